@@ -0,0 +1,260 @@
+""" Admission control: requests past what the server can handle are turned away at once, rather
+than queued until everyone's latency suffers.
+
+Each request belongs to a class of routes (CLASSES, by path; "transform" for the others), and
+    each class lets at most limit requests in at a time. The next ones wait in line, first
+    come first served, and are answered 503 Service Unavailable (with Retry-After) when:
+        queue       max_queue requests are already waiting
+        overload    the first in line has waited more than target seconds: the line is not
+                    moving fast enough for one more to get in on time
+        timeout     it waited timeout seconds itself
+    The operations routes (EXEMPT) are never held back, so that an overloaded server can
+    still be watched.
+
+With a rate, each client (by address) also has a token bucket of burst requests, refilled at
+    rate per second, whatever the class: a client with none left is answered 429 Too Many
+    Requests, with the seconds until its next token in Retry-After.
+
+Admitted and shed requests are counted per class and outcome, and the time spent waiting in
+    line is timed, in the metrics of metrics.py (and in stats(), for GET /admission/stats).
+
+AdmissionMiddleware runs on the event loop, as pure ASGI middleware: turning a request away
+    costs no thread, and reads no more than its path.
+"""
+
+import math
+import time
+import asyncio
+from collections import OrderedDict, deque
+
+import orjson
+
+import metrics
+
+# The class of a request is the first whose prefixes its path starts with
+CLASSES = {
+    "bulk": (
+        "/random/bulk",
+        "/password/bulk",
+        "/batch",
+        "/stream/",
+        "/find_many",
+        "/counterstring/stream/",
+    ),
+    "words": ("/anagrams/", "/subanagrams/", "/suggest/", "/wildcard/"),
+    "storage": ("/storage/",),
+}
+DEFAULT_CLASS = "transform"
+EXEMPT = (
+    "/metrics",
+    "/admission/",
+    "/admin/",
+    "/cache/stats",
+    "/dictionaries/stats",
+    "/profile/",
+    "/robots.txt",
+    "/favicon.ico",
+    "/docs",
+    "/redoc",
+    "/openapi.json",
+)
+DEFAULT_LIMITS = {"transform": 64, "words": 16, "storage": 8, "bulk": 4}
+
+metrics.families.update(
+    {
+        "ttweak_admission_total": (
+            "counter",
+            "Requests admitted or shed by admission control, by class and outcome.",
+        ),
+        "ttweak_admission_wait_seconds": (
+            "histogram",
+            "Time admitted requests waited in line, by class.",
+        ),
+    }
+)
+
+
+def route_class(path):
+    """The class of a path, or None if it is exempt."""
+    if path.startswith(EXEMPT):
+        return None
+    for name, prefixes in CLASSES.items():
+        if path.startswith(prefixes):
+            return name
+    return DEFAULT_CLASS
+
+
+class Rejected(Exception):
+    def __init__(self, status, reason, retry_after):
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Gate:
+    """At most limit requests of a class in at once, and a line of the others."""
+
+    def __init__(self, name, limit, max_queue, target, timeout):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.target = target
+        self.timeout = timeout
+        self.active = 0
+        self._waiting = deque()
+        labels = (("class", name),)
+        outcomes = ("admitted", "queue", "overload", "timeout", "rate")
+        self.counts = dict.fromkeys(outcomes, 0)
+        self._keys = {
+            outcome: ("ttweak_admission_total", labels + (("outcome", outcome),))
+            for outcome in outcomes
+        }
+        self._wait = ("ttweak_admission_wait_seconds", labels)
+
+    def count(self, outcome):
+        # Only counted on the event loop: no lock
+        self.counts[outcome] += 1
+        metrics.registry.inc(*self._keys[outcome])
+
+    async def enter(self):
+        """Waits for a place: raises Rejected if there is none in time."""
+        if self.active < self.limit and not self._waiting:
+            self.active += 1
+            self.count("admitted")
+            return
+        now = time.monotonic()
+        if len(self._waiting) >= self.max_queue:
+            self._reject("queue")
+        if self._waiting and now - self._waiting[0][0] > self.target:
+            self._reject("overload")
+
+        place = asyncio.get_running_loop().create_future()
+        entry = (now, place)
+        self._waiting.append(entry)
+        try:
+            await asyncio.wait_for(place, self.timeout)
+        except asyncio.TimeoutError:
+            # leave() drops the entries it finds done, and may have come first
+            if entry in self._waiting:
+                self._waiting.remove(entry)
+            if not place.done() or place.cancelled():
+                self._reject("timeout")
+            # Given a place just as the wait timed out: it takes it
+        except BaseException:
+            # Cancelled (the client left): a place it was given goes to the next in line
+            if place.done() and not place.cancelled():
+                self.leave()
+            elif entry in self._waiting:
+                self._waiting.remove(entry)
+            raise
+        # leave() passed its place on: active already counts this request
+        self.count("admitted")
+        metrics.registry.observe(*self._wait, time.monotonic() - now)
+
+    def leave(self):
+        while self._waiting:
+            _, place = self._waiting.popleft()
+            if not place.done():
+                place.set_result(None)
+                return
+        self.active -= 1
+
+    def _reject(self, reason):
+        self.count(reason)
+        raise Rejected(503, reason, 1)
+
+    def stats(self):
+        res = {"limit": self.limit, "active": self.active, "waiting": len(self._waiting)}
+        res.update(self.counts)
+        return res
+
+
+class Buckets:
+    """A token bucket per client: burst tokens at most, rate more per second. The clients not
+    seen for the longest are forgotten beyond max_clients (they come back with a full one)."""
+
+    def __init__(self, rate, burst, max_clients=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+
+    def take(self, client):
+        """0 if client had a token (now used), otherwise the seconds until it has one."""
+        now = time.monotonic()
+        tokens, last = self._buckets.pop(client, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        if tokens >= 1:
+            tokens -= 1
+            wait = 0
+        else:
+            wait = (1 - tokens) / self.rate
+        self._buckets[client] = (tokens, now)
+        if len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+class Admission:
+    """The gates of all the classes, and the client buckets (if rate is set)."""
+
+    def __init__(self, limits=None, max_queue=256, target=0.05, timeout=1.0, rate=0, burst=None):
+        limits = dict(DEFAULT_LIMITS, **(limits or {}))
+        self.gates = {
+            name: Gate(name, limit, max_queue, target, timeout) for name, limit in limits.items()
+        }
+        self.buckets = Buckets(rate, burst or max(1, rate)) if rate > 0 else None
+
+    def stats(self):
+        return {name: gate.stats() for name, gate in sorted(self.gates.items())}
+
+
+class AdmissionMiddleware:
+    """ASGI middleware letting requests in as admission (an Admission) allows."""
+
+    def __init__(self, app, admission):
+        self.app = app
+        self.admission = admission
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        name = route_class(scope["path"])
+        if name is None:
+            return await self.app(scope, receive, send)
+        gate = self.admission.gates.get(name) or self.admission.gates[DEFAULT_CLASS]
+
+        try:
+            buckets = self.admission.buckets
+            if buckets is not None:
+                wait = buckets.take((scope.get("client") or ("",))[0])
+                if wait:
+                    gate.count("rate")
+                    raise Rejected(429, "rate", math.ceil(wait))
+            await gate.enter()
+        except Rejected as e:
+            return await reject(send, e)
+        try:
+            return await self.app(scope, receive, send)
+        finally:
+            gate.leave()
+
+
+async def reject(send, rejected):
+    if rejected.status == 429:
+        detail = "Too many requests: retry later"
+    else:
+        detail = f"Server busy ({rejected.reason}): retry later"
+    body = orjson.dumps({"detail": detail})
+    await send(
+        {
+            "type": "http.response.start",
+            "status": rejected.status,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(rejected.retry_after).encode()),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,89 @@
+""" Latency under overload, with and without admission control (see admission.py).
+
+One worker is started on uvicorn, and sent a mix of word searches and transforms:
+    saturation  closed loop (see common.closed_loop): the most requests/s it answers
+    overload    open loop (see common.open_loop_streams) at --factor times that rate, for
+                --seconds: the latency of each request counts from when it was due, as a
+                client sees it
+
+Without admission control the line of requests grows for as long as the overload lasts, and so
+    does everyone's latency. With it, the requests past what the server keeps up with are
+    answered 503 at once, and the others are served in about the time they take.
+
+    python benchmarks/bench_admission.py [--seconds S] [--factor 2]
+"""
+
+import asyncio
+import argparse
+
+from common import closed_loop, launch_server, open_loop_streams, percentile
+
+# Mostly sub-anagrams (a couple of milliseconds of NumPy each), and a few quick ones
+PATHS = [
+    "/subanagrams/abcdefghijklmnop",
+    "/subanagrams/etaoinshrdlu",
+    "/upper/hello",
+    "/subanagrams/qwertyuiopasd",
+    "/subanagrams/zxcvbnmlkjhgf",
+    "/suggest/speling",
+    "/subanagrams/mnbvcxzasdfgh",
+    "/anagrams/listen",
+]
+
+
+def warm_up(url):
+    import urllib.request
+
+    for path in PATHS:
+        urllib.request.urlopen(url + path, timeout=60).read()
+
+
+def saturation(seconds):
+    process, url = launch_server(env={"TTWEAK_ADMISSION": "0"})
+    try:
+        warm_up(url)
+        samples, elapsed = asyncio.run(closed_loop(url, PATHS, 32, seconds))
+        return len(samples) / elapsed
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def overload(env, rate, seconds):
+    process, url = launch_server(env=env)
+    try:
+        warm_up(url)
+        samples = asyncio.run(open_loop_streams(url, PATHS, rate, seconds))
+    finally:
+        process.terminate()
+        process.wait()
+    ok = [latency for _, status, latency in samples if status == 200]
+    shed = [latency for _, status, latency in samples if status == 503]
+    others = len(samples) - len(ok) - len(shed)
+    return (
+        len(ok),
+        percentile(ok, 50),
+        percentile(ok, 99),
+        len(shed),
+        others,
+        percentile(shed, 99),
+    )
+
+
+def main(options):
+    rate = saturation(options.seconds)
+    target = rate * options.factor
+    print(f"saturation: {rate:.0f} requests/s; overload at {options.factor:g}x: {target:.0f}/s")
+    header = ("admission", "ok", "p50 ms", "p99 ms", "shed", "shed p99", "errors")
+    print("{:<11}{:>8}{:>10}{:>10}{:>8}{:>10}{:>8}".format(*header))
+    for name, env in (("off", {"TTWEAK_ADMISSION": "0"}), ("on", {})):
+        ok, p50, p99, shed, errors, shed_p99 = overload(env, target, options.seconds)
+        print(f"{name:<11}{ok:>8}{p50 * 1000:>10.1f}{p99 * 1000:>10.1f}{shed:>8}"
+              f"{shed_p99 * 1000:>10.1f}{errors:>8}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="T-Tweak latency under overload")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--factor", type=float, default=2)
+    main(parser.parse_args())
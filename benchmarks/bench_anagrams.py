@@ -0,0 +1,63 @@
+""" Compares the anagram dictionary (words.words) with the packed, mmap'd index (words.idx).
+
+Each mode runs in a fresh interpreter, so the numbers include the cold start a new worker pays:
+    import, first lookup, and the peak resident memory of the process. Then it times the
+    per-request lookup path of both: copying the dict versus searching the index.
+
+    python benchmarks/bench_anagrams.py
+"""
+
+import os
+import sys
+import json
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import json, resource, time, timeit
+t0 = time.perf_counter()
+import words
+if MODE == "dict":
+    lookup = lambda key: words.words.copy().get(key, []).copy()
+else:
+    index = words.open_index()
+    lookup = lambda key: index.get(key, [])
+first = lookup(words.anagram_key("listen"))
+cold = time.perf_counter() - t0
+keys = [words.anagram_key(w) for w in ("listen", "stone", "angel", "zzzzzz", "enlist")]
+n = 20 if MODE == "dict" else 20000
+per_call = timeit.timeit(lambda: [lookup(k) for k in keys], number=n) / (n * len(keys))
+print(json.dumps({
+    "mode": MODE,
+    "cold_start_ms": cold * 1000,
+    "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "lookup_us": per_call * 1e6,
+    "first": first,
+}))
+"""
+
+
+def run(mode):
+    out = subprocess.run(
+        [sys.executable, "-c", f"MODE = {mode!r}\n{PROBE}"],
+        cwd=ROOT,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return json.loads(out.stdout)
+
+
+if __name__ == "__main__":
+    # Build the index once up front: that is the build step, not a per-process cost
+    subprocess.run([sys.executable, "words.py"], cwd=ROOT, check=True, capture_output=True)
+
+    results = [run("dict"), run("index")]
+    assert results[0]["first"] == results[1]["first"]
+
+    print(f"{'mode':<8}{'cold start (ms)':>18}{'max rss (MB)':>15}{'lookup (us)':>14}")
+    for r in results:
+        print(
+            f"{r['mode']:<8}{r['cold_start_ms']:>18.1f}{r['max_rss_mb']:>15.1f}{r['lookup_us']:>14.1f}"
+        )
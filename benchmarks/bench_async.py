@@ -0,0 +1,80 @@
+""" Throughput of the tweak routes at 1, 50, 200 and 1000 concurrent clients, before and after.
+
+"before" is another revision of the repo (by default HEAD, exported to a temporary
+    directory with git archive), "after" is the working tree. Each is started on uvicorn
+    with one worker, and the clients (see common.closed_loop) cycle through the tweaks.
+
+    python benchmarks/bench_async.py [--before REV] [--seconds S] [--clients 1,50,200,1000]
+
+The clients run on the same machine, in one process: with few cores they take their share
+    of the CPU, and the curve flattens sooner than it would with a separate load generator.
+"""
+
+import os
+import asyncio
+import tarfile
+import argparse
+import tempfile
+import subprocess
+
+from common import ROOT, closed_loop, launch_server, percentile
+
+PATHS = [
+    "/reverse/Hello%20World",
+    "/upper/hello",
+    "/tolower/HELLO",
+    "/mix_case/hello%20world",
+    "/length/abcdef",
+    "/password/Passw0rd1234",
+    "/counterstring/50/*",
+    "/anagrams/listen",
+    "/find/abababab/ab",
+    "/substring/abcdefgh/2/5",
+    "/random?length=20",
+]
+
+
+def export(rev):
+    """Extracts revision rev of the repo into a temporary directory."""
+    tree = tempfile.mkdtemp(prefix="ttweak-before-")
+    archive = subprocess.run(["git", "archive", rev], cwd=ROOT, capture_output=True, check=True)
+    with tempfile.TemporaryFile() as tar:
+        tar.write(archive.stdout)
+        tar.seek(0)
+        tarfile.open(fileobj=tar).extractall(tree)
+    return tree
+
+
+def curve(root, clients, seconds):
+    process, url = launch_server(root=root)
+    try:
+        points = []
+        for n in clients:
+            samples, elapsed = asyncio.run(closed_loop(url, PATHS, n, seconds))
+            ok = [latency for _, status, latency in samples if status == 200]
+            points.append((n, len(samples) / elapsed, percentile(ok, 50), percentile(ok, 99),
+                           len(samples) - len(ok)))
+        return points
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main(options):
+    clients = [int(n) for n in options.clients.split(",")]
+    results = {
+        f"before ({options.before})": curve(export(options.before), clients, options.seconds),
+        "after": curve(ROOT, clients, options.seconds),
+    }
+    print(f"{'tree':<16}{'clients':>8}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for tree, points in results.items():
+        for n, rate, p50, p99, errors in points:
+            print(f"{tree:<16}{n:>8}{rate:>10.0f}{p50 * 1000:>10.1f}{p99 * 1000:>10.1f}{errors:>8}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--before", default="HEAD", help="revision to compare with")
+    parser.add_argument("--seconds", type=float, default=5, help="duration of each point")
+    parser.add_argument("--clients", default="1,50,200,1000", help="concurrent clients")
+    main(parser.parse_args())
@@ -0,0 +1,44 @@
+""" One POST /batch with many texts versus one GET per text, both through the TestClient.
+
+    python benchmarks/bench_batch.py [items]
+"""
+
+import sys
+import time
+import random
+import string
+import warnings
+
+from common import use_scratch_dir
+
+use_scratch_dir()
+warnings.simplefilter("ignore")
+
+from fastapi.testclient import TestClient
+
+import main
+
+
+def main_bench(n):
+    client = TestClient(main.app)
+    texts = ["".join(random.choices(string.ascii_letters, k=random.randint(1, 100))) for _ in range(n)]
+
+    t0 = time.perf_counter()
+    singles = [client.get(f"/reverse/{text}").json()["res"] for text in texts]
+    single_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    batched = client.post("/batch", json={"op": "reverse", "items": texts}).json()["res"]
+    batch_s = time.perf_counter() - t0
+
+    assert singles == batched
+
+    print(f"{n} reverse tweaks")
+    print(f"{'mode':<12}{'total (s)':>12}{'per item (us)':>16}")
+    for name, total in (("GET each", single_s), ("POST /batch", batch_s)):
+        print(f"{name:<12}{total:>12.3f}{total / n * 1e6:>16.1f}")
+    print(f"speedup: {single_s / batch_s:.0f}x")
+
+
+if __name__ == "__main__":
+    main_bench(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,130 @@
+""" Calls/s of the client (ttweak_client.py) at different pool sizes, against ad-hoc requests.
+
+One worker is started on uvicorn (admission control off), and called for --seconds with
+    /upper on many texts, in a closed loop: each caller makes its next call as soon as the
+    last one is answered.
+    requests.get    one call at a time, each on a new connection, as ad-hoc scripts do
+    Client          one thread per connection of the pool
+    AsyncClient     one task per connection of the pool
+    batched         AsyncClient with a batch_window of --window seconds, and --callers
+                    tasks (many more than connections): their calls go in POST /batch
+
+The server and the client share the machine's CPUs, as on a developer's laptop: the numbers
+    are for comparing the clients, not for sizing a server.
+
+    python benchmarks/bench_client.py [--seconds S] [--window W] [--callers N]
+"""
+
+import sys
+import time
+import asyncio
+import argparse
+import threading
+
+from common import ROOT, launch_server, percentile
+
+sys.path.insert(0, ROOT)
+
+import ttweak_client
+
+POOLS = (1, 4, 16, 64)
+TEXTS = [f"text{i}" for i in range(1000)]
+
+
+def ad_hoc(url, seconds):
+    import requests
+
+    latencies = []
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        t0 = time.perf_counter()
+        requests.get(f"{url}/upper/{TEXTS[len(latencies) % len(TEXTS)]}").json()
+        latencies.append(time.perf_counter() - t0)
+    return latencies, len(latencies)
+
+
+def threaded(url, pool, seconds):
+    latencies = []
+    with ttweak_client.Client(url, max_connections=pool) as t:
+        deadline = time.perf_counter() + seconds
+
+        def caller(n):
+            found = []
+            while time.perf_counter() < deadline:
+                t0 = time.perf_counter()
+                t.upper(TEXTS[(n + len(found) * pool) % len(TEXTS)])
+                found.append(time.perf_counter() - t0)
+            latencies.extend(found)
+
+        threads = [threading.Thread(target=caller, args=(n,)) for n in range(pool)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return latencies, t.sent
+
+
+async def tasks(url, pool, seconds, callers=None, window=None):
+    latencies = []
+    callers = callers or pool
+    async with ttweak_client.AsyncClient(url, max_connections=pool, batch_window=window) as t:
+        deadline = time.perf_counter() + seconds
+
+        async def caller(n):
+            i = n
+            while time.perf_counter() < deadline:
+                t0 = time.perf_counter()
+                await t.upper(TEXTS[i % len(TEXTS)])
+                latencies.append(time.perf_counter() - t0)
+                i += callers
+
+        await asyncio.gather(*[caller(n) for n in range(callers)])
+        return latencies, t.sent
+
+
+def main(options):
+    process, url = launch_server(env={"TTWEAK_ADMISSION": "0"})
+    try:
+        # Warmed up: the cache of /upper holds all the texts
+        with ttweak_client.Client(url) as t:
+            t.batch("upper", TEXTS)
+            for text in TEXTS:
+                t.upper(text)
+
+        seconds = options.seconds
+        runs = [("requests.get", 1, lambda: ad_hoc(url, seconds))]
+        for pool in POOLS:
+            runs.append(("Client", pool, lambda pool=pool: threaded(url, pool, seconds)))
+        for pool in POOLS:
+            runs.append(
+                ("AsyncClient", pool, lambda pool=pool: asyncio.run(tasks(url, pool, seconds)))
+            )
+        for pool in POOLS[:3]:
+            runs.append(
+                (
+                    "batched",
+                    pool,
+                    lambda pool=pool: asyncio.run(
+                        tasks(url, pool, seconds, options.callers, options.window)
+                    ),
+                )
+            )
+
+        header = ("client", "pool", "calls/s", "requests/s", "p50 ms", "p99 ms")
+        print("{:<14}{:>6}{:>10}{:>12}{:>10}{:>10}".format(*header))
+        for name, pool, run in runs:
+            latencies, sent = run()
+            calls, requests = len(latencies) / seconds, sent / seconds
+            p50, p99 = percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000
+            print(f"{name:<14}{pool:>6}{calls:>10.0f}{requests:>12.0f}{p50:>10.2f}{p99:>10.2f}")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="T-Tweak client calls/s by pool size")
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--window", type=float, default=0.002)
+    parser.add_argument("--callers", type=int, default=256)
+    main(parser.parse_args())
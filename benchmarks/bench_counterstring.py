@@ -0,0 +1,43 @@
+""" The original counterstring algorithm (string concatenation) versus tweaks.counterstring.
+
+    python benchmarks/bench_counterstring.py
+"""
+
+import sys
+import time
+
+from common import ROOT
+
+sys.path.insert(0, ROOT)
+
+import tweaks
+
+
+def concatenating(length, char):
+    counterstring = ""
+    while length > 0:
+        next_count = char + str(length)[::-1]
+        if len(next_count) > length:
+            next_count = next_count[:length]
+        counterstring = counterstring + next_count
+        length -= len(next_count)
+    return counterstring[::-1]
+
+
+def timed(fn, *args):
+    t0 = time.perf_counter()
+    res = fn(*args)
+    return time.perf_counter() - t0, res
+
+
+if __name__ == "__main__":
+    print(f"{'length':>10}{'concat (ms)':>14}{'linear (ms)':>14}{'chunks (ms)':>14}")
+    for length in (150, 10**3, 10**4, 10**5, 10**6, 10**7):
+        if length <= 10**5:
+            concat_s, expected = timed(concatenating, length, "*")
+        else:
+            concat_s, expected = float("nan"), None
+        linear_s, res = timed(tweaks.counterstring, length, "*")
+        chunks_s, _ = timed(lambda: sum(len(c) for c in tweaks.counterstring_chunks(length, "*")))
+        assert expected in (None, res)
+        print(f"{length:>10}{concat_s * 1000:>14.2f}{linear_s * 1000:>14.2f}{chunks_s * 1000:>14.2f}")
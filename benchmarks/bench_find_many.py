@@ -0,0 +1,62 @@
+""" search.find_many (one Aho-Corasick pass) versus the /find loop called once per needle.
+
+    python benchmarks/bench_find_many.py [megabytes] [needles]
+"""
+
+import sys
+import time
+import random
+import string
+
+from common import ROOT
+
+sys.path.insert(0, ROOT)
+
+import search
+
+
+def find_loop(text, sub):
+    # The loop of main.find, without the web server around it
+    here = 0
+    res = []
+    while True:
+        here = text.find(sub, here)
+        if here == -1:
+            break
+        res.append(here)
+        here += 1
+    return res
+
+
+if __name__ == "__main__":
+    megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+
+    random.seed(67778)
+    text = "".join(random.choices(string.ascii_lowercase[:8], k=megabytes * 2**20))
+    needles = {"".join(random.choices(string.ascii_lowercase[:8], k=random.randint(4, 10))) for _ in range(n)}
+    needles = sorted(needles)
+
+    t0 = time.perf_counter()
+    looped = {needle: find_loop(text, needle) for needle in needles}
+    loop_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    search.Automaton(needles)
+    build_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    found = search.find_many(text, needles)
+    search_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    search.find_many(text, needles)
+    cached_s = time.perf_counter() - t0
+
+    assert looped == found
+    matches = sum(len(v) for v in found.values())
+    print(f"{len(needles)} needles over {megabytes} MB, {matches} matches")
+    print(f"find loop per needle      {loop_s:8.2f} s")
+    print(f"automaton build           {build_s:8.2f} s")
+    print(f"find_many (uncached)      {search_s:8.2f} s")
+    print(f"find_many (cached)        {cached_s:8.2f} s")
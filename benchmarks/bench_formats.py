@@ -0,0 +1,64 @@
+""" Size and encode time of large lists, in each response format.
+
+    json (stdlib)   what JSONResponse did for every route before formats.py
+    json (orjson)   the default format now
+    msgpack         application/msgpack
+    frames          application/vnd.ttweak.frames
+
+The lists are {"res": [...]} of dictionary words (strings), and of positions (integers), as
+    /anagrams, /history and /find answer, at a few sizes.
+
+    python benchmarks/bench_formats.py
+"""
+
+import os
+import sys
+import json
+import time
+import random
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import formats
+
+
+def stdlib_json(content):
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+ENCODERS = {
+    "json (stdlib)": stdlib_json,
+    "json (orjson)": formats.encoders[formats.JSON],
+    "msgpack": formats.encoders[formats.MSGPACK],
+    "frames": formats.encoders[formats.FRAMES],
+}
+
+
+def timed(fn, content):
+    repeat = max(3, int(2e6 // len(content["res"])))
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        body = fn(content)
+    return (time.perf_counter() - t0) / repeat, len(body)
+
+
+def main():
+    with open(os.path.join(ROOT, "words.txt")) as f:
+        words = [w.strip() for w in f]
+    random.seed(1)
+    cases = []
+    for n in (1000, 100_000):
+        cases.append((f"{n} words", {"res": random.sample(words, n)}))
+    for n in (1000, 100_000):
+        cases.append((f"{n} ints", {"res": sorted(random.sample(range(10**7), n))}))
+
+    print(f"{'list':<14}{'format':<16}{'bytes':>12}{'encode ms':>12}{'MB/s':>9}")
+    for name, content in cases:
+        for fmt, fn in ENCODERS.items():
+            seconds, size = timed(fn, content)
+            print(f"{name:<14}{fmt:<16}{size:>12}{seconds * 1000:>12.3f}{size / seconds / 1e6:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
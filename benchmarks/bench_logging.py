@@ -0,0 +1,102 @@
+""" Request-path latency of log_count_history: files rewritten per call versus the LogWriter.
+
+"rewrite" is the previous implementation (read the whole file, append, rewrite under flock)
+    for the log, the history and the count. "writer" is writer.LogWriter, whose calls only
+    touch memory, plus the shared counter of counter.py; the writer's final flush is timed
+    separately. Both write into a temporary directory.
+
+    python benchmarks/bench_logging.py [calls]
+"""
+
+import os
+import sys
+import time
+import fcntl
+import datetime
+import tempfile
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from writer import LogWriter
+from counter import open_counter
+
+
+def rewrite_log_count_history(log_file, hist_file, count_file, msg):
+    items = []
+    if os.path.isfile(log_file):
+        with open(log_file, "r") as l:
+            items = l.readlines()
+    items.append(f"{datetime.datetime.now().strftime('%c')} {str(msg)}\n")
+    with open(log_file, "w") as l:
+        fcntl.flock(l, fcntl.LOCK_EX)
+        l.writelines(items[-250:])
+        fcntl.flock(l, fcntl.LOCK_UN)
+
+    hist = []
+    if os.path.isfile(hist_file):
+        with open(hist_file, "r") as h:
+            hist = h.readlines()
+    hist.append(f"{msg}\n")
+    with open(hist_file, "w") as h:
+        fcntl.flock(h, fcntl.LOCK_EX)
+        h.writelines(hist[-50:])
+        fcntl.flock(h, fcntl.LOCK_UN)
+
+    cnt = 0
+    if os.path.isfile(count_file):
+        with open(count_file, "r") as c:
+            r = c.read()
+            cnt = int(r) if r.isnumeric() else 0
+    with open(count_file, "w+") as c:
+        fcntl.flock(c, fcntl.LOCK_EX)
+        c.write(str(cnt + 1))
+        fcntl.flock(c, fcntl.LOCK_UN)
+
+
+def timed(fn, calls):
+    samples = []
+    for i in range(calls):
+        t0 = time.perf_counter()
+        fn(f"reverse text{i}")
+        samples.append(time.perf_counter() - t0)
+    samples.sort()
+    return {
+        "mean_us": statistics.fmean(samples) * 1e6,
+        "p50_us": samples[len(samples) // 2] * 1e6,
+        "p99_us": samples[int(len(samples) * 0.99)] * 1e6,
+    }
+
+
+def main(calls):
+    with tempfile.TemporaryDirectory() as tmp:
+        files = [os.path.join(tmp, f"rewrite.{ext}") for ext in ("log", "txt", "cnt")]
+        rewrite = timed(lambda msg: rewrite_log_count_history(*files, msg), calls)
+
+        files = [os.path.join(tmp, name) for name in ("writer.log", "writer.history")]
+        w = LogWriter(*files).start()
+        c = open_counter("journal", os.path.join(tmp, "writer.cnt"))
+
+        def enqueue(msg):
+            w.log(msg)
+            w.history(msg)
+            c.add(1)
+
+        background = timed(enqueue, calls)
+        t0 = time.perf_counter()
+        w.flush()
+        flush_ms = (time.perf_counter() - t0) * 1000
+
+        assert c.get() == calls
+        assert len(w.history()) == 50
+
+    print(f"{calls} calls of log + history + count")
+    print(f"{'mode':<10}{'mean (us)':>12}{'p50 (us)':>12}{'p99 (us)':>12}")
+    for name, r in (("rewrite", rewrite), ("writer", background)):
+        print(f"{name:<10}{r['mean_us']:>12.1f}{r['p50_us']:>12.1f}{r['p99_us']:>12.1f}")
+    print(f"writer final flush: {flush_ms:.1f} ms")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
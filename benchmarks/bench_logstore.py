@@ -0,0 +1,70 @@
+""" Appends and tail queries of the segmented log, as the retained volume grows.
+
+For each volume, the log is filled with history-like entries (in batches of 100, as the
+    writer flushes them), then it times:
+        append      one more batch of 1 and of 100 entries (entries per second)
+        open        a new process' first query, which builds its index of the segments
+        tail 50     the last 50 entries, and the 50 before the last 5000 (page 100)
+        readlines   the last 50 from a single file read whole, as the history used to be
+
+    python benchmarks/bench_logstore.py [largest volume]
+"""
+
+import os
+import sys
+import time
+import tempfile
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from logstore import SegmentedLog
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    return statistics.median(samples)
+
+
+def entries(start, n):
+    return [f"reverse some text to tweak {i}" for i in range(start, start + n)]
+
+
+def main(largest):
+    volumes = [v for v in (10_000, 100_000, 1_000_000, 10_000_000) if v <= largest]
+    print(f"{'entries':>10}{'segments':>10}{'append 1/s':>12}{'append 100/s':>14}"
+          f"{'open ms':>9}{'tail us':>9}{'page 100 us':>13}{'readlines us':>14}")
+    for volume in volumes:
+        with tempfile.TemporaryDirectory() as tmp:
+            log = SegmentedLog(tmp, segment_bytes=4 * 2**20, max_segments=1000)
+            flat = os.path.join(tmp, "history.txt")
+            with open(flat, "w") as f:
+                for i in range(0, volume, 100):
+                    batch = entries(i, 100)
+                    log.append(batch)
+                    f.writelines(e + "\n" for e in batch)
+
+            one = timed(lambda: log.append(entries(0, 1)), 200)
+            hundred = timed(lambda: log.append(entries(0, 100)), 200)
+            opened = timed(lambda: len(SegmentedLog(tmp)), 3)
+            tail = timed(lambda: log.tail(50), 200)
+            page = timed(lambda: log.tail(50, skip=5000), 200)
+
+            def readlines():
+                with open(flat) as f:
+                    return f.readlines()[-50:]
+
+            flat_tail = timed(readlines, 3 if volume > 100_000 else 20)
+            print(
+                f"{volume:>10}{log.stats()['segments']:>10}{1 / one:>12.0f}{100 / hundred:>14.0f}"
+                f"{opened * 1000:>9.1f}{tail * 1e6:>9.1f}{page * 1e6:>13.1f}{flat_tail * 1e6:>14.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -0,0 +1,90 @@
+""" What the metrics of metrics.py cost per request.
+
+Two apps with the same trivial async route, one with plain APIRoutes and one with
+    MetricsRoute, are called straight through ASGI (no client, no sockets) many times; the
+    difference is the instrumentation. The registry's own operations are timed too.
+
+    python benchmarks/bench_metrics.py [requests]
+"""
+
+import os
+import sys
+import time
+import asyncio
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fastapi import FastAPI, Path
+from fastapi.responses import JSONResponse
+
+import metrics
+
+
+def make_app(route_class):
+    app = FastAPI()
+    if route_class is not None:
+        app.router.route_class = route_class
+
+    @app.get("/reverse/{text}")
+    async def reverse(text: str = Path(..., max_length=100)):
+        return JSONResponse(content={"res": text[::-1]})
+
+    return app
+
+
+async def call(app, n):
+    scope = {
+        "type": "http",
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/reverse/abcdef",
+        "raw_path": b"/reverse/abcdef",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [],
+        "server": ("test", 80),
+        "client": ("test", 1),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    # Warm up, then time
+    for _ in range(1000):
+        await app(dict(scope), receive, send)
+    t0 = time.perf_counter()
+    for _ in range(n):
+        await app(dict(scope), receive, send)
+    return (time.perf_counter() - t0) / n
+
+
+def main(n):
+    plain = min(asyncio.run(call(make_app(None), n)) for _ in range(3))
+    measured = min(asyncio.run(call(make_app(metrics.MetricsRoute), n)) for _ in range(3))
+
+    registry = metrics.Registry()
+    labels = (("route", "/reverse/{text}"), ("status", "200"))
+    t0 = time.perf_counter()
+    for _ in range(n):
+        registry.inc("ttweak_requests_total", labels)
+    inc = (time.perf_counter() - t0) / n
+    t0 = time.perf_counter()
+    for _ in range(n):
+        registry.observe("ttweak_request_duration_seconds", labels, 0.0003)
+    observe = (time.perf_counter() - t0) / n
+
+    print(f"{n} requests, called through ASGI")
+    print(f"{'app':<16}{'per request (us)':>18}")
+    print(f"{'APIRoute':<16}{plain * 1e6:>18.2f}")
+    print(f"{'MetricsRoute':<16}{measured * 1e6:>18.2f}")
+    print(f"overhead: {(measured - plain) * 1e6:.2f} us per request")
+    print(f"registry.inc: {inc * 1e6:.2f} us, registry.observe: {observe * 1e6:.2f} us")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,44 @@
+""" Passwords scored per second: strength.scores versus one main.password_strength per password.
+
+The per-request path is timed by calling the route function directly (logging included, the
+    HTTP layer excluded), so the comparison is generous to it.
+
+    python benchmarks/bench_password.py [passwords]
+"""
+
+import sys
+import json
+import time
+import random
+import warnings
+
+from common import call_inline, use_scratch_dir
+
+use_scratch_dir()
+warnings.simplefilter("ignore")
+
+import main
+import strength
+
+ALPHABET = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789!@#$%"
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    random.seed(67778)
+    passwords = ["".join(random.choices(ALPHABET, k=random.randint(6, 22))) for _ in range(n)]
+
+    sample = passwords[: min(n, 20000)]
+    password_strength = call_inline(main.password_strength)
+    t0 = time.perf_counter()
+    single = [json.loads(password_strength(p).body)["res"] for p in sample]
+    single_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    bulk = strength.scores(passwords)
+    bulk_s = time.perf_counter() - t0
+
+    assert single == bulk[: len(sample)].tolist()
+    print(f"{'path':<22}{'passwords':>12}{'seconds':>10}{'passwords/s':>14}")
+    print(f"{'password_strength':<22}{len(sample):>12}{single_s:>10.2f}{len(sample) / single_s:>14,.0f}")
+    print(f"{'strength.scores':<22}{n:>12}{bulk_s:>10.2f}{n / bulk_s:>14,.0f}")
@@ -0,0 +1,47 @@
+""" Random strings: the "random" module, as /random used to make them, versus the streams of rng.
+
+    single  one string of 10 and of 150 characters per call, as /random makes them
+    bulk    count strings of 10 characters at once, as /random/bulk makes them
+
+    python benchmarks/bench_random.py [count]
+"""
+
+import os
+import sys
+import time
+import random
+import string
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import rng
+
+
+def per_call(fn, calls=20000):
+    t0 = time.perf_counter()
+    for i in range(calls):
+        fn(i)
+    return (time.perf_counter() - t0) / calls
+
+
+def main(count):
+    alphabet = string.ascii_letters + string.digits
+    print(f"{'single':<10}{'length':>8}{'random (us)':>14}{'rng (us)':>12}")
+    for length in (10, 150):
+        choices = per_call(lambda i: "".join(random.choices(alphabet, k=length)))
+        streams = per_call(lambda i: rng.text(5, i * length, length))
+        print(f"{'':<10}{length:>8}{choices * 1e6:>14.2f}{streams * 1e6:>12.2f}")
+
+    t0 = time.perf_counter()
+    ["".join(random.choices(alphabet, k=10)) for _ in range(count)]
+    choices = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for _ in rng.lines(5, 0, count, 10):
+        pass
+    streamed = time.perf_counter() - t0
+    print(f"bulk of {count} x 10: random {choices * 1000:.0f} ms, rng lines {streamed * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -0,0 +1,94 @@
+""" Latency of /anagrams while the dictionary is reloaded, against the same load without reloads.
+
+One worker is started on uvicorn, with a copy of words.txt of its own. The clients (see
+    common.closed_loop) cycle through anagram lookups of many words, first with no reload,
+    then while another thread reloads the dictionary back to back: it changes words.txt
+    (adds or removes one word), POSTs /admin/dictionary/reload and waits for the new
+    version, over and over. Each reload builds the whole index again.
+
+    python benchmarks/bench_reload.py [--seconds S] [--clients N]
+"""
+
+import os
+import json
+import shutil
+import asyncio
+import argparse
+import threading
+import urllib.request
+
+from common import ROOT, closed_loop, launch_server, percentile
+
+TOKEN = "bench"
+EXTRA_WORD = "zyzzyvaq\n"
+
+
+def admin(url, path, method="GET"):
+    request = urllib.request.Request(url + path, method=method, headers={"X-Admin-Token": TOKEN})
+    with urllib.request.urlopen(request, timeout=30) as r:
+        return json.load(r)["res"]
+
+
+def reload_loop(url, src, stop, done):
+    """Changes src and reloads the dictionary, until stop is set. Appends each version to done."""
+    with open(src) as f:
+        original = f.read()
+    while not stop.is_set():
+        with open(src, "w") as f:
+            f.write(original if len(done) % 2 else original + EXTRA_WORD)
+        version = admin(url, "/admin/dictionary")["version"]
+        admin(url, "/admin/dictionary/reload", "POST")
+        while not stop.wait(0.02):
+            info = admin(url, "/admin/dictionary")
+            if not info["reloading"]:
+                if info["version"] > version:
+                    done.append(info)
+                break
+
+
+def run(url, paths, clients, seconds):
+    samples, elapsed = asyncio.run(closed_loop(url, paths, clients, seconds))
+    ok = [latency for _, status, latency in samples if status == 200]
+    return len(samples) / elapsed, percentile(ok, 50), percentile(ok, 99), len(samples) - len(ok)
+
+
+def main(options):
+    with open(os.path.join(ROOT, "words.txt")) as f:
+        found = (w.strip() for w in f.readlines()[::97])
+        paths = [f"/anagrams/{w}" for w in found if w.isascii() and w.isalpha()]
+    env = {"TTWEAK_ADMIN_TOKEN": TOKEN, "TTWEAK_DICTIONARY_POLL": "0"}
+    process, url = launch_server(env=env)
+    try:
+        # The server's words.txt is a link to the repo's: changed here, on a copy
+        scratch = os.readlink(f"/proc/{process.pid}/cwd")
+        src = os.path.join(scratch, "words.txt")
+        os.unlink(src)
+        shutil.copy(os.path.join(ROOT, "words.txt"), src)
+        urllib.request.urlopen(url + paths[0]).read()
+
+        print(f"{'load':<12}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}{'reloads':>9}")
+        rate, p50, p99, errors = run(url, paths, options.clients, options.seconds)
+        print(f"{'no reload':<12}{rate:>10.0f}{p50 * 1000:>10.2f}{p99 * 1000:>10.2f}{errors:>8}{0:>9}")
+
+        stop, done = threading.Event(), []
+        reloader = threading.Thread(target=reload_loop, args=(url, src, stop, done))
+        reloader.start()
+        try:
+            rate, p50, p99, errors = run(url, paths, options.clients, options.seconds)
+        finally:
+            stop.set()
+            reloader.join()
+        print(f"{'reloading':<12}{rate:>10.0f}{p50 * 1000:>10.2f}{p99 * 1000:>10.2f}{errors:>8}{len(done):>9}")
+        if done:
+            builds = sorted(info["build_seconds"] for info in done)
+            print(f"median build of the index: {builds[len(builds) // 2] * 1000:.0f} ms")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="T-Tweak latency during dictionary reloads")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--clients", type=int, default=20)
+    main(parser.parse_args())
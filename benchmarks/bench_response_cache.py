@@ -0,0 +1,81 @@
+""" Skewed traffic on the pure tweaks, with and without the response cache, through the TestClient.
+
+Requests pick among a few hundred texts with Zipf-like weights, as the real traffic does.
+    "no cache" sets every route's limit to 0, so nothing is ever stored. The same calls are
+    also timed straight on the route functions, without the HTTP round trip of the TestClient
+    (which costs more than most tweaks).
+
+    python benchmarks/bench_response_cache.py [requests]
+"""
+
+import sys
+import time
+import random
+import string
+import warnings
+
+from common import call_inline, use_scratch_dir
+
+use_scratch_dir()
+warnings.simplefilter("ignore")
+
+from fastapi.testclient import TestClient
+
+import main
+from cache import ResponseCache
+
+
+def run(client, paths):
+    t0 = time.perf_counter()
+    for path in paths:
+        client.get(path)
+    return time.perf_counter() - t0
+
+
+def run_direct(calls):
+    t0 = time.perf_counter()
+    for fn, args in calls:
+        fn(*args)
+    return time.perf_counter() - t0
+
+
+def main_bench(n):
+    random.seed(1)
+    texts = ["".join(random.choices(string.ascii_lowercase, k=random.randint(5, 40))) for _ in range(300)]
+    weights = [1 / (rank + 1) for rank in range(len(texts))]
+    routes = ["reverse", "upper", "mix_case", "anagrams", "counterstring/150"]
+    requests = list(zip(random.choices(routes, k=n), random.choices(texts, weights, k=n)))
+    paths = [f"/{route}/{text[0] if route.startswith('counter') else text}" for route, text in requests]
+    functions = {
+        "reverse": call_inline(main.reverse),
+        "upper": call_inline(main.upper),
+        "mix_case": call_inline(main.mix_case),
+        # Called directly, the default of a Query parameter has to be given
+        "anagrams": lambda text: call_inline(main.anagrams)(text, main.default_dictionary),
+    }
+    calls = [
+        (call_inline(main.counterstring), (150, text[0])) if route.startswith("counter") else (functions[route], (text,))
+        for route, text in requests
+    ]
+
+    client = TestClient(main.app)
+    client.get("/anagrams/warmup")
+
+    results = {}
+    for mode, size in (("no cache", 0), ("cache", 4 * 2**20)):
+        main.responses = ResponseCache(default_bytes=size)
+        http = run(client, paths)
+        main.responses = ResponseCache(default_bytes=size)
+        direct = run_direct(calls)
+        results[mode] = (http, direct)
+    stats = main.responses.stats()["total"]
+
+    print(f"{n} requests over {len(texts)} texts and {len(routes)} routes")
+    print(f"{'mode':<10}{'HTTP (us/req)':>15}{'handler (us/call)':>20}")
+    for name, (http, direct) in results.items():
+        print(f"{name:<10}{http / n * 1e6:>15.1f}{direct / n * 1e6:>20.1f}")
+    print(f"hit rate {stats['hit_rate']:.1%}, {stats['entries']} entries, {stats['bytes']} bytes")
+
+
+if __name__ == "__main__":
+    main_bench(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
@@ -0,0 +1,104 @@
+""" Cold starts: time to the first response of a fresh interpreter, as on a new Vercel instance.
+
+Each run starts uvicorn on main:app in a new process (with VERCEL=1, as in production), from
+    a scratch directory, and times:
+        first /          from the start of the process to the answer of GET /
+        first anagrams   GET /anagrams/{text} right after, which opens the anagram index
+        next anagrams    the same request again, warm
+    with the prebuilt index (words.idx, shipped with the code) and without it (built from
+    words.txt on the first anagram request, as every cold start used to).
+
+    python benchmarks/bench_startup.py [--runs 5] [--importtime FILE]
+
+--importtime also writes the import profile of main (python -X importtime), largest first:
+    benchmarks/importtime.txt is one, kept in the repo as the reference.
+"""
+
+import os
+import sys
+import time
+import socket
+import argparse
+import statistics
+import subprocess
+import http.client
+
+from common import ROOT, free_port, use_scratch_dir
+
+
+def get(port, path):
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    t0 = time.perf_counter()
+    connection.request("GET", path)
+    response = connection.getresponse()
+    response.read()
+    connection.close()
+    assert response.status == 200, (path, response.status)
+    return time.perf_counter() - t0
+
+
+def cold_start(prebuilt, text="listen"):
+    scratch = use_scratch_dir()
+    if prebuilt:
+        os.symlink(os.path.join(ROOT, "words.idx"), os.path.join(scratch, "words.idx"))
+    port = free_port()
+    env = dict(os.environ, PYTHONPATH=ROOT, VERCEL="1")
+    cmd = [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"]
+    t0 = time.perf_counter()
+    process = subprocess.Popen(cmd, cwd=scratch, env=env)
+    try:
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                break
+            except OSError:
+                if process.poll() is not None:
+                    raise RuntimeError("the server didn't start")
+                time.sleep(0.002)
+        get(port, "/")
+        first = time.perf_counter() - t0
+        return first, get(port, f"/anagrams/{text}"), get(port, f"/anagrams/{text}")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def import_profile(out):
+    """Writes the -X importtime lines of "import main", by cumulative time, largest first."""
+    scratch = use_scratch_dir()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=scratch,
+        env=dict(os.environ, PYTHONPATH=ROOT, VERCEL="1"),
+        capture_output=True,
+        text=True,
+    )
+    lines = [l for l in result.stderr.splitlines() if l.startswith("import time:") and "|" in l]
+    header, rows = lines[0], lines[1:]
+    rows.sort(key=lambda l: -int(l.split("|")[1]))
+    with open(out, "w") as f:
+        f.write(f"# python -X importtime -c 'import main', Python {sys.version.split()[0]}\n")
+        f.write("# sorted by cumulative time (us), largest first\n")
+        f.write("\n".join([header] + rows) + "\n")
+    print(f"saved {out}: import main took {int(rows[0].split('|')[1]) / 1000:.0f} ms")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="T-Tweak cold start times")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--importtime", help="also write the import profile to this file")
+    options = parser.parse_args(argv)
+
+    if options.importtime:
+        import_profile(os.path.abspath(options.importtime))
+
+    print(f"{'index':<10}{'first / (ms)':>14}{'first anagrams':>16}{'next anagrams':>15}")
+    for prebuilt in (True, False):
+        runs = [cold_start(prebuilt) for _ in range(options.runs)]
+        first, anagrams, warm = (statistics.median(r[i] for r in runs) * 1000 for i in range(3))
+        name = "prebuilt" if prebuilt else "built"
+        print(f"{name:<10}{first:>14.0f}{anagrams:>16.1f}{warm:>15.1f}")
+
+
+if __name__ == "__main__":
+    main()
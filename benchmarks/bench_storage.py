@@ -0,0 +1,70 @@
+""" /storage latency and cookie bytes on the wire, as a session stores more strings.
+
+"cookie" is the previous behavior: the whole machine in the signed session cookie. The other
+    modes keep it in a session_store.py store, with only the session id in the cookie. Each
+    session sends "add", then five strings of 100 characters, then a query; every step is
+    timed through the TestClient, and the cookie bytes sent and received are counted.
+
+    python benchmarks/bench_storage.py [sessions]
+"""
+
+import os
+import sys
+import time
+import tempfile
+import warnings
+import statistics
+
+from common import use_scratch_dir
+
+use_scratch_dir()
+warnings.simplefilter("ignore")
+
+from fastapi.testclient import TestClient
+
+import main
+import session_store
+
+
+def run_sessions(sessions):
+    """Returns, for each step, the mean latency (us) and mean cookie bytes (sent + received)."""
+    steps = ["add"] + [f"{i}" * 100 for i in range(5)] + ["query?index=4"]
+    latency = [[] for _ in steps]
+    wire = [[] for _ in steps]
+    for _ in range(sessions):
+        with TestClient(main.app) as client:
+            for n, command in enumerate(steps):
+                t0 = time.perf_counter()
+                r = client.get(f"/storage/{command}")
+                latency[n].append(time.perf_counter() - t0)
+                sent = len(r.request.headers.get("cookie", ""))
+                received = len(r.headers.get("set-cookie", ""))
+                wire[n].append(sent + received)
+        assert "4" * 100 == r.json()["res"]
+    return [(statistics.fmean(l) * 1e6, statistics.fmean(w)) for l, w in zip(latency, wire)]
+
+
+def main_bench(sessions):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        modes = {
+            "cookie": None,
+            "memory": session_store.MemoryStore(),
+            "sqlite": session_store.SQLiteStore(os.path.join(tmp, "storage.db")),
+            "shared": session_store.SharedStore(os.path.join(tmp, "storage.shm")),
+        }
+        for mode, store in modes.items():
+            main.storage_backend = mode
+            main._session_store = store
+            results[mode] = run_sessions(sessions)
+
+    print(f"{sessions} sessions: add, 5 strings of 100 characters, query")
+    header = f"{'stored':<8}" + "".join(f"{m + ' us':>12}{m + ' B':>11}" for m in results)
+    print(header)
+    for step in range(7):
+        row = "".join(f"{r[step][0]:>12.0f}{r[step][1]:>11.0f}" for r in results.values())
+        print(f"{min(step, 5):<8}{row}")
+
+
+if __name__ == "__main__":
+    main_bench(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
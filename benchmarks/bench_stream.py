@@ -0,0 +1,74 @@
+""" Streams a large body through POST /stream/{op} on a local uvicorn, and watches its memory.
+
+The server's peak RSS must not grow with the size of the body. Run with the size in MB:
+
+    python benchmarks/bench_stream.py [megabytes]
+
+The server answers while the body is still arriving, so the client has to send and receive at
+    the same time (most HTTP/1.1 clients only read once they've sent everything, and deadlock
+    once the socket buffers fill up). This uses a small asyncio client that does both.
+"""
+
+import sys
+import time
+import asyncio
+from urllib.parse import urlsplit
+
+from common import launch_server, peak_rss_mb
+
+CHUNK = b"The quick brown fox jumps over the lazy dog. " * 1456  # ~64 KB
+
+
+def body(megabytes):
+    for _ in range(megabytes * (1 << 20) // len(CHUNK)):
+        yield CHUNK
+
+
+async def duplex_post(url, path, chunks):
+    """POSTs a chunked body while reading the answer; returns the number of bytes received."""
+    parts = urlsplit(url)
+    reader, writer = await asyncio.open_connection(parts.hostname, parts.port)
+
+    async def send():
+        writer.write(
+            f"POST {path} HTTP/1.1\r\nHost: {parts.netloc}\r\n"
+            "Transfer-Encoding: chunked\r\nConnection: close\r\n\r\n".encode()
+        )
+        for chunk in chunks:
+            writer.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+            await writer.drain()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def receive():
+        received = 0
+        while data := await reader.read(1 << 16):
+            received += len(data)
+        return received
+
+    _, received = await asyncio.gather(send(), receive())
+    writer.close()
+    return received
+
+
+def run(url, op, megabytes):
+    t0 = time.perf_counter()
+    received = asyncio.run(duplex_post(url, f"/stream/{op}", body(megabytes)))
+    return time.perf_counter() - t0, received
+
+
+if __name__ == "__main__":
+    megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    process, url = launch_server()
+    try:
+        baseline = peak_rss_mb(process.pid)
+        print(f"{megabytes} MB body, server peak RSS before: {baseline:.1f} MB")
+        print(f"{'op':<10}{'seconds':>10}{'MB/s':>10}{'out (MB)':>10}{'peak RSS (MB)':>15}")
+        for op in ("upper", "mix_case", "length", "reverse"):
+            seconds, received = run(url, op, megabytes)
+            print(
+                f"{op:<10}{seconds:>10.2f}{megabytes / seconds:>10.1f}"
+                f"{received / (1 << 20):>10.1f}{peak_rss_mb(process.pid):>15.1f}"
+            )
+    finally:
+        process.terminate()
@@ -0,0 +1,94 @@
+""" Spelling suggestions: the deletion index of suggest.py against a scan of the whole dictionary.
+
+The queries are dictionary words with up to two random letters changed, added or removed.
+    scan    the Levenshtein distance to every word (of a close enough length), as a plain
+            implementation would: the distance stops early once over k (suggest.distance)
+    index   SuggestIndex.suggest, as /suggest runs it (limit 10)
+
+It also reports the build time, size and opening time of the index file.
+
+    python benchmarks/bench_suggest.py [queries]
+"""
+
+import os
+import sys
+import time
+import random
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import words
+import suggest
+from common import percentile
+
+
+def queries(all_words, n):
+    random.seed(1)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    found = []
+    for word in random.sample(all_words, n):
+        chars = list(word)
+        for _ in range(random.randint(0, 2)):
+            i = random.randrange(len(chars) + 1)
+            edit = random.choice("cad") if chars else "a"
+            if edit == "c" and i < len(chars):
+                chars[i] = random.choice(letters)
+            elif edit == "a":
+                chars.insert(i, random.choice(letters))
+            elif i < len(chars):
+                del chars[i]
+        found.append("".join(chars))
+    return found
+
+
+def scan(all_words, text, k, limit=10):
+    found = sorted(
+        (d, w)
+        for w in all_words
+        if abs(len(w) - len(text)) <= k
+        for d in (suggest.distance(text, w, k),)
+        if d <= k
+    )
+    return [(w, d) for d, w in found[:limit]]
+
+
+def timed(fn, texts):
+    latencies = []
+    for text in texts:
+        t0 = time.perf_counter()
+        fn(text)
+        latencies.append(time.perf_counter() - t0)
+    return latencies
+
+
+def main(n):
+    all_words = [w for w in words.load_words(os.path.join(ROOT, words.source)) if w]
+    path = os.path.join(tempfile.mkdtemp(prefix="ttweak-suggest-"), "words.sug")
+    t0 = time.perf_counter()
+    suggest.write_suggest(path, all_words)
+    built = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    index = suggest.SuggestIndex(path)
+    opened = time.perf_counter() - t0
+    size = index.nbytes / 2**20
+    print(f"index of {len(index)} words: built in {built:.1f} s, {size:.0f} MiB, "
+          f"opened in {opened * 1000:.2f} ms")
+
+    texts = queries(all_words, n)
+    print(f"{'k':<4}{'method':<8}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for k in (1, 2):
+        for text in texts[:20]:
+            assert scan(all_words, text, k) == index.suggest(text, k), text
+        methods = {"scan": lambda t: scan(all_words, t, k), "index": lambda t: index.suggest(t, k)}
+        for name, fn in methods.items():
+            # The scan takes long enough for a twentieth of the queries to tell
+            latencies = timed(fn, texts[: max(20, n // 20)] if name == "scan" else texts)
+            p50, p99 = percentile(latencies, 50), percentile(latencies, 99)
+            worst = max(latencies)
+            print(f"{k:<4}{name:<8}{p50 * 1000:>10.3f}{p99 * 1000:>10.3f}{worst * 1000:>10.3f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,66 @@
+""" Memory per uvicorn worker with the anagram table: per-worker dict, mmap'd file, shared memory.
+
+Starts the server with 8 workers for each mode, sends enough /anagrams requests (one
+    connection each) for every worker to load the table, and reports each worker's RSS and
+    PSS (proportional set size: shared pages are split between the processes that map them).
+
+    python benchmarks/bench_workers_rss.py [workers]
+"""
+
+import os
+import sys
+import time
+import urllib.request
+
+from common import ROOT, launch_server, children, memory_mb
+
+sys.path.insert(0, ROOT)
+
+import words
+
+
+def measure(workers, **launch):
+    process, url = launch_server(workers=workers, **launch)
+    try:
+        # Wait for all the workers to be up, then make sure each one answers some anagrams
+        while len(children(process.pid)) < workers:
+            time.sleep(0.1)
+        time.sleep(2)
+        expected = None
+        for _ in range(40 * workers):
+            with urllib.request.urlopen(f"{url}/anagrams/listen") as r:
+                res = r.read()
+            assert expected in (None, res)
+            expected = res
+        time.sleep(0.5)
+        return [memory_mb(pid) for pid in children(process.pid)], expected
+    finally:
+        process.terminate()
+        process.wait()
+
+
+if __name__ == "__main__":
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    os.chdir(ROOT)
+    words.build_index()
+
+    results = {}
+    results["dict"] = measure(workers, app="legacy_anagrams:app")
+    results["mmap"] = measure(workers)
+
+    shm = words.publish_shared(f"ttweak-bench-{os.getpid()}")
+    try:
+        results["shm"] = measure(workers, env={"TTWEAK_ANAGRAM_SHM": shm.name})
+    finally:
+        shm.close()
+        shm.unlink()
+
+    responses = {res for _, res in results.values()}
+    assert len(responses) == 1, responses
+
+    print(f"{workers} workers, /anagrams/listen -> {responses.pop().decode()}")
+    print(f"{'mode':<6}{'RSS/worker (MB)':>17}{'PSS/worker (MB)':>17}{'PSS total (MB)':>16}")
+    for mode, (mem, _) in results.items():
+        rss = sum(r for r, _ in mem) / len(mem)
+        pss = sum(p for _, p in mem)
+        print(f"{mode:<6}{rss:>17.1f}{pss / len(mem):>17.1f}{pss:>16.1f}")
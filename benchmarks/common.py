@@ -0,0 +1,281 @@
+""" Helpers shared by the benchmark scripts. """
+
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def use_scratch_dir():
+    """Moves into a temporary directory that looks like the repo to main.
+
+    main reads and writes paths relative to the working directory (logs/, words.txt), so the
+        benchmarks run from a scratch copy and leave the real logs alone.
+    """
+    scratch = tempfile.mkdtemp(prefix="ttweak-bench-")
+    os.makedirs(os.path.join(scratch, "logs"))
+    for name in ("words.txt", "favicon.ico"):
+        os.symlink(os.path.join(ROOT, name), os.path.join(scratch, name))
+    os.chdir(scratch)
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    return scratch
+
+
+def call_inline(fn):
+    """fn itself, or for an "async def" route a plain function that runs it to completion.
+
+    The tweak routes never really wait once warmed up, so their coroutine is driven by hand:
+        timing them through an event loop would mostly time the loop. A coroutine that does
+        wait (anagrams opening its index) has to be warmed up first with asyncio.run.
+    """
+    import inspect
+
+    if not inspect.iscoroutinefunction(fn):
+        return fn
+
+    def run(*args, **kwargs):
+        coroutine = fn(*args, **kwargs)
+        try:
+            coroutine.send(None)
+        except StopIteration as done:
+            return done.value
+        coroutine.close()
+        raise RuntimeError(f"{fn.__name__} waited: warm it up with asyncio.run first")
+
+    return run
+
+
+def free_port():
+    import socket
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def launch_server(port=None, workers=1, env=None, args=(), app="main:app", root=ROOT):
+    """Starts uvicorn on main:app (or app) from a scratch directory, and waits until it answers.
+
+    root is the tree the app is imported from: another checkout of the repo can be measured
+        (the data files missing there are taken from this one).
+
+    Returns (process, base_url). Stop it with process.terminate().
+    """
+    import time
+    import subprocess
+    import urllib.request
+
+    port = port or free_port()
+    scratch = tempfile.mkdtemp(prefix="ttweak-server-")
+    os.makedirs(os.path.join(scratch, "logs"))
+    for name in ("words.txt", "words.idx", "favicon.ico"):
+        for tree in (root, ROOT):
+            if os.path.exists(os.path.join(tree, name)):
+                os.symlink(os.path.join(tree, name), os.path.join(scratch, name))
+                break
+
+    path = os.pathsep.join([root, os.path.join(ROOT, "benchmarks")])
+    server_env = dict(os.environ, PYTHONPATH=path, **(env or {}))
+    cmd = [sys.executable, "-m", "uvicorn", app, "--port", str(port), "--log-level", "warning"]
+    if workers > 1:
+        cmd += ["--workers", str(workers)]
+    process = subprocess.Popen(cmd + list(args), cwd=scratch, env=server_env)
+
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(200):
+        try:
+            urllib.request.urlopen(f"{url}/robots.txt", timeout=1)
+            return process, url
+        except OSError:
+            time.sleep(0.05)
+    process.terminate()
+    raise RuntimeError("uvicorn did not start")
+
+
+def children(pid):
+    """The pids of the direct children of a (linux) process, e.g. uvicorn's workers."""
+    with open(f"/proc/{pid}/task/{pid}/children") as c:
+        return [int(p) for p in c.read().split()]
+
+
+def memory_mb(pid):
+    """Current RSS and PSS of a (linux) process. PSS splits shared pages between their users."""
+    found = {}
+    with open(f"/proc/{pid}/smaps_rollup") as smaps:
+        for line in smaps:
+            key, _, value = line.partition(":")
+            if key in ("Rss", "Pss"):
+                found[key] = int(value.split()[0]) / 1024
+    return found.get("Rss", float("nan")), found.get("Pss", float("nan"))
+
+
+def peak_rss_mb(pid):
+    """Peak resident memory of a (linux) process, from /proc."""
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    return float("nan")
+
+
+def percentile(samples, p):
+    """The p-th percentile (0-100) of a list of numbers, nearest rank."""
+    if not samples:
+        return float("nan")
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+async def open_loop(url, paths, rate, seconds, connections=100):
+    """Sends GETs at a fixed rate (requests/s), cycling through paths, whatever the latency.
+
+    Latency is measured from when each request was due, not from when it was sent, so a
+    server that falls behind shows it (no "coordinated omission"). Returns a list of
+    (path, status, latency in seconds) tuples.
+    """
+    import time
+    import asyncio
+    import httpx
+
+    limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+    results = []
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=30) as client:
+
+        async def one(path, due):
+            try:
+                r = await client.get(path)
+                status = r.status_code
+            except httpx.HTTPError:
+                status = 0
+            results.append((path, status, time.perf_counter() - due))
+
+        tasks = []
+        start = time.perf_counter()
+        for i in range(int(rate * seconds)):
+            due = start + i / rate
+            delay = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(one(paths[i % len(paths)], due)))
+        await asyncio.gather(*tasks)
+    return results
+
+
+async def open_loop_streams(url, paths, rate, seconds, connections=256):
+    """open_loop, spoken over plain asyncio streams as in closed_loop, for rates an HTTP
+    library would take most of the CPU to send.
+
+    A request goes out on an idle connection, or a new one while there are fewer than
+    connections, or else waits for one: that wait counts in its latency too. Returns a
+    list of (path, status, latency in seconds) tuples.
+    """
+    import time
+    import asyncio
+    from urllib.parse import urlsplit
+
+    host, port = urlsplit(url).hostname, urlsplit(url).port
+    results = []
+    idle = asyncio.Queue()
+    opened = 0
+
+    async def one(path, due):
+        nonlocal opened
+        if idle.empty() and opened < connections:
+            opened += 1
+            try:
+                connection = await asyncio.open_connection(host, port)
+            except OSError:
+                opened -= 1
+                results.append((path, 0, time.perf_counter() - due))
+                return
+        else:
+            connection = await idle.get()
+        reader, writer = connection
+        try:
+            writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode("latin-1"))
+            status = await _read_response(reader)
+            idle.put_nowait(connection)
+        except (OSError, asyncio.IncompleteReadError, ValueError):
+            status = 0
+            writer.close()
+            opened -= 1
+        results.append((path, status, time.perf_counter() - due))
+
+    tasks = []
+    start = time.perf_counter()
+    for i in range(int(rate * seconds)):
+        due = start + i / rate
+        delay = due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(one(paths[i % len(paths)], due)))
+    await asyncio.gather(*tasks)
+    while not idle.empty():
+        idle.get_nowait()[1].close()
+    return results
+
+
+async def _read_response(reader):
+    """Reads one HTTP/1.1 response from a stream: returns its status."""
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    status = int(lines[0].split()[1])
+    headers = dict(line.lower().split(": ", 1) for line in lines[1:] if ": " in line)
+    if "content-length" in headers:
+        await reader.readexactly(int(headers["content-length"]))
+    elif headers.get("transfer-encoding") == "chunked":
+        while True:
+            size = int((await reader.readuntil(b"\r\n")).strip(), 16)
+            await reader.readexactly(size + 2)
+            if not size:
+                break
+    return status
+
+
+async def closed_loop(url, paths, clients, seconds, warmup=1.0):
+    """clients concurrent clients each send a GET as soon as their last one is answered,
+    cycling through paths, for seconds (after warmup seconds that are not recorded).
+
+    Each client keeps one HTTP/1.1 connection, spoken over plain asyncio streams: an HTTP
+        library would cost the clients more CPU than the server spends on most routes.
+    Returns (list of (path, status, latency in seconds) tuples, seconds actually recorded).
+    """
+    import time
+    import asyncio
+    from urllib.parse import urlsplit
+
+    host, port = urlsplit(url).hostname, urlsplit(url).port
+    results = []
+    start = time.perf_counter()
+    recording = start + warmup
+    end = recording + seconds
+
+    async def one_client(n):
+        i = n
+        reader = writer = None
+        while True:
+            sent = time.perf_counter()
+            if sent >= end:
+                break
+            path = paths[i % len(paths)]
+            i += clients
+            try:
+                if writer is None:
+                    reader, writer = await asyncio.open_connection(host, port)
+                request = f"GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n"
+                writer.write(request.encode("latin-1"))
+                status = await _read_response(reader)
+            except (OSError, asyncio.IncompleteReadError, ValueError):
+                status = 0
+                if writer is not None:
+                    writer.close()
+                reader = writer = None
+            if sent >= recording:
+                results.append((path, status, time.perf_counter() - sent))
+        if writer is not None:
+            writer.close()
+
+    await asyncio.gather(*(one_client(n) for n in range(clients)))
+    return results, time.perf_counter() - recording
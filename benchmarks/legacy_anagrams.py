@@ -0,0 +1,17 @@
+""" main:app, but with the anagram table each worker used to build: the words.words dict.
+
+Only for comparisons (see bench_workers_rss.py): uvicorn legacy_anagrams:app
+"""
+
+import main
+import words
+
+
+class DictIndex:
+    def get(self, key, default=None):
+        # The route used to copy the whole dict, and then the list, per request
+        return list(words.words.copy().get(key, default or []))
+
+
+main.dictionary.swap(DictIndex())
+app = main.app
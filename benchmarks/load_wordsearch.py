@@ -0,0 +1,73 @@
+""" Latency of /subanagrams and /wildcard on a local uvicorn under a fixed request rate.
+
+First times the index queries in-process, then sends requests at a fixed rate (1000/s by
+    default) and reports p50/p99 per query, measured from when each request was due.
+
+    python benchmarks/load_wordsearch.py [rate] [seconds] [workers]
+
+The load generator runs on the same machine: give the server enough cores (workers) for it.
+"""
+
+import sys
+import time
+import asyncio
+import timeit
+from collections import defaultdict
+
+from common import ROOT, launch_server, open_loop, percentile
+
+sys.path.insert(0, ROOT)
+
+import words
+import wordsearch
+
+LETTERS = ["listen", "scrabble", "aeiourstln", "quizzing"]
+PATTERNS = ["c?t*", "*ing", "??e*y", "*a*b*", "pre*ion"]
+
+
+def in_process():
+    all_words = words.load_words()
+    t0 = time.perf_counter()
+    letter_index = wordsearch.LetterIndex(all_words)
+    pattern_index = wordsearch.PatternIndex(all_words)
+    print(f"indexes built in {(time.perf_counter() - t0) * 1000:.0f} ms")
+
+    print(f"{'query':<24}{'results':>9}{'ms/query':>10}")
+    for letters in LETTERS:
+        n = len(letter_index.sub_anagrams(letters))
+        ms = timeit.timeit(lambda: letter_index.sub_anagrams(letters), number=50) / 50 * 1000
+        print(f"{'subanagrams ' + letters:<24}{n:>9}{ms:>10.2f}")
+    for pattern in PATTERNS:
+        n = len(pattern_index.match(pattern))
+        ms = timeit.timeit(lambda: pattern_index.match(pattern), number=50) / 50 * 1000
+        print(f"{'wildcard ' + pattern:<24}{n:>9}{ms:>10.2f}")
+
+
+if __name__ == "__main__":
+    rate = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    seconds = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+    in_process()
+
+    paths = [f"/subanagrams/{l}" for l in LETTERS]
+    paths += [f"/wildcard/{p.replace('?', '%3F')}" for p in PATTERNS]
+    process, url = launch_server(workers=workers)
+    try:
+        # The indexes are built on the first query, in each worker
+        asyncio.run(open_loop(url, paths * 4 * workers, 20, len(paths) * 4 * workers / 20))
+        results = asyncio.run(open_loop(url, paths, rate, seconds))
+    finally:
+        process.terminate()
+
+    by_path = defaultdict(list)
+    errors = 0
+    for path, status, latency in results:
+        by_path[path].append(latency * 1000)
+        errors += status != 200
+    everything = [l * 1000 for _, _, l in results]
+
+    print(f"\n{rate} requests/s for {seconds} s on {workers} worker(s), {len(results)} requests, {errors} errors")
+    print(f"{'path':<32}{'p50 (ms)':>10}{'p99 (ms)':>10}")
+    for path, latencies in by_path.items():
+        print(f"{path:<32}{percentile(latencies, 50):>10.2f}{percentile(latencies, 99):>10.2f}")
+    print(f"{'all':<32}{percentile(everything, 50):>10.2f}{percentile(everything, 99):>10.2f}")
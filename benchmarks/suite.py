@@ -0,0 +1,299 @@
+""" The performance baseline of T-Tweak: micro-benchmarks, HTTP load, and a comparison of runs.
+
+    python benchmarks/suite.py micro [--out FILE] [--cache] [--only NAME]
+        Times each route function of main, called in-process, at several input sizes (the
+        logging and counting they do included). The response cache is off unless --cache.
+
+    python benchmarks/suite.py load [--out FILE] [--clients N] [--seconds S] [--workers W]
+                                    [--warmup S]
+        Starts uvicorn on main:app and keeps N clients sending requests over a mix of every
+        tweak, then reports throughput and p50/p95/p99 latency, per route and in total.
+
+    python benchmarks/suite.py compare OLD.json NEW.json [--threshold 0.1]
+        Compares two runs of the same kind and flags every number that got worse by more
+        than the threshold (10% by default). Exits with 1 when there is any regression.
+
+Results are saved as JSON, by default in benchmarks/results/<kind>-<date>.json, with the
+    commit, the Python version and the machine they ran on.
+
+The load generator runs on the same machine as the server, and in one process: compare runs
+    made with the same settings on the same (quiet) machine.
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import datetime
+import subprocess
+import urllib.request
+import statistics
+import warnings
+from collections import defaultdict
+
+from common import ROOT, call_inline, closed_loop, launch_server, percentile
+
+# Metrics in the results, and whether a larger value is better
+HIGHER_IS_BETTER = {
+    "median_us": False,
+    "throughput_rps": True,
+    "p50_ms": False,
+    "p95_ms": False,
+    "p99_ms": False,
+}
+
+
+def micro_cases(main):
+    """(name, function, args) for each route function and input size."""
+    cases = []
+    for n in (1, 10, 100):
+        text = ("AbCdEfGhIj" * 10)[:n]
+        cases += [
+            (f"length[{n}]", main.get_length, (text,)),
+            (f"reverse[{n}]", main.reverse, (text,)),
+            (f"upper[{n}]", main.upper, (text,)),
+            (f"tolower[{n}]", main.tolower, (text,)),
+            (f"mix_case[{n}]", main.mix_case, (text,)),
+            (f"substring[{n}]", main.substring, (text, 0, n // 2)),
+            (f"random[{n}]", main.rand_str, (n,)),
+        ]
+    for n in (1, 4, 8):
+        cases.append((f"find[{n}]", main.find, ("abababab"[:n], "ab")))
+    for n in (6, 12, 20):
+        cases.append((f"password[{n}]", main.password_strength, (("Passw0rd" * 3)[:n],)))
+    for n in (10, 50, 150):
+        cases.append((f"counterstring[{n}]", main.counterstring, (n, "*")))
+    for word in ("cat", "listen", "conversation"):
+        # Called directly, the default of a Query parameter has to be given
+        cases.append((f"anagrams[{len(word)}]", main.anagrams, (word, main.default_dictionary)))
+    for letters in ("cat", "listen", "conversation"):
+        cases.append((f"subanagrams[{len(letters)}]", main.subanagrams, (letters, 0, 50)))
+    for pattern in ("c?t", "c?t*", "*a*b*"):
+        cases.append((f"wildcard[{pattern}]", main.wildcard, (pattern, 0, 50)))
+    return cases
+
+
+def time_call(fn, args, seconds=0.2):
+    """Times each call for about seconds: median, mean and p99 per call, in microseconds.
+
+    The median is what compare looks at first: periodic work (a journal compaction, a log
+        flush) shows in the mean and p99 without making every run look different.
+    """
+    first = fn(*args)
+    if asyncio.iscoroutine(first):
+        asyncio.run(first)
+    fn = call_inline(fn)
+    samples = []
+    end = time.perf_counter() + seconds
+    while True:
+        t0 = time.perf_counter()
+        fn(*args)
+        t1 = time.perf_counter()
+        samples.append(t1 - t0)
+        if t1 >= end:
+            break
+    return {
+        "median_us": statistics.median(samples) * 1e6,
+        "mean_us": statistics.fmean(samples) * 1e6,
+        "p99_us": percentile(samples, 99) * 1e6,
+        "calls": len(samples),
+    }
+
+
+def run_micro(options):
+    from common import use_scratch_dir
+
+    use_scratch_dir()
+    warnings.simplefilter("ignore")
+    import main
+    from cache import ResponseCache
+
+    if not options.cache:
+        main.responses = ResponseCache(default_bytes=0)
+    results = {}
+    print(f"{'name':<24}{'median us':>12}{'mean us':>12}{'p99 us':>12}")
+    for name, fn, args in micro_cases(main):
+        if options.only and not name.startswith(options.only):
+            continue
+        results[name] = r = time_call(fn, args)
+        print(f"{name:<24}{r['median_us']:>12.1f}{r['mean_us']:>12.1f}{r['p99_us']:>12.1f}")
+    main.writer.flush()
+    return {"config": {"cache": options.cache}, "results": results}
+
+
+def load_paths():
+    """(route, path) pairs: one request for every tweak, with a few different inputs."""
+    paths = []
+    for text in ("abc", "Hello%20World", "AbCdEfGhIjKlMnOpQrStUvWxYz0123456789" * 2):
+        paths += [
+            ("/length/{text}", f"/length/{text}"),
+            ("/reverse/{text}", f"/reverse/{text}"),
+            ("/upper/{text}", f"/upper/{text}"),
+            ("/tolower/{text}", f"/tolower/{text}"),
+            ("/mix_case/{text}", f"/mix_case/{text}"),
+            ("/substring/{string}/{start}/{end}", f"/substring/{text}/1/3"),
+            ("/password/{password}", f"/password/{text}xY1"),
+        ]
+    for word in ("listen", "stone", "conversation"):
+        paths += [
+            ("/anagrams/{text}", f"/anagrams/{word}"),
+            ("/subanagrams/{letters}", f"/subanagrams/{word}"),
+            ("/wildcard/{pattern}", f"/wildcard/{word[:2]}*"),
+        ]
+    for n in (10, 150):
+        paths.append(("/counterstring/{length}/{char}", f"/counterstring/{n}/*"))
+        paths.append(("/random", f"/random?length={n}"))
+    paths.append(("/find/{string}/{sub}", "/find/abababab/ab"))
+    return paths
+
+
+def summarize(latencies, errors, seconds):
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "throughput_rps": (len(latencies) + errors) / seconds,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def run_load(options):
+    pairs = load_paths()
+    route_of = dict((path, route) for route, path in pairs)
+    process, url = launch_server(workers=options.workers)
+    try:
+        # Each path once first, so that the indexes built on first use are there
+        for _, path in pairs:
+            urllib.request.urlopen(url + path)
+        samples, seconds = asyncio.run(
+            closed_loop(
+                url, [path for _, path in pairs], options.clients, options.seconds, options.warmup
+            )
+        )
+    finally:
+        process.terminate()
+        process.wait()
+
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    for path, status, latency in samples:
+        for key in (route_of[path], "total"):
+            if 200 <= status < 300:
+                latencies[key].append(latency)
+            else:
+                errors[key] += 1
+    keys = sorted(set(latencies) | set(errors))
+    results = {key: summarize(latencies[key], errors[key], seconds) for key in keys}
+
+    print(f"{options.clients} clients, {options.seconds} s, {options.workers} worker(s)")
+    print(f"{'route':<36}{'req/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}")
+    for key, r in results.items():
+        print(
+            f"{key:<36}{r['throughput_rps']:>10.0f}{r['p50_ms']:>9.2f}"
+            f"{r['p95_ms']:>9.2f}{r['p99_ms']:>9.2f}{r['errors']:>8}"
+        )
+    config = {"clients": options.clients, "seconds": options.seconds, "workers": options.workers}
+    config["warmup"] = options.warmup
+    return {"config": config, "results": results}
+
+
+def metadata():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True
+        ).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "machine": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def save(kind, run, out):
+    run = {"kind": kind, "meta": metadata(), **run}
+    if out is None:
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        out = os.path.join(ROOT, "benchmarks", "results", f"{kind}-{stamp}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(run, f, indent=1)
+    print(f"saved {out}")
+
+
+def compare(old, new, threshold):
+    """Returns [(name, metric, old, new, change, regression)] for the numbers in both runs."""
+    rows = []
+    for name in old["results"]:
+        if name not in new["results"]:
+            continue
+        for metric, higher_is_better in HIGHER_IS_BETTER.items():
+            a = old["results"][name].get(metric)
+            b = new["results"][name].get(metric)
+            if a is None or b is None or not a:
+                continue
+            change = (b - a) / a
+            worse = -change if higher_is_better else change
+            rows.append((name, metric, a, b, change, worse > threshold))
+    return rows
+
+
+def run_compare(options):
+    with open(options.old) as f:
+        old = json.load(f)
+    with open(options.new) as f:
+        new = json.load(f)
+    if old["kind"] != new["kind"]:
+        sys.exit(f"Can't compare a {old['kind']} run with a {new['kind']} run")
+    if old.get("config") != new.get("config"):
+        print(f"warning: different settings {old.get('config')} and {new.get('config')}")
+
+    rows = compare(old, new, options.threshold)
+    print(f"{old['meta']['commit'] or 'old'} -> {new['meta']['commit'] or 'new'}")
+    print(f"{'name':<36}{'metric':<16}{'old':>12}{'new':>12}{'change':>9}")
+    for name, metric, a, b, change, regression in rows:
+        flag = "  REGRESSION" if regression else ""
+        print(f"{name:<36}{metric:<16}{a:>12.2f}{b:>12.2f}{change:>+9.1%}{flag}")
+    regressions = sum(row[-1] for row in rows)
+    print(f"{regressions} regression(s) beyond {options.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="T-Tweak benchmark suite")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    micro = commands.add_parser("micro", help="time each route function in-process")
+    micro.add_argument("--out", help="JSON file for the results")
+    micro.add_argument("--cache", action="store_true", help="keep the response cache on")
+    micro.add_argument("--only", help="only the benchmarks whose name starts with this")
+
+    load = commands.add_parser("load", help="HTTP load against a local uvicorn")
+    load.add_argument("--out", help="JSON file for the results")
+    load.add_argument("--clients", type=int, default=50, help="concurrent clients")
+    load.add_argument("--seconds", type=float, default=10, help="duration of the measure")
+    load.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    load.add_argument("--warmup", type=float, default=2, help="seconds of load not measured")
+
+    cmp = commands.add_parser("compare", help="flag regressions between two runs")
+    cmp.add_argument("old")
+    cmp.add_argument("new")
+    cmp.add_argument("--threshold", type=float, default=0.1, help="0.1 is 10%% worse")
+
+    options = parser.parse_args(argv)
+    if options.command == "compare":
+        return run_compare(options)
+    run = run_micro(options) if options.command == "micro" else run_load(options)
+    save(options.command, run, options.out)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,132 @@
+""" A least-recently-used cache bounded by the total size of its values, not their number.
+
+ResponseCache keeps one such cache per route, for responses that were already encoded (in
+    whichever format they were asked for).
+"""
+
+import time
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    def __init__(self, max_bytes, sizeof=len, ttl=None):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.ttl = ttl
+        self.bytes = 0
+        self.hits = self.misses = self.evictions = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and item[2] is not None and item[2] < time.monotonic():
+                self.bytes -= self._items.pop(key)[1]
+                self.evictions += 1
+                item = None
+            if item is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._items.move_to_end(key)
+            return item[0]
+
+    def put(self, key, value):
+        """Stores value, evicting the least recently used values to make room for it.
+
+        A value larger than the whole cache is not stored.
+        """
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            if key in self._items:
+                self.bytes -= self._items.pop(key)[1]
+            self._items[key] = (value, size, expires)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted, _) = self._items.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.bytes = 0
+
+    def stats(self):
+        return {
+            "entries": len(self._items),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class ResponseCache:
+    """Encoded responses by (route, params). Each route has its own LRUCache, of limits[route]
+    bytes (default_bytes for the others), so a route with large responses can't push out
+    the rest.
+    """
+
+    def __init__(self, default_bytes, limits=None, ttl=None):
+        self.default_bytes = default_bytes
+        self.limits = dict(limits or {})
+        self.ttl = ttl
+        self._routes = {}
+        self._lock = threading.Lock()
+
+    def route(self, name):
+        found = self._routes.get(name)
+        if found is None:
+            with self._lock:
+                found = self._routes.setdefault(
+                    name,
+                    LRUCache(
+                        self.limits.get(name, self.default_bytes), sizeof=_body_size, ttl=self.ttl
+                    ),
+                )
+        return found
+
+    def get(self, name, params):
+        """(body, media type) of the response stored for params, or None."""
+        return self.route(name).get(params)
+
+    def put(self, name, params, body, media_type="application/json"):
+        self.route(name).put(params, (body, media_type))
+
+    def clear(self):
+        for cache in list(self._routes.values()):
+            cache.clear()
+
+    def stats(self):
+        """Hits, misses, evictions and sizes, per route and in total."""
+        routes = {name: cache.stats() for name, cache in sorted(self._routes.items())}
+        total = {key: 0 for key in ("entries", "bytes", "hits", "misses", "evictions")}
+        for route in routes.values():
+            for key in total:
+                total[key] += route[key]
+        lookups = total["hits"] + total["misses"]
+        total["hit_rate"] = total["hits"] / lookups if lookups else 0.0
+        return {"total": total, "routes": routes}
+
+
+def _body_size(response):
+    return len(response[0])
+
+
+def parse_limits(text):
+    """Parses per-route limits written as "route=bytes,route=bytes"."""
+    limits = {}
+    for item in filter(None, (part.strip() for part in (text or "").split(","))):
+        name, _, size = item.partition("=")
+        limits[name.strip()] = int(size)
+    return limits
@@ -0,0 +1,252 @@
+""" Counters shared by all the worker processes of the server, exact under concurrent updates.
+
+Two backends with the same interface (get, add, reset):
+    SlotCounter     an 8-byte integer in a memory-mapped file, updated under an exclusive lock.
+    JournalCounter  an append-only text file: the first line is a total, every other line an
+                    increment. Appends run concurrently; a compaction folds the journal back into
+                    a single line every so often. Each process reads only the lines appended
+                    since its last read.
+
+open_counter picks one by name, so the server can be configured with an environment variable.
+
+BufferedCounter goes in front of either, for callers that must not wait on files: it adds up
+    increments in memory, and a background thread hands them to the backend in batches.
+"""
+
+import os
+import mmap
+import time
+import atexit
+import struct
+import threading
+
+# "fcntl" is a linux module: in Windows it doesn't exist, and win_fctl stands in for it.
+try:
+    import fcntl
+except ModuleNotFoundError:
+    import win_fctl as fcntl
+
+SLOT = struct.Struct("<q")
+
+
+class Counter:
+    def get(self):
+        """Returns the current value."""
+        raise NotImplementedError
+
+    def add(self, n=1):
+        """Adds n and returns the new value."""
+        raise NotImplementedError
+
+    def reset(self, value=0):
+        raise NotImplementedError
+
+
+class SlotCounter(Counter):
+    def __init__(self, path):
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        if os.fstat(self._fd).st_size < SLOT.size:
+            os.ftruncate(self._fd, SLOT.size)
+        self._map = mmap.mmap(self._fd, SLOT.size)
+
+    def get(self):
+        fcntl.flock(self._fd, fcntl.LOCK_SH)
+        try:
+            return SLOT.unpack_from(self._map)[0]
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def add(self, n=1):
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            value = SLOT.unpack_from(self._map)[0] + n
+            SLOT.pack_into(self._map, 0, value)
+            return value
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def reset(self, value=0):
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            SLOT.pack_into(self._map, 0, value)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+class JournalCounter(Counter):
+    def __init__(self, path, compact_every=1000):
+        self.path = path
+        self.compact_every = compact_every
+        self._adds = 0
+        # What this process has read of the journal: its open file, how far, and the sum
+        self._file = None
+        self._offset = 0
+        self._sum = 0
+        self._reading = threading.Lock()
+        # Compaction replaces the journal file, so the lock lives in a file of its own
+        self._lock = os.open(f"{path}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+
+        # A plain count file ("0", no newline) is a valid journal once its line is ended
+        fcntl.flock(self._lock, fcntl.LOCK_EX)
+        try:
+            if os.path.isfile(path) and os.path.getsize(path):
+                with open(path, "rb+") as j:
+                    j.seek(-1, os.SEEK_END)
+                    if j.read(1) != b"\n":
+                        j.write(b"\n")
+        finally:
+            fcntl.flock(self._lock, fcntl.LOCK_UN)
+
+    def _total(self):
+        try:
+            journal = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return 0
+        with self._reading:
+            # A compaction (by any process) replaced the file: read the new one from the start.
+            #   The old one stays open until then, so its inode can't be reused meanwhile.
+            if self._file is None or os.fstat(self._file.fileno()).st_ino != journal:
+                self._close()
+                self._file = open(self.path, "rb")
+                self._offset = self._sum = 0
+            size = os.fstat(self._file.fileno()).st_size
+            if size < self._offset:
+                # Rewritten in place, not replaced
+                self._offset = self._sum = 0
+            self._file.seek(self._offset)
+            data = self._file.read(size - self._offset)
+            # A crash (or an append in progress) can leave a partial last line: only complete
+            #   lines count, the rest is read again next time
+            complete = data[: data.rfind(b"\n") + 1]
+            self._offset += len(complete)
+            self._sum += sum(int(l) for l in complete.split() if l.lstrip(b"-").isdigit())
+            return self._sum
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _replace(self, value):
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as j:
+            j.write(f"{value}\n")
+        # Windows can't replace a file that is still open
+        with self._reading:
+            self._close()
+        os.replace(tmp, self.path)
+
+    def get(self):
+        fcntl.flock(self._lock, fcntl.LOCK_SH)
+        try:
+            return self._total()
+        finally:
+            fcntl.flock(self._lock, fcntl.LOCK_UN)
+
+    def add(self, n=1):
+        fcntl.flock(self._lock, fcntl.LOCK_SH)
+        try:
+            # Small O_APPEND writes don't interleave, so appenders only share the lock
+            with open(self.path, "a") as j:
+                j.write(f"{n}\n")
+            value = self._total()
+        finally:
+            fcntl.flock(self._lock, fcntl.LOCK_UN)
+
+        self._adds += 1
+        if self._adds % self.compact_every == 0:
+            self.compact()
+        return value
+
+    def compact(self):
+        fcntl.flock(self._lock, fcntl.LOCK_EX)
+        try:
+            self._replace(self._total())
+        finally:
+            fcntl.flock(self._lock, fcntl.LOCK_UN)
+
+    def reset(self, value=0):
+        fcntl.flock(self._lock, fcntl.LOCK_EX)
+        try:
+            self._replace(value)
+        finally:
+            fcntl.flock(self._lock, fcntl.LOCK_UN)
+
+
+class BufferedCounter(Counter):
+    """Increments are only added up in memory, and handed to counter every interval seconds.
+
+    get() is exact for this process' own increments (its pending ones included) and sees the
+    other processes' once they are handed over. add() touches no file, and returns the value
+    known at the last hand-over plus what is pending.
+    """
+
+    def __init__(self, counter, interval=0.5):
+        self.counter = counter
+        self.interval = interval
+        self._pending = 0
+        self._known = 0
+        self._lock = threading.Lock()
+        # Held while pending increments are on their way to the backend, so that get()
+        #   never counts them twice, or not at all
+        self._flushing = threading.Lock()
+        self._thread = None
+
+    def get(self):
+        with self._flushing:
+            value = self.counter.get()
+            with self._lock:
+                self._known = value
+                return value + self._pending
+
+    def add(self, n=1):
+        with self._lock:
+            self._pending += n
+            return self._known + self._pending
+
+    def flush(self):
+        with self._flushing:
+            with self._lock:
+                pending, self._pending = self._pending, 0
+            if pending:
+                try:
+                    self._known = self.counter.add(pending)
+                except Exception:
+                    with self._lock:
+                        self._pending += pending
+                    raise
+
+    def reset(self, value=0):
+        with self._flushing:
+            with self._lock:
+                self._pending = 0
+                self._known = value
+            self.counter.reset(value)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                # Silently fail in serverless environments where filesystem may be restricted
+                pass
+
+    def start(self):
+        """Starts the background thread (once) and flushes at interpreter exit."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="ttweak-counter", daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+        return self
+
+
+backends = {"slot": SlotCounter, "journal": JournalCounter}
+
+
+def open_counter(kind, path, **options):
+    """Opens a counter backend by name ("slot" or "journal")."""
+    if kind not in backends:
+        raise ValueError(f"Unknown counter backend {kind!r}, use one of {sorted(backends)}")
+    return backends[kind](path, **options)
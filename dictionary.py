@@ -0,0 +1,426 @@
+""" The dictionaries of the word routes, replaced without a restart when their source changes.
+
+Dictionary.current() is the version in use: its anagram index (see words.py), its word
+    searches and its spelling suggestions (see suggest.py, opened on first use). A reload
+    builds the index of the source as it is now, in a child process, so that the requests
+    of this worker keep their share of the CPU and all of its GIL. Then it opens the new
+    index and swaps it in: the requests that already had the old version finish with it,
+    the next ones get the new one. The index file is replaced atomically (see
+    wordindex.write_index), and the old one stays readable through the mappings still open
+    on it.
+
+The suggestion index takes seconds and hundreds of MB to build: a worker never builds it
+    itself. The first use of the suggestions has a child process build it from the anagram
+    index of the version, and once it exists, a reload builds the new one in the same child
+    as the anagram index.
+
+Registry holds several dictionaries by name (words.txt is "words"), each built from a word
+    list of its own and only loaded when first used. Once the indexes loaded take more than
+    max_bytes in all, the least recently used are unloaded, except the pinned ones.
+
+The watcher thread of the registry looks at the source of each loaded dictionary every poll
+    seconds: when its size or mtime changed, it reloads it if the digest isn't the one of
+    the current version. Each worker has its own watcher: the first to take the build lock
+    builds the new index, the others find it built and only open it.
+"""
+
+import os
+import sys
+import time
+import shutil
+import datetime
+import contextlib
+import threading
+import subprocess
+from collections import OrderedDict
+
+# "fcntl" is a linux module: in Windows it doesn't exist, and win_fctl stands in for it.
+try:
+    import fcntl
+except ModuleNotFoundError:
+    import win_fctl as fcntl
+
+import words
+import wordindex
+
+
+def run_child(script, *args):
+    """Runs a python script in a child process, at a lower priority: on a busy machine the
+    requests go first. Through nice(1), not a preexec_fn: this process has threads, and a
+    child forked from it could deadlock before it gets to exec."""
+    nice = ["nice", "-n", "10"] if shutil.which("nice") else []
+    subprocess.run(
+        nice + [sys.executable, os.path.abspath(script), *args], check=True, capture_output=True
+    )
+
+
+@contextlib.contextmanager
+def build_lock(path):
+    """Holds the lock of whoever builds the file at path, in any process."""
+    with open(f"{path}.lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+class Version:
+    """One version of the dictionary: number counts the versions loaded by this process."""
+
+    def __init__(self, number, index, build_seconds=0.0, suggest_paths=()):
+        self.number = number
+        self.index = index
+        self.tag = getattr(index, "tag", bytes(16))
+        self.build_seconds = build_seconds
+        self.suggest_paths = suggest_paths
+        self.loaded = time.time()
+        self._word_search = None
+        self._suggestions = None
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self):
+        """The bytes of the index, and of the suggestion index if it was opened."""
+        nbytes = getattr(self.index, "nbytes", 0)
+        if self._suggestions is not None:
+            nbytes += self._suggestions.nbytes
+        return nbytes
+
+    def word_search(self):
+        """The sub-anagram and pattern indexes of the words of this version."""
+        if self._word_search is None:
+            with self._lock:
+                if self._word_search is None:
+                    # NumPy takes a while to import, so only the word searches pay for it
+                    import wordsearch
+
+                    all_words = sorted(self.index.values())
+                    self._word_search = (
+                        wordsearch.LetterIndex(all_words),
+                        wordsearch.PatternIndex(all_words),
+                    )
+        return self._word_search
+
+    def suggestions(self):
+        """The spelling suggestion index of the words of this version (see suggest.py), opened
+        on first use: from the first of suggest_paths that was built from them, or built (in
+        a child process) at the first that can be written."""
+        if self._suggestions is None:
+            with self._lock:
+                if self._suggestions is None:
+                    self._suggestions = self._open_suggestions()
+        return self._suggestions
+
+    def _open_suggestions(self):
+        # NumPy takes a while to import, so only the suggestions pay for it
+        import suggest
+
+        for path in self.suggest_paths:
+            try:
+                found = suggest.SuggestIndex(path)
+            except (FileNotFoundError, ValueError):
+                continue
+            if found.tag == self.tag:
+                return found
+        error = None
+        for path in self.suggest_paths:
+            try:
+                with build_lock(path):
+                    # Another worker may have built it while this one waited for the lock
+                    try:
+                        found = suggest.SuggestIndex(path)
+                        if found.tag == self.tag:
+                            return found
+                    except (FileNotFoundError, ValueError):
+                        pass
+                    run_child(suggest.__file__, self.index.path, path)
+                    return suggest.SuggestIndex(path)
+            except (OSError, subprocess.CalledProcessError) as e:
+                # Not writable here (Vercel's code is read-only): the next path
+                error = e
+        raise error or FileNotFoundError("No path to build the suggestion index at")
+
+    def info(self):
+        return {
+            "version": self.number,
+            "source": self.tag.hex(),
+            "entries": len(self.index),
+            "bytes": self.nbytes,
+            "build_seconds": round(self.build_seconds, 3),
+            "loaded": datetime.datetime.fromtimestamp(self.loaded).isoformat(),
+        }
+
+
+class Dictionary:
+    """The current version of the dictionary of src, and its reloads.
+
+    The index is built at path, or at fallback where path can't be written (Vercel's code is
+        read-only). With shared, the first version is the index that serve.py published in
+        shared memory under that name; reloads build files as usual.
+    """
+
+    def __init__(self, src=words.source, path=words.index_file, fallback=None, shared=None):
+        self.src = src
+        self.path = path
+        self.fallback = fallback
+        self.shared = shared
+        self.reloads = 0
+        self.last_error = None
+        self._current = None
+        self._number = 0
+        self._stat = None
+        self._loading = threading.Lock()
+        self._reloading = None
+
+    def current(self):
+        """The version in use, opened on first use (in the caller's thread)."""
+        version = self._current
+        if version is None:
+            with self._loading:
+                if self._current is None:
+                    self._stat = self._source_stat()
+                    if self.shared:
+                        self.swap(words.attach_shared(self.shared))
+                    else:
+                        self.swap(*self._open(in_child=False))
+            version = self._current
+        return version
+
+    @property
+    def loaded(self):
+        return self._current is not None
+
+    def unload(self):
+        """Drops the current version: the next use opens the index again. The requests that
+        have it finish with it."""
+        with self._loading:
+            self._current = None
+
+    def swap(self, index, build_seconds=0.0):
+        """Makes index the current version."""
+        self._number += 1
+        paths = [os.path.splitext(p)[0] + ".sug" for p in (self.path, self.fallback) if p]
+        self._current = Version(self._number, index, build_seconds, paths)
+        return self._current
+
+    def reload(self):
+        """Starts building and swapping in the dictionary of the source as it is now, in the
+        background. Returns the thread doing it (the one already at it, if any)."""
+        with self._loading:
+            if self._reloading is None or not self._reloading.is_alive():
+                self._reloading = threading.Thread(
+                    target=self._reload, name="ttweak-dictionary-reload", daemon=True
+                )
+                self._reloading.start()
+            return self._reloading
+
+    @property
+    def reloading(self):
+        return self._reloading is not None and self._reloading.is_alive()
+
+    def _reload(self):
+        try:
+            self._stat = self._source_stat()
+            index, build_seconds = self._open(in_child=True)
+            with self._loading:
+                if self._current is None or index.tag == self._current.tag:
+                    # Unloaded meanwhile, or the source is the one of the current version
+                    return
+                self.swap(index, build_seconds)
+            self.reloads += 1
+            self.last_error = None
+        except Exception as e:
+            # The current version stays: the next change of the source tries again
+            self.last_error = f"{type(e).__name__}: {e}"
+
+    def _source_stat(self):
+        try:
+            st = os.stat(self.src)
+        except OSError:
+            return None
+        return st.st_size, st.st_mtime_ns
+
+    def _built(self, path, tag):
+        """The index at path, if it was built from the source: from its digest tag, or when
+        there is none (the first version), as words.is_current tells."""
+        if tag is None:
+            return wordindex.PackedIndex(path) if words.is_current(path, self.src) else None
+        try:
+            index = wordindex.PackedIndex(path)
+        except (FileNotFoundError, ValueError):
+            return None
+        return index if index.tag == tag else None
+
+    def _open(self, in_child):
+        """(index, build seconds) of the source: the index already built from it, or a new one.
+
+        A reload (in_child) compares digests: the mtimes of a file changed in the same tick
+            as its index was written don't tell which is newer.
+        """
+        tag = words.source_tag(self.src) if in_child else None
+        for path in (self.path, self.fallback):
+            index = self._built(path, tag) if path else None
+            if index is not None:
+                return index, 0.0
+
+        path = self.path
+        if self.fallback and not os.access(os.path.dirname(os.path.abspath(path)), os.W_OK):
+            path = self.fallback
+        with build_lock(path):
+            # Another worker may have built it while this one waited for the lock
+            index = self._built(path, tag)
+            if index is not None:
+                return index, 0.0
+            t0 = time.perf_counter()
+            if in_child:
+                self._build_in_child(path)
+            else:
+                words.build_index(self.src, path)
+            return wordindex.PackedIndex(path), time.perf_counter() - t0
+
+    def _build_in_child(self, path):
+        # The suggestions too, if they were built for an earlier version
+        suggestions = os.path.splitext(path)[0] + ".sug"
+        if not os.path.exists(suggestions):
+            return run_child(words.__file__, self.src, path)
+        with build_lock(suggestions):
+            run_child(words.__file__, self.src, path, suggestions)
+
+    def check(self):
+        """Reloads (in the background) if the source changed since the current version."""
+        stat = self._source_stat()
+        if self._current is None or stat is None or stat == self._stat or self.reloading:
+            return None
+        self._stat = stat
+        if words.source_tag(self.src) == self._current.tag:
+            return None
+        return self.reload()
+
+    def info(self):
+        """The current version (if loaded), and the state of the reloads."""
+        res = self._current.info() if self._current is not None else {"version": 0}
+        res.update(reloading=self.reloading, reloads=self.reloads, last_error=self.last_error)
+        return res
+
+
+def parse_sources(text):
+    """Parses dictionaries written as "name=path,name=path"."""
+    sources = {}
+    for item in filter(None, (part.strip() for part in (text or "").split(","))):
+        name, _, path = item.partition("=")
+        sources[name.strip()] = path.strip()
+    return sources
+
+
+class Registry:
+    """Dictionaries by name, loaded on first use and unloaded, least recently used first, when
+    the loaded indexes take more than max_bytes. The pinned ones are never unloaded.
+
+    sources are {name: word list}: the index of each is built next to it (name.idx in
+        fallback_dir if that can't be written).
+    """
+
+    def __init__(self, sources=None, max_bytes=None, fallback_dir="/tmp", poll=0):
+        self.max_bytes = max_bytes
+        self.poll = poll
+        self._dictionaries = {}
+        self._pinned = set()
+        self._used = OrderedDict()
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watcher = None
+        for name, src in (sources or {}).items():
+            fallback = os.path.join(fallback_dir, f"{name}.idx")
+            self.add(name, Dictionary(src, os.path.splitext(src)[0] + ".idx", fallback))
+
+    def add(self, name, dictionary, pinned=False):
+        self._dictionaries[name] = dictionary
+        self._stats[name] = {"hits": 0, "loads": 0, "load_seconds": 0.0, "evictions": 0}
+        if pinned:
+            self._pinned.add(name)
+        return dictionary
+
+    def __contains__(self, name):
+        return name in self._dictionaries
+
+    def __getitem__(self, name):
+        return self._dictionaries[name]
+
+    def names(self):
+        return sorted(self._dictionaries)
+
+    def use(self, name):
+        """The current version of dictionary name, loaded if it isn't (then evicting others
+        to stay within max_bytes). Raises KeyError for an unknown name."""
+        dictionary = self._dictionaries[name]
+        stats = self._stats[name]
+        with self._lock:
+            self._used[name] = True
+            self._used.move_to_end(name)
+            version = dictionary._current
+            if version is not None:
+                stats["hits"] += 1
+                return version
+
+        t0 = time.perf_counter()
+        version = dictionary.current()
+        with self._lock:
+            stats["loads"] += 1
+            stats["load_seconds"] = time.perf_counter() - t0
+        self._evict(keep=name)
+        return version
+
+    def _evict(self, keep):
+        with self._lock:
+            versions = [d._current for d in self._dictionaries.values()]
+            total = sum(version.nbytes for version in versions if version is not None)
+            for name in list(self._used):
+                if self.max_bytes is None or total <= self.max_bytes:
+                    break
+                version = self._dictionaries[name]._current
+                if name == keep or name in self._pinned or version is None:
+                    continue
+                total -= version.nbytes
+                self._dictionaries[name].unload()
+                del self._used[name]
+                self._stats[name]["evictions"] += 1
+
+    def start(self):
+        """Starts the watcher thread, if poll is set. Returns self."""
+        if self.poll > 0 and self._watcher is None:
+            self._watcher = threading.Thread(
+                target=self._watch, name="ttweak-dictionary", daemon=True
+            )
+            self._watcher.start()
+        return self
+
+    def _watch(self):
+        while not self._stop.wait(self.poll):
+            for dictionary in list(self._dictionaries.values()):
+                try:
+                    dictionary.check()
+                except Exception:
+                    # The source is being replaced, or gone: look again next time
+                    pass
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        """Per dictionary: whether it is loaded, its size, load time, hits, loads, evictions."""
+        res = {}
+        total = 0
+        for name in self.names():
+            version = self._dictionaries[name]._current
+            nbytes = version.nbytes if version is not None else 0
+            total += nbytes
+            res[name] = dict(
+                self._stats[name],
+                loaded=version is not None,
+                bytes=nbytes,
+                entries=len(version.index) if version is not None else 0,
+                version=version.number if version is not None else 0,
+            )
+        return {"bytes": total, "max_bytes": self.max_bytes, "dictionaries": res}
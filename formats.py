@@ -0,0 +1,222 @@
+""" Response formats, chosen by the Accept header of the request.
+
+    application/json                 the default (encoded by orjson)
+    application/msgpack              the same structure, in MessagePack (or application/x-msgpack)
+    application/vnd.ttweak.frames    lists of strings or of integers only (see below)
+
+A client lists the formats it takes in Accept, with q values as usual: the response comes in
+    the first of them that can hold it, and in JSON when none can (*/*, a missing header, or
+    only formats t-tweak doesn't have). Errors are always JSON.
+
+Frames hold one list: the bare list, or the "res" of {"res": [...]}. Integers are little-endian:
+    kind        1 byte, "s" for strings or "i" for integers
+    width       1 byte, the size of each length or integer below: 1, 2, 4 or 8
+    count       4 bytes, unsigned
+    "s"         count lengths (unsigned), then the utf-8 bytes of the strings, joined
+    "i"         count integers (signed)
+    The width is the smallest that fits them all.
+    The kind comes from the response model of the route, so an empty list has the right one.
+
+NegotiationMiddleware reads the header once per request; render encodes in the chosen format.
+"""
+
+import sys
+import struct
+import contextvars
+from array import array
+
+import orjson
+import msgpack
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+FRAMES = "application/vnd.ttweak.frames"
+
+ALIASES = {JSON: JSON, MSGPACK: MSGPACK, "application/x-msgpack": MSGPACK, FRAMES: FRAMES}
+
+FRAME = struct.Struct("<cBI")
+# Array type codes by width, for lengths (unsigned) and integers (signed)
+UNSIGNED = {1: "B", 2: "H", 4: "I", 8: "Q"}
+SIGNED = {1: "b", 2: "h", 4: "i", 8: "q"}
+
+# The formats the current request takes, best first: JSON is always last
+_accepted = contextvars.ContextVar("ttweak_accepted", default=(JSON,))
+_parsed = {}
+# The ASGI scope of the current request: the router adds the route to it
+_scope = contextvars.ContextVar("ttweak_scope", default=None)
+# Frame kinds by response model
+_kinds = {}
+
+
+def accepted(header):
+    """The formats of an Accept header (bytes), best first, each once, ending with JSON."""
+    found = _parsed.get(header)
+    if found is None:
+        ranked = []
+        for i, item in enumerate(header.decode("latin-1").split(",")):
+            media, *params = (part.strip() for part in item.split(";"))
+            q = 1.0
+            for param in params:
+                name, _, value = param.partition("=")
+                if name.strip() == "q":
+                    try:
+                        q = float(value)
+                    except ValueError:
+                        q = 0.0
+            media = ALIASES.get(media.lower())
+            if media and q > 0:
+                ranked.append((-q, i, media))
+        found = []
+        for _, _, media in sorted(ranked):
+            if media not in found:
+                found.append(media)
+        if JSON not in found:
+            found.append(JSON)
+        found = tuple(found)
+        if len(_parsed) > 1000:
+            # Clients send few different headers: this only guards against junk
+            _parsed.clear()
+        _parsed[header] = found
+    return found
+
+
+def current():
+    return _accepted.get()
+
+
+def _packed(kind, codes, values, low, high):
+    """The frame of values, in the narrowest of codes that holds low and high; None if none."""
+    for width, code in codes.items():
+        bits = 8 * width - (codes is SIGNED)
+        if -(1 << bits) <= low and high < 1 << bits:
+            numbers = array(code, values)
+            if sys.byteorder != "little":
+                numbers.byteswap()
+            return FRAME.pack(kind, width, len(numbers)) + numbers.tobytes()
+    return None
+
+
+def encode_frames(content, kind=None):
+    """The frames of content, or None if it isn't a list of strings or of integers.
+
+    kind (b"s" or b"i") is the one the list must have, when known: otherwise it comes from
+        the items, and an empty list is one of strings.
+    """
+    items = content.get("res") if type(content) is dict and len(content) == 1 else content
+    if type(items) is not list:
+        return None
+    try:
+        if kind == b"i":
+            raise TypeError
+        # Fails unless all are strings: checks them as it goes
+        text = "".join(items)
+    except TypeError:
+        if kind == b"s" or not all(type(item) is int for item in items):
+            return None
+        return _packed(b"i", SIGNED, items, min(items, default=0), max(items, default=0))
+    data = text.encode("utf-8")
+    if len(data) == len(text):
+        # ASCII: a length in characters is one in bytes
+        lengths = list(map(len, items))
+    else:
+        lengths = [len(item.encode("utf-8")) for item in items]
+    return _packed(b"s", UNSIGNED, lengths, 0, max(lengths, default=0)) + data
+
+
+def decode_frames(data):
+    """The list that encode_frames encoded."""
+    kind, width, count = FRAME.unpack_from(data)
+    pos = FRAME.size
+    codes = SIGNED if kind == b"i" else UNSIGNED
+    numbers = array(codes[width], data[pos : pos + width * count])
+    if sys.byteorder != "little":
+        numbers.byteswap()
+    if kind == b"i":
+        return numbers.tolist()
+    lengths = numbers
+    pos += width * count
+    items = []
+    for length in lengths:
+        items.append(data[pos : pos + length].decode("utf-8"))
+        pos += length
+    return items
+
+
+encoders = {
+    JSON: orjson.dumps,
+    MSGPACK: msgpack.packb,
+    FRAMES: encode_frames,
+}
+
+
+def route_kind():
+    """The frame kind of the current route's response model; None if it doesn't have one."""
+    scope = _scope.get()
+    model = getattr(scope and scope.get("route"), "response_model", None)
+    if model is None:
+        return None
+    kind = _kinds.get(model)
+    if kind is None:
+        kind = _kinds[model] = _list_kind(model.model_json_schema(), {}) or b""
+    return kind or None
+
+
+def render(content, media_types=None):
+    """(body, media type) of content, in the first of media_types (by default, those the
+    request accepts) that can hold it."""
+    for media in media_types or _accepted.get():
+        if media == FRAMES:
+            body = encode_frames(content, route_kind())
+        else:
+            body = encoders[media](content)
+        if body is not None:
+            return body, media
+
+
+class NegotiationMiddleware:
+    """ASGI middleware noting the formats each request accepts, for render."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            for name, value in scope["headers"]:
+                if name == b"accept":
+                    token = _accepted.set(accepted(value))
+                    # Frames need the route, which the router adds to this same scope
+                    scoped = _scope.set(scope)
+                    try:
+                        return await self.app(scope, receive, send)
+                    finally:
+                        _scope.reset(scoped)
+                        _accepted.reset(token)
+        return await self.app(scope, receive, send)
+
+
+def _list_kind(schema, components):
+    """The frame kind of a JSON schema of a list of strings or integers, bare or as
+    {"res": [...]}; None for any other schema."""
+    if "$ref" in schema:
+        schema = components.get(schema["$ref"].rsplit("/", 1)[-1], {})
+    properties = schema.get("properties")
+    if properties is not None and list(properties) == ["res"]:
+        schema = properties["res"]
+    if schema.get("type") != "array":
+        return None
+    return {"string": b"s", "integer": b"i"}.get(schema.get("items", {}).get("type"))
+
+
+def document(openapi):
+    """Adds the other formats to the 200 responses of an OpenAPI schema that has JSON."""
+    components = openapi.get("components", {}).get("schemas", {})
+    for operations in openapi.get("paths", {}).values():
+        for operation in operations.values():
+            content = operation.get("responses", {}).get("200", {}).get("content", {})
+            if JSON not in content:
+                continue
+            schema = content[JSON].get("schema", {})
+            content[MSGPACK] = {"schema": schema}
+            if _list_kind(schema, components):
+                content[FRAMES] = {"schema": {"type": "string", "format": "binary"}}
+    return openapi
@@ -0,0 +1,289 @@
+""" An append-only log kept in a directory of fixed-size segment files, shared by all workers.
+
+    <directory>/000000000001.log    the oldest segment still kept
+    <directory>/000000000002.log
+    ...                             the last one is the active segment, appended to
+    <directory>/.lock               flock: shared to read, exclusive to append or rotate
+
+One entry is one line (newlines and backslashes in an entry are escaped). Appending writes
+    at the end of the active segment only: its cost doesn't depend on how much is kept. Once
+    a segment would grow past segment_bytes, a new one is started, and the oldest are
+    deleted beyond max_segments, max_bytes, or max_age seconds (checked at each rotation).
+
+Each process keeps an index of every segment: its number of lines, and the offset of one
+    line in every INDEX_EVERY. It is built once when the log is opened, then only extended
+    with what the other processes appended since. A tail query finds its segments by their
+    line counts, newest first, and reads only the bytes of the lines it returns: the last K
+    entries cost the same whatever the size of the log.
+
+A crash in the middle of an append can leave a partial last line: it is never indexed (nor
+    returned), and the next append starts a new segment rather than end that line.
+"""
+
+import os
+import time
+import threading
+from array import array
+
+# "fcntl" is a linux module: in Windows it doesn't exist, and win_fctl stands in for it.
+try:
+    import fcntl
+except ModuleNotFoundError:
+    import win_fctl as fcntl
+
+# One line offset in the index for every INDEX_EVERY lines
+INDEX_EVERY = 64
+
+
+def encode(entry):
+    return str(entry).replace("\\", "\\\\").replace("\n", "\\n").encode("utf-8") + b"\n"
+
+
+def decode(line):
+    text = line.decode("utf-8", errors="replace")
+    if "\\" not in text:
+        return text
+    parts = text.split("\\\\")
+    return "\\".join(part.replace("\\n", "\n") for part in parts)
+
+
+class Segment:
+    """What a process knows of one segment file."""
+
+    __slots__ = ("lines", "end", "offsets")
+
+    def __init__(self):
+        self.lines = 0  # complete lines
+        self.end = 0  # where the last complete line ends
+        self.offsets = array("q")  # where lines 0, INDEX_EVERY, 2 * INDEX_EVERY... start
+
+    def scan(self, data, base):
+        """Indexes the complete lines of data, read at offset base (where the last one ended)."""
+        last = data.rfind(b"\n")
+        pos = 0
+        while pos <= last:
+            if self.lines % INDEX_EVERY == 0:
+                self.offsets.append(base + pos)
+            pos = data.index(b"\n", pos) + 1
+            self.lines += 1
+        self.end = base + last + 1 if last >= 0 else self.end
+
+    def span(self, start, stop):
+        """(first byte, end) of a read that holds lines start to stop, maybe with a few more."""
+        first = self.offsets[start // INDEX_EVERY]
+        following = -(-stop // INDEX_EVERY)
+        end = self.offsets[following] if following < len(self.offsets) else self.end
+        return first, end, start // INDEX_EVERY * INDEX_EVERY
+
+
+class SegmentedLog:
+    def __init__(
+        self, directory, segment_bytes=2**20, max_segments=16, max_bytes=None, max_age=None
+    ):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_segments = max_segments
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+        self._segments = {}  # number -> Segment, oldest first
+        self._mutex = threading.Lock()
+        self._lock = None  # opened on first use, so nothing is created until then
+
+    def _path(self, number):
+        return os.path.join(self.directory, f"{number:012d}.log")
+
+    def _locked(self, how):
+        if self._lock is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._lock = os.open(os.path.join(self.directory, ".lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self._lock, how)
+
+    def _unlock(self):
+        fcntl.flock(self._lock, fcntl.LOCK_UN)
+
+    def _refresh(self):
+        """Catches the index up with the directory. Called with the file lock held."""
+        numbers = list(self._segments)
+        # Segments are only created and deleted by a rotation or a clear, and both create a
+        #   segment numbered after the last: while there is none, only the last can have grown
+        if not numbers or os.path.exists(self._path(numbers[-1] + 1)):
+            names = os.listdir(self.directory)
+            numbers = sorted(int(n[:-4]) for n in names if n.endswith(".log") and n[:-4].isdigit())
+            self._segments = {n: self._segments.get(n) or Segment() for n in numbers}
+            # A segment's last appends may have come after our last look at it
+            stale = numbers
+        else:
+            stale = numbers[-1:]
+
+        for number in stale:
+            segment = self._segments[number]
+            try:
+                with open(self._path(number), "rb") as f:
+                    size = os.fstat(f.fileno()).st_size
+                    if size > segment.end:
+                        f.seek(segment.end)
+                        segment.scan(f.read(size - segment.end), segment.end)
+            except FileNotFoundError:
+                del self._segments[number]
+
+    def _start_segment(self):
+        number = max(self._segments, default=0) + 1
+        os.close(os.open(self._path(number), os.O_WRONLY | os.O_CREAT, 0o644))
+        self._segments[number] = Segment()
+        return number
+
+    def _retain(self):
+        """Deletes the oldest segments beyond the limits. The active one is always kept."""
+        now = time.time()
+        numbers = list(self._segments)[:-1]
+        total = sum(s.end for s in self._segments.values())
+        for number in numbers:
+            segment = self._segments[number]
+            path = self._path(number)
+            expired = False
+            if self.max_age is not None:
+                try:
+                    expired = os.path.getmtime(path) < now - self.max_age
+                except FileNotFoundError:
+                    expired = True
+            too_many = len(self._segments) > self.max_segments
+            too_big = self.max_bytes is not None and total > self.max_bytes
+            if not (expired or too_many or too_big):
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= segment.end
+            del self._segments[number]
+
+    def append(self, entries):
+        """Appends entries (strings) at the end of the log, in one write."""
+        data = b"".join(encode(e) for e in entries)
+        if not data:
+            return
+        with self._mutex:
+            self._locked(fcntl.LOCK_EX)
+            try:
+                self._refresh()
+                number = max(self._segments, default=None)
+                if number is None:
+                    number = self._start_segment()
+                else:
+                    segment = self._segments[number]
+                    size = os.path.getsize(self._path(number))
+                    # Bytes past the last complete line are what a crash left: don't end them
+                    if size != segment.end or (size and size + len(data) > self.segment_bytes):
+                        number = self._start_segment()
+                        self._retain()
+                fd = os.open(self._path(number), os.O_WRONLY | os.O_APPEND)
+                try:
+                    os.write(fd, data)
+                finally:
+                    os.close(fd)
+                segment = self._segments[number]
+                segment.scan(data, segment.end)
+            finally:
+                self._unlock()
+
+    def import_file(self, path):
+        """Appends the lines of path, a plain file of one entry per line, if this log has
+        never had a segment: the first process to open the log imports it, and only once.
+        Returns the number of entries imported."""
+        with self._mutex:
+            self._locked(fcntl.LOCK_EX)
+            try:
+                self._refresh()
+                if self._segments:
+                    return 0
+                try:
+                    with open(path, "r", encoding="utf-8", errors="replace") as f:
+                        entries = [line.rstrip("\n") for line in f]
+                except FileNotFoundError:
+                    entries = []
+                # Started even when there is nothing to import: the log has a segment now
+                number = self._start_segment()
+                data = b"".join(encode(e) for e in entries)
+                fd = os.open(self._path(number), os.O_WRONLY | os.O_APPEND)
+                try:
+                    os.write(fd, data)
+                finally:
+                    os.close(fd)
+                self._segments[number].scan(data, 0)
+                return len(entries)
+            finally:
+                self._unlock()
+
+    def tail(self, n, skip=0):
+        """The last n entries before the last skip ones, oldest first."""
+        if n <= 0:
+            return []
+        with self._mutex:
+            self._locked(fcntl.LOCK_SH)
+            try:
+                self._refresh()
+                found = []
+                for number in reversed(list(self._segments)):
+                    segment = self._segments[number]
+                    if skip >= segment.lines:
+                        skip -= segment.lines
+                        continue
+                    stop = segment.lines - skip
+                    start = max(0, stop - n)
+                    skip = 0
+                    found.append(self._read(number, segment, start, stop))
+                    n -= stop - start
+                    if not n:
+                        break
+            finally:
+                self._unlock()
+        return [entry for lines in reversed(found) for entry in lines]
+
+    def _read(self, number, segment, start, stop):
+        first, end, line = segment.span(start, stop)
+        with open(self._path(number), "rb") as f:
+            f.seek(first)
+            data = f.read(end - first)
+        lines = data.split(b"\n")
+        return [decode(l) for l in lines[start - line : stop - line]]
+
+    def __len__(self):
+        with self._mutex:
+            self._locked(fcntl.LOCK_SH)
+            try:
+                self._refresh()
+                return sum(s.lines for s in self._segments.values())
+            finally:
+                self._unlock()
+
+    def stats(self):
+        with self._mutex:
+            self._locked(fcntl.LOCK_SH)
+            try:
+                self._refresh()
+                return {
+                    "segments": len(self._segments),
+                    "entries": sum(s.lines for s in self._segments.values()),
+                    "bytes": sum(s.end for s in self._segments.values()),
+                }
+            finally:
+                self._unlock()
+
+    def clear(self):
+        """Deletes every entry. The next segment is numbered after the deleted ones, so that
+        the other processes see the change."""
+        with self._mutex:
+            self._locked(fcntl.LOCK_EX)
+            try:
+                self._refresh()
+                numbers = list(self._segments)
+                self._start_segment()
+                for number in numbers:
+                    try:
+                        os.remove(self._path(number))
+                    except FileNotFoundError:
+                        pass
+                    del self._segments[number]
+            finally:
+                self._unlock()
@@ -1,26 +1,39 @@
 """ All the t-tweak functions. Called "main" to fit most uvicorn's server standard tutorials."""
 
 import os
+import json
 import string
 import random
+import secrets
 import datetime
-from typing import List
-
-from fastapi import FastAPI, Path, Query, HTTPException, status as http_status, Request
-from fastapi.responses import Response, JSONResponse, FileResponse, PlainTextResponse
+import contextlib
+from typing import Dict, List, Literal
+
+from fastapi import FastAPI, Path, Query, HTTPException, status as http_status, Request, Header
+from fastapi.responses import (
+    Response,
+    FileResponse,
+    PlainTextResponse,
+    StreamingResponse,
+)
 from starlette.middleware.sessions import SessionMiddleware
-from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field
+import anyio
 
 # The "extra" module is for external functions that are considered out of the programmer's control.
 import extra
-
-# "fcntl" is a linux module, important to control file access in a multi-client web server.
-#   In Windows it doesn't exist, and for students to run locally we invented a mock for
-#   the module. Adds but a tiny risk of concomitant write to logs, a non issue.
-try:
-    import fcntl
-except ModuleNotFoundError:
-    import win_fctl as fcntl
+import words
+import tweaks
+import streams
+import search
+import metrics
+import formats
+import admission
+from dictionary import Dictionary, Registry, parse_sources
+from writer import LogWriter
+from counter import BufferedCounter, open_counter
+from cache import LRUCache, ResponseCache, parse_limits
 
 branch_name = "review"
 description = """
@@ -28,7 +41,22 @@ T-Tweak helps you tweak text! 🖉
 
 ### All functions log their usage, so don't write anything secret!
 """
+
+
+# The tweaks are "async def" and run on the event loop: their work takes microseconds, and
+#   logging and counting only touch memory (see writer.py and counter.py). Routes that read
+#   files or compute for longer (storage, batches, word searches...) are plain "def", and run
+#   in a pool of TTWEAK_THREADS threads (40 by default).
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    if os.environ.get("TTWEAK_THREADS"):
+        threads = anyio.to_thread.current_default_thread_limiter()
+        threads.total_tokens = int(os.environ["TTWEAK_THREADS"])
+    yield
+
+
 app = FastAPI(
+    lifespan=lifespan,
     title="T-Tweak API",
     description=description,
     version="0.0.1",
@@ -37,6 +65,56 @@ app = FastAPI(
     },
     swagger_ui_parameters={"defaultModelsExpandDepth": -1},
 )
+# Every route counts and times its requests, for GET /metrics. See metrics.py.
+app.router.route_class = metrics.MetricsRoute
+_openapi = app.openapi
+
+
+def openapi():
+    """The OpenAPI schema, with the other formats of each response (see formats.py)."""
+    if app.openapi_schema is None:
+        formats.document(_openapi())
+    return app.openapi_schema
+
+
+app.openapi = openapi
+
+# One request in every TTWEAK_PROFILE_EVERY is profiled (see profiling.py), when set. The
+#   results are written to TTWEAK_PROFILE_DIR, and GET /profile/top gives them to whoever
+#   sends the X-Profile-Token header with the value of TTWEAK_PROFILE_TOKEN.
+profile_every = int(os.environ.get("TTWEAK_PROFILE_EVERY", 0))
+profile_dir = os.environ.get(
+    "TTWEAK_PROFILE_DIR", "/tmp/profiles" if os.environ.get("VERCEL") else "logs/profiles"
+)
+profiler = None
+if profile_every > 0:
+    # Only imported when on: cProfile and pstats would add to every cold start
+    import profiling
+
+    profiler = profiling.Profiler(profile_every, profile_dir)
+
+    class ProfiledMetricsRoute(profiling.ProfiledRoute, metrics.MetricsRoute):
+        pass
+
+    app.router.route_class = ProfiledMetricsRoute
+
+# Admission control (see admission.py): each class of routes lets in at most so many requests
+#   at once (the defaults, or as in TTWEAK_ADMISSION_LIMITS: "words=16,storage=8"), with up
+#   to TTWEAK_ADMISSION_QUEUE more waiting in line. Past that, or once the line has been
+#   waiting more than TTWEAK_ADMISSION_TARGET seconds, or a request itself more than
+#   TTWEAK_ADMISSION_TIMEOUT, requests are answered 503 at once. TTWEAK_RATE (requests per
+#   second) and TTWEAK_RATE_BURST limit each client. TTWEAK_ADMISSION=0 turns it all off.
+admission_control = None
+if os.environ.get("TTWEAK_ADMISSION", "1") != "0":
+    admission_control = admission.Admission(
+        limits=parse_limits(os.environ.get("TTWEAK_ADMISSION_LIMITS")),
+        max_queue=int(os.environ.get("TTWEAK_ADMISSION_QUEUE", 256)),
+        target=float(os.environ.get("TTWEAK_ADMISSION_TARGET", 0.05)),
+        timeout=float(os.environ.get("TTWEAK_ADMISSION_TIMEOUT", 1.0)),
+        rate=float(os.environ.get("TTWEAK_RATE", 0)),
+        burst=int(os.environ["TTWEAK_RATE_BURST"]) if os.environ.get("TTWEAK_RATE_BURST") else None,
+    )
+
 ttweak_key = "course67778isthebestinhuji"
 
 random_seed = 5
@@ -63,75 +141,213 @@ class ListIntOut(BaseModel):
     res: List[int]
 
 
+class PageStringOut(BaseModel):
+    res: List[str]
+    total: int
+
+
+class DictListIntOut(BaseModel):
+    res: Dict[str, List[int]]
+
+
 class Message(BaseModel):
     detail: str
 
 
+class FindManyIn(BaseModel):
+    haystack: str
+    needles: List[str] = Field(..., min_length=1, max_length=10000)
+
+
+class BodyStreamingResponse(StreamingResponse):
+    """A streaming response whose content is produced while the request body is still read.
+
+    StreamingResponse also listens for a client disconnect, and that listener would eat
+        the request body messages before the content generator gets them.
+    """
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+class NDJSONResponse(BodyStreamingResponse):
+    """One JSON document per line, whatever the Accept header of the request."""
+
+    media_type = "application/x-ndjson"
+
+
+class BatchIn(BaseModel):
+    op: Literal[tuple(tweaks.operations)]
+    items: List[str]
+
+
 # ## ### ### ### ###
 # Logging files and the functions that fill them
 
 # Use /tmp for serverless environments like Vercel (filesystem is read-only except /tmp)
 count_file = "/tmp/count.cnt" if os.environ.get("VERCEL") else "logs/count.cnt"
-hist_file = "/tmp/history.txt" if os.environ.get("VERCEL") else "logs/history.txt"
+hist_dir = "/tmp/history" if os.environ.get("VERCEL") else "logs/history"
+log_dir = "/tmp/log" if os.environ.get("VERCEL") else "logs/log"
+# The anagram index ships prebuilt (see words.py). Where it can't be rebuilt if it doesn't
+#   match words.txt (Vercel's code is read-only), one is built in /tmp instead.
+anagram_index_file = words.index_file
+anagram_index_fallback = "/tmp/words.idx"
+# /anagrams can use other word lists than words.txt ("words"), named in TTWEAK_DICTIONARIES
+#   as "name=path,name=path". Each is loaded on first use, and the least recently used are
+#   unloaded once they take more than TTWEAK_DICTIONARY_BYTES in all (words never is).
+# The dictionaries are reloaded, without a restart, when their word lists change: they are
+#   checked every TTWEAK_DICTIONARY_POLL seconds (0 to only reload from the admin route).
+#   The admin routes are for whoever sends the X-Admin-Token header with the value of
+#   TTWEAK_ADMIN_TOKEN (when it isn't set, nobody). See dictionary.py
+default_dictionary = "words"
+dictionaries = Registry(
+    parse_sources(os.environ.get("TTWEAK_DICTIONARIES")),
+    max_bytes=int(os.environ.get("TTWEAK_DICTIONARY_BYTES", 64 * 2**20)),
+    poll=float(os.environ.get("TTWEAK_DICTIONARY_POLL", 2)),
+)
+dictionary = dictionaries.add(
+    default_dictionary,
+    Dictionary(
+        words.source,
+        anagram_index_file,
+        anagram_index_fallback,
+        shared=os.environ.get("TTWEAK_ANAGRAM_SHM"),
+    ),
+    pinned=True,
+)
+dictionaries.start()
+
+
+# Requests only queue their log lines and history in memory; the writer thread
+#   appends them in batches to two segmented logs, shared by the workers. Each keeps up to
+#   TTWEAK_LOG_SEGMENTS segments of TTWEAK_LOG_SEGMENT_BYTES, and, if set, no more than
+#   TTWEAK_LOG_MAX_BYTES in all and nothing older than TTWEAK_LOG_MAX_AGE seconds. See
+#   writer.py and logstore.py.
+log_retention = {
+    "segment_bytes": int(os.environ.get("TTWEAK_LOG_SEGMENT_BYTES", 2**20)),
+    "max_segments": int(os.environ.get("TTWEAK_LOG_SEGMENTS", 16)),
+    "max_bytes": int(os.environ["TTWEAK_LOG_MAX_BYTES"])
+    if os.environ.get("TTWEAK_LOG_MAX_BYTES")
+    else None,
+    "max_age": float(os.environ["TTWEAK_LOG_MAX_AGE"])
+    if os.environ.get("TTWEAK_LOG_MAX_AGE")
+    else None,
+}
+# Before, the log and the history were single files: what they hold is imported into the
+#   segmented logs when those are first created.
 log_file = "/tmp/log.log" if os.environ.get("VERCEL") else "logs/log.log"
+hist_file = "/tmp/history.txt" if os.environ.get("VERCEL") else "logs/history.txt"
+writer = LogWriter(
+    log_dir, hist_dir, log_file=log_file, hist_file=hist_file, **log_retention
+).start()
+
+# The largest page of history /history answers
+history_max_page = int(os.environ.get("TTWEAK_HISTORY_MAX_PAGE", 1000))
+
+# The count is shared by all the workers: "journal" (default) keeps count.cnt as text,
+#   "slot" keeps it in an 8-byte memory-mapped file. Requests only add to it in memory, and
+#   a background thread hands the increments over in batches. See counter.py.
+counter_backend = os.environ.get("TTWEAK_COUNTER", "journal")
+counter_file = count_file if counter_backend == "journal" else count_file.replace(".cnt", ".slot")
+_counter = None
+
+
+def shared_counter():
+    """The counter is opened on first use, so each worker process opens its own handle."""
+    global _counter
+    if _counter is None:
+        _counter = BufferedCounter(open_counter(counter_backend, counter_file)).start()
+    return _counter
 
 
 def count(increment=None):
     try:
-        cnt = 0
-        if os.path.isfile(count_file):
-            with open(count_file, "r") as c:
-                r = c.read()
-                cnt = int(r) if r.isnumeric() else 0
         if type(increment) is int:
-            with open(count_file, "w+") as c:
-                fcntl.flock(c, fcntl.LOCK_EX)
-                c.write(str(cnt + 1))
-                fcntl.flock(c, fcntl.LOCK_UN)
-        return cnt
+            return shared_counter().add(increment) - increment
+        return shared_counter().get()
     except Exception:
         # Silently fail in serverless environments where filesystem may be restricted
         return 0
 
 
+# Where the storage machine of each session is kept: "shared" (default, a memory-mapped file
+#   for all the workers), "sqlite", "memory" (one worker only), or "cookie", the whole machine
+#   in the session cookie (the default on Vercel, where nothing else outlives an instance).
+#   See session_store.py.
+# TTWEAK_STORAGE_FILE is the file of the "shared" and "sqlite" stores. By default, logs/storage.db
+#   for sqlite, and for shared a file in /dev/shm named after the working directory, so that
+#   two deployments on one machine never share one.
+storage_backend = os.environ.get(
+    "TTWEAK_STORAGE", "cookie" if os.environ.get("VERCEL") else "shared"
+)
+storage_file = os.environ.get("TTWEAK_STORAGE_FILE")
+_session_store = None
+
+
+def machine_store():
+    """The store is opened on first use, like the counter; None when state stays in cookies."""
+    global _session_store
+    if _session_store is None and storage_backend != "cookie":
+        # Imported here, like the store is opened: sqlite3 is slow to import
+        import session_store
+
+        if storage_backend == "sqlite":
+            args = (storage_file or "logs/storage.db",)
+        else:
+            args = (storage_file,) if storage_backend == "shared" else ()
+        _session_store = session_store.open_store(storage_backend, *args)
+    return _session_store
+
+
+# Responses of the pure tweaks, already encoded, by route and parameters. Each route gets
+#   TTWEAK_RESPONSE_CACHE_BYTES (or its own limit, as "route=bytes,..." in
+#   TTWEAK_RESPONSE_CACHE_LIMITS), and entries expire after TTWEAK_RESPONSE_CACHE_TTL seconds
+#   if set. A hit still logs and counts: only the tweak and the encoding are skipped.
+responses = ResponseCache(
+    default_bytes=int(os.environ.get("TTWEAK_RESPONSE_CACHE_BYTES", 4 * 2**20)),
+    limits=parse_limits(os.environ.get("TTWEAK_RESPONSE_CACHE_LIMITS")),
+    ttl=float(os.environ["TTWEAK_RESPONSE_CACHE_TTL"])
+    if os.environ.get("TTWEAK_RESPONSE_CACHE_TTL")
+    else None,
+)
+
+
+# Responses come in the format the request asks for in its Accept header: JSON by default,
+#   or MessagePack, or frames for lists. See formats.py.
+def reply(content, status_code=200):
+    body, media_type = formats.render(content)
+    return Response(
+        content=body, media_type=media_type, status_code=status_code, headers={"vary": "Accept"}
+    )
+
+
+def cached_reply(route, params, tweak):
+    """The response {"res": tweak()}, encoded only the first time params are seen (in each
+    set of accepted formats)."""
+    accepted = formats.current()
+    found = responses.get(route, (params, accepted))
+    if found is None:
+        found = formats.render({"res": tweak()}, accepted)
+        responses.put(route, (params, accepted), *found)
+    return Response(content=found[0], media_type=found[1], headers={"vary": "Accept"})
+
+
 def history(new_string=None):
-    try:
-        hist = []
-        if os.path.isfile(hist_file):
-            with open(hist_file, "r") as h:
-                hist = h.readlines()
-        if new_string:
-            hist.append(f"{new_string}\n")
-            with open(hist_file, "w") as h:
-                fcntl.flock(h, fcntl.LOCK_EX)
-                h.writelines(hist[-50:])
-                fcntl.flock(h, fcntl.LOCK_UN)
-
-        return [h.strip() for h in hist]
-    except Exception:
-        # Silently fail in serverless environments where filesystem may be restricted
-        return []
+    return writer.history(new_string)
 
 
 def log(msg):
-    try:
-        items = []
-        if os.path.isfile(log_file):
-            with open(log_file, "r") as l:
-                items = l.readlines()
-        if msg:
-            items.append(f"{datetime.datetime.now().strftime('%c')} {str(msg)}\n")
-            with open(log_file, "w") as l:
-                fcntl.flock(l, fcntl.LOCK_EX)
-                l.writelines(items[-250:])
-                fcntl.flock(l, fcntl.LOCK_UN)
-    except Exception:
-        # Silently fail in serverless environments where filesystem may be restricted
-        pass
+    writer.log(msg)
 
-log("Starting T-Tweak")
 
+# The only line logged at startup: like all the others it is queued, and written by the
+#   writer thread with the first batch
+log(f"Starting T-Tweak, random seed {random_seed}")
 
+
+@metrics.phase("log")
 def log_count_history(l=True, h=True, c=True, **kwargs):
     msg = kwargs.get("msg", None)
     if msg:
@@ -147,20 +363,15 @@ def log_count_history(l=True, h=True, c=True, **kwargs):
 # ## ### ### ### ###
 # REST Functions and their responses
 
-# ## ### ### ### ###
-# REST Functions and their responses
-
-log("Starting T-Tweak")
-
 
 @app.get("/", response_model=StringOut)
-def root():
+async def root():
     """Provides status of the t-tweak service.
 
     Return Type: str"""
     log("root")
 
-    return JSONResponse(content={"Status": f"Operational ({branch_name})"})
+    return reply({"Status": f"Operational ({branch_name})"})
 
 
 @app.get("/robots.txt", include_in_schema=False)
@@ -185,44 +396,160 @@ def count_all():
     """
     log(f"count all")
 
-    return JSONResponse(content={"res": count()})
+    return reply({"res": count()})
 
 
-@app.get("/history", response_model=ListStringOut)
-def get_history():
+@app.get("/history", response_model=List[str])
+def get_history(
+    page: int = Query(0, description="Page of history, from the latest (starts at 0)", ge=0),
+    size: int = Query(50, description="Entries per page", ge=1, le=history_max_page),
+):
     """The history of text tweaks serviced by t-tweak is returned by this function.
 
+    The last "size" entries, oldest first; page 1 are the "size" entries before them, and so on.
+
     Return Type: str
     """
     log("get_history")
 
-    return JSONResponse(content=history())
+    return reply(writer.tail(size, page))
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Request counts, errors, latency histograms and requests in flight, per route, in the
+    Prometheus text format.
+
+    Return Type: text
+    """
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/profile/top", include_in_schema=False)
+def profile_top(
+    n: int = Query(20, ge=1, le=500),
+    route: str = None,
+    x_profile_token: str = Header(None),
+):
+    """The functions where profiled requests spent most of their time, per route or overall.
+
+    Return Type: dict
+    """
+    if profiler is None:
+        raise HTTPException(status_code=http_status.HTTP_404_NOT_FOUND, detail="Profiling is off")
+    token = os.environ.get("TTWEAK_PROFILE_TOKEN", "")
+    if not token or not secrets.compare_digest(token, x_profile_token or ""):
+        raise HTTPException(status_code=http_status.HTTP_403_FORBIDDEN, detail="Bad profile token")
+
+    return reply({"res": profiler.top(n, route)})
+
+
+def check_admin(x_admin_token):
+    token = os.environ.get("TTWEAK_ADMIN_TOKEN", "")
+    if not token or not secrets.compare_digest(token, x_admin_token or ""):
+        raise HTTPException(status_code=http_status.HTTP_403_FORBIDDEN, detail="Bad admin token")
+
+
+def named_dictionary(name):
+    if name not in dictionaries:
+        raise HTTPException(
+            status_code=http_status.HTTP_404_NOT_FOUND, detail=f"No dictionary named {name}"
+        )
+    return dictionaries[name]
+
+
+@app.get("/admin/dictionary", include_in_schema=False)
+def dictionary_info(
+    name: str = Query(default_dictionary, alias="dict"), x_admin_token: str = Header(None)
+):
+    """The version of a dictionary in use: its number, the digest of its word list, its
+    number of entries (anagram keys), how long it took to build, and when it was loaded.
+
+    Return Type: dict
+    """
+    check_admin(x_admin_token)
+
+    return reply({"res": named_dictionary(name).info()})
+
+
+@app.post("/admin/dictionary/reload", status_code=202, include_in_schema=False)
+def dictionary_reload(
+    name: str = Query(default_dictionary, alias="dict"), x_admin_token: str = Header(None)
+):
+    """Starts reloading a dictionary from its word list, in the background. The requests go
+    on with the current version until the new one is ready: GET /admin/dictionary tells when.
+
+    Return Type: dict
+    """
+    check_admin(x_admin_token)
+    log(f"dictionary reload {name}")
+
+    found = named_dictionary(name)
+    found.reload()
+    return reply({"res": found.info()}, status_code=202)
+
+
+@app.get("/dictionaries/stats")
+async def dictionary_stats():
+    """The dictionaries /anagrams can use: whether each is loaded, the bytes of its index,
+    how long it took to load, and its hits, loads and evictions.
+
+    Return Type: dict
+    """
+    log("dictionary stats")
+
+    return reply({"res": dictionaries.stats()})
+
+
+@app.get("/admission/stats")
+async def admission_stats():
+    """Per class of routes: its limit, the requests in and waiting now, and how many were
+    admitted or turned away (queue full, overload, timeout, or over the client's rate).
+
+    Return Type: dict
+    """
+    log("admission stats")
+
+    if admission_control is None:
+        return reply({"res": {}})
+    return reply({"res": admission_control.stats()})
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Hits, misses and evictions of the cache of tweak responses, in total and per route.
+
+    Return Type: dict
+    """
+    log("cache stats")
+
+    return reply({"res": responses.stats()})
 
 
 @app.get("/length/{text}", response_model=IntOut)
-def get_length(text: str = Path(..., description="Text to be measured", max_length=100)):
+async def get_length(text: str = Path(..., description="Text to be measured", max_length=100)):
     """Calculates the length of a text provided.
 
     Return Type: str
     """
     log_count_history(l=True, h=True, c=True, msg=f"length {text}", inc=1)
 
-    return JSONResponse(content={"res": str(len(text))})
+    return cached_reply("length", text, lambda: tweaks.length(text))
 
 
 @app.get("/reverse/{text}", response_model=StringOut)
-def reverse(text: str = Path(..., description="Text to be reversed", max_length=100)):
+async def reverse(text: str = Path(..., description="Text to be reversed", max_length=100)):
     """Calculates the length of a text provided. 
 
     Return Type: str
     """
     log_count_history(l=True, h=True, c=True, msg=f"reverse {text}", inc=1)
 
-    return JSONResponse(content={"res": text[::-1]})
+    return cached_reply("reverse", text, lambda: tweaks.reverse(text))
 
 
 @app.get("/upper/{text}", response_model=StringOut)
-def upper(
+async def upper(
     text: str = Path(..., description="Text to convert to upper case")
 ):
     """Converts a text to all-uppercase.
@@ -231,11 +558,11 @@ def upper(
     """
     log_count_history(l=True, h=True, c=True, msg=f"upper {text}", inc=1)
 
-    return JSONResponse(content={"res": text.upper()})
+    return cached_reply("upper", text, lambda: tweaks.upper(text))
 
 
 @app.get("/tolower/{text}", response_model=StringOut)
-def tolower(
+async def tolower(
     text: str = Path(..., description="Text to convert to lower case", max_length=100)
 ):
     """Converts a text to all lowercase.
@@ -244,11 +571,11 @@ def tolower(
     """
     log_count_history(l=True, h=True, c=True, msg=f"lower {text}", inc=1)
 
-    return JSONResponse(content={"res": text.lower()})
+    return cached_reply("tolower", text, lambda: tweaks.lower(text))
 
 
 @app.get("/mix_case/{text}", response_model=StringOut)
-def mix_case(
+async def mix_case(
     text: str = Path(..., description="Text to alternate cases", max_length=100)
 ):
     """Text will have the case of its letters alternate between lower and upper case.
@@ -259,13 +586,116 @@ def mix_case(
     """
     log_count_history(l=True, h=True, c=True, msg=f"mix_case {text}", inc=1)
 
-    res = "".join([l.upper() if i % 2 else l.lower() for i, l in enumerate(text)])
+    return cached_reply("mix_case", text, lambda: tweaks.mix_case(text))
 
-    return JSONResponse(content={"res": res})
+
+def check_batch_item(op, i, text):
+    max_length = tweaks.operations[op][1]
+    if type(text) is not str:
+        return f"Item {i} is not a string"
+    if max_length is not None and len(text) > max_length:
+        return f"Item {i} is longer than {max_length} characters"
+    return None
+
+
+@app.post(
+    "/batch",
+    response_model=ListStringOut,
+    responses={422: {"model": Message, "description": "An item is too long"}},
+)
+def batch(body: BatchIn):
+    """Applies one tweak (length, reverse, upper, tolower or mix_case) to many texts.
+
+    Each text has the same limits as in the single tweak. Results come back in order.
+
+    Return Type: list[str]
+    """
+    for i, text in enumerate(body.items):
+        error = check_batch_item(body.op, i, text)
+        if error:
+            raise HTTPException(status_code=422, detail=error)
+
+    log_count_history(
+        l=True, h=True, c=True, msg=f"batch {body.op} {len(body.items)}", inc=len(body.items)
+    )
+
+    tweak = tweaks.operations[body.op][0]
+    return reply({"res": [tweak(text) for text in body.items]})
+
+
+def batch_line(op, i, line):
+    try:
+        text = json.loads(line)
+    except ValueError:
+        text = None
+    error = check_batch_item(op, i, text)
+    return {"detail": error} if error else {"res": tweaks.operations[op][0](text)}
+
+
+@app.post("/batch/stream", response_class=NDJSONResponse)
+async def batch_stream(
+    request: Request,
+    op: Literal[tuple(tweaks.operations)] = Query(..., description="Tweak to apply"),
+):
+    """Applies one tweak to a stream of texts, sent as NDJSON (one JSON string per line).
+
+    Answers with NDJSON as well, one line per input line and in the same order:
+        {"res": result}, or {"detail": reason} for a text that can't be tweaked.
+    """
+    async def results():
+        done = 0
+        tail = b""
+        try:
+            async for chunk in request.stream():
+                lines = (tail + chunk).split(b"\n")
+                tail = lines.pop()
+                out = []
+                for line in lines:
+                    if line.strip():
+                        out.append(batch_line(op, done, line))
+                        done += 1
+                if out:
+                    yield "".join(json.dumps(o) + "\n" for o in out)
+            if tail.strip():
+                yield json.dumps(batch_line(op, done, tail)) + "\n"
+                done += 1
+        finally:
+            log_count_history(l=True, h=True, c=True, msg=f"batch {op} {done}", inc=done)
+
+    return NDJSONResponse(results())
+
+
+@app.post("/stream/{op}", response_class=PlainTextResponse)
+async def stream_tweak(
+    request: Request,
+    op: Literal[tuple(streams.operations)] = Path(..., description="Tweak to apply"),
+):
+    """Tweaks a text of any size, sent as the request body (utf-8) instead of in the path.
+
+    The result is streamed back as it is produced: the tweaked text, or for "length" the
+        same JSON as /length.
+    """
+    received = 0
+
+    async def body():
+        nonlocal received
+        async for chunk in request.stream():
+            received += len(chunk)
+            yield chunk
+
+    async def results():
+        try:
+            async for chunk in streams.operations[op](body()):
+                yield chunk
+        finally:
+            log_count_history(l=True, h=True, c=True, msg=f"stream {op} {received} bytes", inc=1)
+
+    media_type = "application/json" if op == "length" else "text/plain; charset=utf-8"
+    return BodyStreamingResponse(results(), media_type=media_type)
 
 
 @app.get("/find/{string}/{sub}", response_model=ListIntOut)
-def find(
+async def find(
     string: str = Path(
         ...,
         description="String A",
@@ -285,16 +715,38 @@ def find(
     """
     log_count_history(l=True, h=True, c=True, msg=f"find {string}, {sub}", inc=1)
 
-    here = 0
-    res = []
-    while True:
-        here = string.find(sub, here)
-        if here == -1:
-            break
-        res.append(here)
-        here += 1
+    def locations():
+        here = 0
+        res = []
+        while True:
+            here = string.find(sub, here)
+            if here == -1:
+                break
+            res.append(here)
+            here += 1
+        return res
+
+    return cached_reply("find", (string, sub), locations)
+
 
-    return JSONResponse(content={"res": res})
+@app.post("/find_many", response_model=DictListIntOut)
+def find_many(body: FindManyIn):
+    """Finds many strings inside a (large) string, all at once.
+
+    Returns, for each needle, the locations where it starts in the haystack (overlapping
+        ones too, like /find).
+
+    Return Type: dict[str, list[int]]
+    """
+    log_count_history(
+        l=True,
+        h=True,
+        c=True,
+        msg=f"find_many {len(body.needles)} needles in {len(body.haystack)} chars",
+        inc=1,
+    )
+
+    return reply({"res": search.find_many(body.haystack, body.needles)})
 
 
 @app.get(
@@ -304,7 +756,7 @@ def find(
         409: {"model": Message, "description": "Conflict (incompatible start and end)"},
     },
 )
-def substring(
+async def substring(
     string: str = Path(
         ...,
         description="A string to extract a slice from.",
@@ -329,11 +781,11 @@ def substring(
             detail=f"Conflict (incompatible start and end)",
         )
 
-    return JSONResponse(content={"res": string[start:end]})
+    return cached_reply("substring", (string, start, end), lambda: string[start:end])
 
 
 @app.get("/password/{password}", response_model=IntOut)
-def password_strength(
+async def password_strength(
     password: str = Path(
         ...,
         description="Your password. *Do not use a real one*, it gets logged and is publicly visible.",
@@ -351,10 +803,10 @@ def password_strength(
     score = 10
 
     if len(password) > 20:
-        return JSONResponse(content={"res": -1})
+        return reply({"res": -1})
 
     if len(password) == 0:
-        return JSONResponse(content={"res": -2})
+        return reply({"res": -2})
 
     # A password should be larger than 12
     if len(password) < 12:
@@ -364,7 +816,7 @@ def password_strength(
     # A password should NOT be the same letter or number repeated
     if len(set(password)) <= 1:
         score -= 7
-        return JSONResponse(content={"res": min(max(score, 0), 10)})
+        return reply({"res": min(max(score, 0), 10)})
 
     # A password should NOT be the words “password”, "admin" or "root"
     if password in ["password", "admin", "root"]:
@@ -387,11 +839,63 @@ def password_strength(
 
     log(f"password {password} {score}")
 
-    return JSONResponse(content={"res": min(max(score, 0), 10)})
+    return reply({"res": min(max(score, 0), 10)})
+
+
+@app.post("/password/bulk", response_class=NDJSONResponse)
+async def password_strength_bulk(request: Request):
+    """Strength scores for many passwords, sent as NDJSON (one JSON string per line).
+
+    Answers with NDJSON, one line per password and in the same order: {"res": score}, the
+        same score /password gives, or {"detail": reason} for a line that isn't a string.
+        The passwords themselves are not logged.
+    """
+    # NumPy takes a while to import, so only this endpoint pays for it
+    import strength
+
+    async def scored(lines):
+        passwords = []
+        for line in lines:
+            try:
+                password = json.loads(line)
+            except ValueError:
+                password = None
+            passwords.append(password if type(password) is str else None)
+
+        valid = [p for p in passwords if p is not None]
+        scores = iter((await run_in_threadpool(strength.scores, valid)).tolist())
+        return "".join(
+            json.dumps({"res": next(scores)} if p is not None else {"detail": "Not a string"})
+            + "\n"
+            for p in passwords
+        )
+
+    async def results():
+        done = 0
+        tail = b""
+        pending = []
+        try:
+            async for chunk in request.stream():
+                lines = (tail + chunk).split(b"\n")
+                tail = lines.pop()
+                pending += [line for line in lines if line.strip()]
+                if len(pending) >= 10000:
+                    yield await scored(pending)
+                    done += len(pending)
+                    pending = []
+            if tail.strip():
+                pending.append(tail)
+            if pending:
+                yield await scored(pending)
+                done += len(pending)
+        finally:
+            log_count_history(l=True, h=True, c=True, msg=f"password bulk {done}", inc=done)
+
+    return NDJSONResponse(results())
 
 
 @app.get("/counterstring/{length}/{char}", response_model=StringOut)
-def counterstring(
+async def counterstring(
     length: int = Path(
         ..., description="Size of a string to generate with the length of it being the given length and the separation string, which can be any character, is marking the location whose number is to the left of it in the string ", ge=0, le=150
     ),
@@ -412,35 +916,65 @@ def counterstring(
     )
 
     # A discussion on counterstring algorithms is available at https://www.eviltester.com/2018/05/counterstring-algorithms.html
-    # This implementation is copied from https://github.com/deefex/pyclip/blob/master/pyclip/counterstring.py
-    counterstring = ""
+    return cached_reply(
+        "counterstring", (length, char), lambda: tweaks.counterstring(length, char)
+    )
 
-    while length > 0:
-        next_count = char + str(length)[::-1]
-        if len(next_count) > length:
-            next_count = next_count[:length]
-        counterstring = counterstring + next_count
-        length -= len(next_count)
 
-    counterstring = counterstring[::-1]
+# Recent counterstrings, up to 16 MB of them. Larger ones are only ever streamed.
+counterstrings = LRUCache(max_bytes=16 * 2**20)
+counterstring_cache_limit = 2**20
 
-    return JSONResponse(content={"res": counterstring})
 
+def cached_counterstring(length, char):
+    res = counterstrings.get((length, char))
+    if res is None:
+        res = tweaks.counterstring(length, char)
+        counterstrings.put((length, char), res)
+    return res
 
-def reset_random(seed):
-    log(f"Setting seed {seed}")
-    random.seed(seed)
 
+@app.get("/counterstring/stream/{length}/{char}", response_class=PlainTextResponse)
+def counterstring_stream(
+    length: int = Path(
+        ..., description="Size of the counterstring to generate", ge=0, le=10**7
+    ),
+    char: str = Path(
+        ...,
+        description="Character to use as the counterstring measure mark",
+        max_length=100,
+    ),
+):
+    """Generates a counterstring of up to 10 million characters, streamed as plain text.
+
+    Return Type: counterstring
+    """
+    log_count_history(
+        l=True, h=True, c=True, msg=f"counterstring stream {length} {char}", inc=1
+    )
+
+    if length <= counterstring_cache_limit:
+        chunks = [cached_counterstring(length, char)]
+    else:
+        chunks = tweaks.counterstring_chunks(length, char)
+
+    return StreamingResponse(chunks, media_type="text/plain; charset=utf-8")
 
-random_seed = 5
-reset_random(random_seed)
+
+# Each session has a random stream of its own, kept in its cookie: it starts at random_seed,
+#   and /reset_server sets it back there. A request with a seed uses that stream from its
+#   start instead, and leaves the session's alone. See rng.py.
+random_key = "ttweak_random"
+random_bulk_limit = 10**7
 
 
 @app.get("/random", response_model=StringOut)
-def rand_str(
+async def rand_str(
     length: int = Query(
         ..., description="Size of the desired random string", ge=0, le=150
-    )
+    ),
+    seed: int = Query(None, description="Seed of a stream of its own for this request", ge=0),
+    request: Request = None,
 ):
     """Generates a random string of desired size.
 
@@ -448,9 +982,19 @@ def rand_str(
     """
     log_count_history(l=False, h=True, c=True, msg=f"random {length}", inc=1)
 
-    random_string = "".join(
-        random.choices(string.ascii_letters + string.digits, k=length)
-    )
+    if request is None:
+        # Called as a function, not through the server: no session
+        random_string = "".join(
+            random.choices(string.ascii_letters + string.digits, k=length)
+        )
+    else:
+        # NumPy takes a while to import, so the routes that need it import it
+        import rng
+
+        if seed is not None:
+            random_string = rng.text(seed, 0, length)
+        else:
+            random_string = rng.Stream(request.session, random_key, random_seed).take(length)
 
     # with open("random.txt", "r") as r:
     #     rnd = r.read()
@@ -477,12 +1021,56 @@ def rand_str(
 
     log(f"random {length} {random_string}")
 
-    return JSONResponse(content={"res": random_string})
+    return reply({"res": random_string})
 
 
-@app.get("/anagrams/{text}", response_model=ListStringOut)
-def anagrams(
+@app.get("/random/bulk", response_class=PlainTextResponse)
+def rand_bulk(
+    request: Request,
+    count: int = Query(..., description="Number of random strings", ge=0, le=random_bulk_limit),
+    length: int = Query(..., description="Size of each string", ge=0, le=1000),
+    seed: int = Query(None, description="Seed of a stream of its own for this request", ge=0),
+):
+    """Generates many random strings at once, one per line, streamed as plain text: up to
+    10 million characters in all. They come from the same stream as /random's.
+
+    Return Type: str
+    """
+    import rng
+
+    if count * length > random_bulk_limit:
+        raise HTTPException(
+            status_code=422, detail=f"count * length can't be more than {random_bulk_limit}"
+        )
+    log_count_history(l=True, h=True, c=True, msg=f"random bulk {count} x {length}", inc=1)
+
+    if seed is None:
+        stream = rng.Stream(request.session, random_key, random_seed)
+        seed, start = stream.seed, stream.position
+        stream.advance(count * length)
+    else:
+        start = 0
+    return StreamingResponse(
+        rng.lines(seed, start, count, length), media_type="text/plain; charset=utf-8"
+    )
+
 
+def anagram_index():
+    """The anagram index of the current dictionary, opened on first use.
+
+    When started by serve.py, the first index is in shared memory, built once for all workers.
+    """
+    return dictionary.current().index
+
+
+@app.get("/anagrams/{text}", response_model=ListStringOut)
+async def anagrams(
+    text: str = Path(..., description="Text to find anagrams for", max_length=100),
+    name: str = Query(
+        default_dictionary,
+        alias="dict",
+        description="Dictionary to look in (see /dictionaries/stats)",
+    ),
 ):
     """Finds anagrams for the text provided.
 
@@ -492,18 +1080,97 @@ def anagrams(
     """
     log_count_history(l=True, h=True, c=True, msg=f"anagrams {text}", inc=1)
 
-    import words
+    # The whole request uses the version it started with, even if a reload swaps it meanwhile
+    if named_dictionary(name).loaded:
+        version = dictionaries.use(name)
+    else:
+        # Opening (or building) the index reads files: done off the event loop
+        version = await run_in_threadpool(dictionaries.use, name)
+    text = text.lower()
+
+    def found():
+        anagrams = version.index.get(words.anagram_key(text), [])
+        if text in anagrams:
+            anagrams.remove(text)
+        return anagrams
 
-    all_words = words.words.copy()
+    return cached_reply("anagrams", (name, version.number, text), found)
 
-    text = text.lower()
-    key = "".join(sorted(text))
-    anagrams = all_words.get(key, []).copy()
 
-    if text in anagrams:
-        anagrams.remove(text)
+def word_search():
+    """The sub-anagram and pattern indexes of the current dictionary, built on first use."""
+    return dictionary.current().word_search()
+
+
+def page_of(found, page, size):
+    return reply({"res": found[page * size : (page + 1) * size], "total": len(found)})
+
+
+@app.get("/subanagrams/{letters}", response_model=PageStringOut)
+def subanagrams(
+    letters: str = Path(..., description="Letters to form words with", max_length=100),
+    page: int = Query(0, description="Page of results (starts at 0)", ge=0),
+    size: int = Query(50, description="Results per page", ge=1, le=500),
+):
+    """Finds all the words that can be formed with some of the letters provided (as in Scrabble).
+
+    Longest words come first. "total" is the number of words found, in all pages.
+
+    Return Type: list[str]
+    """
+    log_count_history(l=True, h=True, c=True, msg=f"subanagrams {letters}", inc=1)
+
+    return page_of(word_search()[0].sub_anagrams(letters), page, size)
+
+
+@app.get("/suggest/{text}", response_model=ListStringOut)
+def suggest(
+    text: str = Path(..., description="Word to suggest spellings for", max_length=50),
+    k: int = Query(2, description="Most edits (letters added, removed or changed)", ge=0, le=2),
+    limit: int = Query(10, description="Most suggestions", ge=1, le=100),
+    name: str = Query(
+        default_dictionary,
+        alias="dict",
+        description="Dictionary to look in (see /dictionaries/stats)",
+    ),
+):
+    """Suggests the dictionary words within k edits of the text provided, as a spell checker.
+
+    The closest words come first, then in alphabetical order. A word of the dictionary is its
+        own first suggestion.
+
+    Return Type: list[str]
+    """
+    log_count_history(l=True, h=True, c=True, msg=f"suggest {text}", inc=1)
+
+    named_dictionary(name)
+    version = dictionaries.use(name)
+    text = text.lower().replace("'", "")
+
+    def found():
+        return [word for word, _ in version.suggestions().suggest(text, k, limit)]
 
-    return JSONResponse(content={"res": anagrams})
+    return cached_reply("suggest", (name, version.number, text, k, limit), found)
+
+
+@app.get("/wildcard/{pattern}", response_model=PageStringOut)
+def wildcard(
+    pattern: str = Path(
+        ..., description='Pattern to match: "?" is any one letter, "*" any letters', max_length=100
+    ),
+    page: int = Query(0, description="Page of results (starts at 0)", ge=0),
+    size: int = Query(50, description="Results per page", ge=1, le=500),
+):
+    """Finds all the words that match a pattern, such as c?t* (cat, cats, cotton...).
+
+    Words come in alphabetical order. "total" is the number of words found, in all pages.
+        In a URL, "?" has to be sent encoded, as %3F.
+
+    Return Type: list[str]
+    """
+    log_count_history(l=True, h=True, c=True, msg=f"wildcard {pattern}", inc=1)
+
+    return page_of(word_search()[1].match(pattern), page, size)
 
 
 @app.get(
@@ -511,7 +1178,7 @@ def anagrams(
     responses={500: {"model": Message, "description": "Non Authoritative Information"}},
     response_model=Message,
 )
-def server_time():
+async def server_time():
     """Retrieves the server time. For debug purposes.
 
     Return Type: str
@@ -523,55 +1190,69 @@ def server_time():
         detail=f"{datetime.datetime.now().strftime('%c')}",
     )
 
-    return JSONResponse(content={"res": f"{datetime.datetime.now().strftime('%c')}"})
+    return reply({"res": f"{datetime.datetime.now().strftime('%c')}"})
 
 
 @app.get("/reset_server", response_model=StringOut)
-def server_reset():
-    """Resets the server: reinitializes history and count.
+def server_reset(request: Request):
+    """Resets the server: reinitializes history and count, and the caller's random stream.
 
     Return Type: str
     """
 
     # We reset history and count, but leave the log intact
-
+    writer.reset()
     try:
-        with open(count_file, "w") as c:
-            fcntl.flock(c, fcntl.LOCK_EX)
-            c.write("0\n")
-            fcntl.flock(c, fcntl.LOCK_UN)
-
-        with open(hist_file, "w") as h:
-            fcntl.flock(h, fcntl.LOCK_EX)
-            h.write("")
-            fcntl.flock(h, fcntl.LOCK_UN)
+        shared_counter().reset()
     except Exception:
         # Silently fail in serverless environments where filesystem may be restricted
         pass
 
-    # Reset also the random seed (results should repeat) and
-    extra.reset_random(random_seed)
+    # Reset also the caller's random stream (results should repeat), but not the others' and
+    import rng
+
+    rng.Stream(request.session, random_key, random_seed).reset(random_seed)
     log(f"Setting seed {random_seed}")
 
     # Reset and clear the storage
     machine = StateMachine(request)
     machine.act(command="stop")
+    machine.save()
 
     log_count_history(l=True, h=True, c=True, msg=f"reset_server", inc=1)
 
-    return JSONResponse(content={"res": f"Server reset"})
+    return reply({"res": f"Server reset"})
 
 
 class StateMachine:
     def __init__(self, request) -> None:
         self.session = request.session
         self.state = "not set"
+        self.store = machine_store()
 
-        machine = self.session.get(ttweak_key)
-        if not machine:
-            machine = self.session[ttweak_key] = {"state": "start", "strings": []}
+        if self.store is None:
+            machine = self.session.get(ttweak_key)
+            if not machine:
+                machine = self.session[ttweak_key] = {"state": "start", "strings": []}
+        else:
+            # The cookie only carries the session id (a machine left there by an older
+            #   version is dropped, and starts over)
+            sid = self.session.get(ttweak_key)
+            if not isinstance(sid, str):
+                sid = self.session[ttweak_key] = secrets.token_urlsafe(16)
+            self.sid = sid
+            machine = self.store.get(sid) or {"state": "start", "strings": []}
         self.machine = machine
 
+    def save(self):
+        """Keeps the machine for the next request."""
+        if self.store is None:
+            # Assigned again, as the session only sends a new cookie when a key is set
+            #   (not when a list inside it changes)
+            self.session[ttweak_key] = self.machine
+        else:
+            self.store.put(self.sid, self.machine)
+
     # start -add-> adding
     # adding -+string-> adding
     # adding -+string-> full
@@ -641,11 +1322,19 @@ def storage(
     log_count_history(l=True, h=True, c=True, msg=f"storage {command}", inc=1)
 
     machine = StateMachine(request)
-    return JSONResponse(content={"res": machine.act(command, index)})
+    res = machine.act(command, index)
+    machine.save()
+    return reply({"res": res})
 
 
 app.add_middleware(SessionMiddleware, secret_key=ttweak_key)
-log("T-Tweak Started")
+app.add_middleware(formats.NegotiationMiddleware)
+if admission_control is not None:
+    # Outside the session and format handling: turning a request away costs nothing more
+    app.add_middleware(admission.AdmissionMiddleware, admission=admission_control)
+if profiler is not None:
+    # Added last, so it is the outermost and profiles the session cookie handling too
+    app.add_middleware(profiling.ProfilingMiddleware, profiler=profiler)
 
 
 if __name__ == "__main__":
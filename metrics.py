@@ -0,0 +1,235 @@
+""" Request metrics, exported in the Prometheus text format by GET /metrics.
+
+Every route (see MetricsRoute) counts its requests by status, and times them in histograms
+    with fixed buckets: the whole request, and three of its phases,
+        validation  from the start of the route to its function being called (parameters,
+                    body and their checks, and for plain "def" routes the hop to the thread
+                    pool; a 422 only has this phase)
+        work        the route function and its response, minus the logging below
+        log         log_count_history (timed by the @phase("log") decorator)
+    plus a gauge of the requests in flight.
+
+Recording takes no lock: each thread adds into its own shard (a dict of its own lists), and
+    only the export sums the shards. Each worker process exports its own numbers.
+"""
+
+import time
+import inspect
+import functools
+import threading
+import contextvars
+from bisect import bisect_left
+
+from fastapi import HTTPException
+from fastapi.exceptions import RequestValidationError
+from fastapi.routing import APIRoute
+
+BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5
+)
+
+families = {
+    "ttweak_requests_total": ("counter", "Requests handled, by route and status."),
+    "ttweak_request_errors_total": ("counter", "Requests answered with a 4xx or 5xx status."),
+    "ttweak_requests_in_flight": ("gauge", "Requests being handled right now."),
+    "ttweak_request_duration_seconds": ("histogram", "Time to handle a request, by route."),
+    "ttweak_phase_duration_seconds": ("histogram", "Time spent in each phase of a request."),
+}
+
+
+class Registry:
+    def __init__(self):
+        self._shards = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def shard(self):
+        """This thread's (counters, histograms), created on its first use."""
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = ({}, {})
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def inc(self, name, labels, n=1):
+        counters = self.shard()[0]
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + n
+
+    def observe(self, name, labels, seconds):
+        _observe(self.shard()[1], (name, labels), seconds)
+
+    def collect(self):
+        """Sums the shards: ({(name, labels): value}, {(name, labels): histogram})."""
+        counters, histograms = {}, {}
+        with self._lock:
+            shards = list(self._shards)
+        for shard_counters, shard_histograms in shards:
+            for key, value in list(shard_counters.items()):
+                counters[key] = counters.get(key, 0) + value
+            for key, h in list(shard_histograms.items()):
+                total = histograms.setdefault(key, [0] * len(h))
+                for i, value in enumerate(list(h)):
+                    total[i] += value
+        return counters, histograms
+
+    def render(self):
+        """All the metrics, in the Prometheus text exposition format."""
+        counters, histograms = self.collect()
+        lines = []
+        for name, (kind, help) in families.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{format_labels(labels)} {value}")
+            for (metric, labels), h in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, n in zip(BUCKETS + ("+Inf",), h):
+                    cumulative += n
+                    le = format_labels(labels + (("le", str(bound)),))
+                    lines.append(f"{name}_bucket{le} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {h[-2]}")
+                lines.append(f"{name}_count{format_labels(labels)} {h[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+def _observe(histograms, key, seconds):
+    h = histograms.get(key)
+    if h is None:
+        # One count per bucket, then +Inf, sum and count
+        h = histograms[key] = [0] * (len(BUCKETS) + 1) + [0.0, 0]
+    h[bisect_left(BUCKETS, seconds)] += 1
+    h[-2] += seconds
+    h[-1] += 1
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in labels
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+registry = Registry()
+
+# The request being handled: [route, start of the request, start of its function, log seconds]
+_current = contextvars.ContextVar("ttweak_request", default=None)
+
+
+def phase(name):
+    """Decorator adding the time spent in a function to the current request's phase "name"."""
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            request = _current.get()
+            if request is None:
+                return fn(*args, **kwargs)
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - t0
+                request[3] += elapsed
+                labels = (("route", request[0]), ("phase", name))
+                registry.observe("ttweak_phase_duration_seconds", labels, elapsed)
+
+        return timed
+
+    return decorator
+
+
+def _timed_endpoint(endpoint):
+    """Wraps a route function to note when it starts (the end of validation)."""
+    if inspect.iscoroutinefunction(endpoint):
+
+        @functools.wraps(endpoint)
+        async def timed(*args, **kwargs):
+            request = _current.get()
+            if request is not None:
+                request[2] = time.perf_counter()
+            return await endpoint(*args, **kwargs)
+
+    else:
+
+        @functools.wraps(endpoint)
+        def timed(*args, **kwargs):
+            request = _current.get()
+            if request is not None:
+                request[2] = time.perf_counter()
+            return endpoint(*args, **kwargs)
+
+    return timed
+
+
+class MetricsRoute(APIRoute):
+    """An APIRoute that records the metrics of its requests. Set as the route class of the
+    app's router before the routes are declared.
+    """
+
+    def __init__(self, path, endpoint, **kwargs):
+        super().__init__(path, _timed_endpoint(endpoint), **kwargs)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        route = self.path
+
+        # The keys of this route's metrics, made once rather than on every request
+        labels = (("route", route),)
+        in_flight = ("ttweak_requests_in_flight", labels)
+        duration = ("ttweak_request_duration_seconds", labels)
+        validation = ("ttweak_phase_duration_seconds", labels + (("phase", "validation"),))
+        work = ("ttweak_phase_duration_seconds", labels + (("phase", "work"),))
+        by_status = {}
+
+        def status_keys(status):
+            status_labels = labels + (("status", str(status)),)
+            keys = by_status[status] = (
+                ("ttweak_requests_total", status_labels),
+                ("ttweak_request_errors_total", status_labels) if status >= 400 else None,
+            )
+            return keys
+
+        async def timed_handler(request):
+            counters = registry.shard()[0]
+            counters[in_flight] = counters.get(in_flight, 0) + 1
+            t0 = time.perf_counter()
+            current = [route, t0, None, 0.0]
+            token = _current.set(current)
+            status = 500
+            try:
+                response = await handler(request)
+                status = response.status_code
+                return response
+            except HTTPException as e:
+                status = e.status_code
+                raise
+            except RequestValidationError:
+                status = 422
+                raise
+            finally:
+                _current.reset(token)
+                end = time.perf_counter()
+                counters, histograms = registry.shard()
+                counters[in_flight] -= 1
+                requests, errors = by_status.get(status) or status_keys(status)
+                counters[requests] = counters.get(requests, 0) + 1
+                if errors:
+                    counters[errors] = counters.get(errors, 0) + 1
+                _observe(histograms, duration, end - t0)
+
+                started = current[2]
+                if started is None:
+                    _observe(histograms, validation, end - t0)
+                else:
+                    _observe(histograms, validation, started - t0)
+                    _observe(histograms, work, end - started - current[3])
+
+        return timed_handler
@@ -0,0 +1,172 @@
+""" Sampled profiling of requests: where the time of slow requests goes.
+
+ProfilingMiddleware runs one request in every N under cProfile, in the event loop's thread.
+    The plain "def" routes run in the thread pool instead, so ProfiledRoute profiles their
+    function there too, with a profiler of its own. Both profiles of a request are added to
+    its route's, by a background thread that also writes them to a directory:
+
+    <directory>/<pid>/<route>.prof     pstats of the route (snakeviz, flameprof, gprof2dot...)
+    <directory>/<pid>/summary.json     the top functions of each route
+
+Only one request is profiled at a time, but the loop's profiler sees everything the loop
+    runs meanwhile, other requests included.
+
+When profiling is off, main uses neither the middleware nor ProfiledRoute: nothing runs per
+    request.
+"""
+
+import os
+import json
+import queue
+import pstats
+import inspect
+import cProfile
+import functools
+import threading
+import contextvars
+
+from fastapi.routing import APIRoute
+
+# The profilers of the request being profiled, if any
+_profiles = contextvars.ContextVar("ttweak_profiles", default=None)
+
+
+def function_name(key):
+    path, line, name = key
+    return f"{os.path.basename(path)}:{line}({name})" if line else name
+
+
+class Profiler:
+    def __init__(self, every=100, directory="logs/profiles"):
+        self.every = every
+        self.directory = os.path.join(directory, str(os.getpid()))
+        self.stats = {}
+        self.requests = {}
+        self._seen = 0
+        self._busy = False
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def pick(self):
+        """Whether to profile the next request: one in every N, and one at a time."""
+        self._seen += 1
+        return self._seen % self.every == 0 and not self._busy
+
+    def add(self, route, profiles):
+        """Hands the profiles of a request to the background thread."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="ttweak-profiler", daemon=True)
+            self._thread.start()
+        self._queue.put((route, profiles))
+
+    def _run(self):
+        while True:
+            route, profiles = self._queue.get()
+            with self._lock:
+                for profile in profiles:
+                    if route in self.stats:
+                        self.stats[route].add(profile)
+                    else:
+                        self.stats[route] = pstats.Stats(profile)
+                self.requests[route] = self.requests.get(route, 0) + 1
+            self.dump()
+            self._queue.task_done()
+
+    def wait(self):
+        """Waits until the profiles handed so far are added."""
+        self._queue.join()
+
+    def top(self, n=20, route=None):
+        """The n functions with the most time of their own, over all routes or one."""
+        with self._lock:
+            routes = [route] if route is not None else list(self.stats)
+            functions = {}
+            for name in routes:
+                if name not in self.stats:
+                    continue
+                for key, (_, calls, own, total, _) in self.stats[name].stats.items():
+                    found = functions.setdefault(key, [0, 0.0, 0.0])
+                    found[0] += calls
+                    found[1] += own
+                    found[2] += total
+            requests = sum(self.requests.get(name, 0) for name in routes)
+        ranked = sorted(functions.items(), key=lambda item: -item[1][1])[:n]
+        return {
+            "requests": requests,
+            "functions": [
+                {"function": function_name(key), "calls": calls, "self_s": own, "total_s": total}
+                for key, (calls, own, total) in ranked
+            ],
+        }
+
+    def dump(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock:
+            for route, stats in self.stats.items():
+                name = "".join(c if c.isalnum() else "_" for c in route.strip("/")) or "root"
+                stats.dump_stats(os.path.join(self.directory, f"{name}.prof"))
+            routes = list(self.stats)
+        summary = {route: self.top(20, route) for route in routes}
+        with open(os.path.join(self.directory, "summary.json"), "w") as f:
+            json.dump(summary, f, indent=1)
+
+
+class ProfilingMiddleware:
+    """ASGI middleware running one request in every profiler.every under cProfile."""
+
+    def __init__(self, app, profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.profiler.pick():
+            return await self.app(scope, receive, send)
+
+        self.profiler._busy = True
+        profile = cProfile.Profile()
+        profiles = [profile]
+        token = _profiles.set(profiles)
+        profile.enable()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            profile.disable()
+            _profiles.reset(token)
+            self.profiler._busy = False
+            # The router adds the matched route to the scope
+            route = getattr(scope.get("route"), "path", "(no route)")
+            self.profiler.add(route, profiles)
+
+
+def _profiled_endpoint(endpoint):
+    """Wraps a plain route function to profile it in the thread that runs it."""
+
+    @functools.wraps(endpoint)
+    def profiled(*args, **kwargs):
+        profiles = _profiles.get()
+        if profiles is None:
+            return endpoint(*args, **kwargs)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # From Python 3.12 a profiler sees all threads, and only one can run at a time:
+            #   the loop's already sees this one.
+            return endpoint(*args, **kwargs)
+        try:
+            return endpoint(*args, **kwargs)
+        finally:
+            profile.disable()
+            profiles.append(profile)
+
+    return profiled
+
+
+class ProfiledRoute(APIRoute):
+    """An APIRoute whose plain "def" function is also profiled in the thread pool."""
+
+    def __init__(self, path, endpoint, **kwargs):
+        if not inspect.iscoroutinefunction(endpoint):
+            endpoint = _profiled_endpoint(endpoint)
+        super().__init__(path, endpoint, **kwargs)
@@ -0,0 +1,98 @@
+""" Random strings from independent streams, reproducible from a seed.
+
+A stream is a seed and a position in it. Its characters come in blocks of BLOCK, and each
+    block is drawn by a PCG64 generator of its own, keyed by (seed, block number): any part
+    of a stream can be made without the parts before it, in any worker, and no stream shares
+    state with another (or with the "random" module).
+
+Stream keeps a stream in a session, as [seed, position], so that each client gets the same
+    strings whoever else is asking at the same time. Two requests of the same session at
+    once both start at the position it had.
+
+The characters depend on NumPy's Generator.integers, whose output NumPy may change between
+    versions: a seed gives the same strings with the same NumPy.
+"""
+
+import string
+
+import numpy as np
+
+from cache import LRUCache
+
+ALPHABET = string.ascii_letters + string.digits
+BLOCK = 4096
+
+_alphabet = np.frombuffer(ALPHABET.encode("ascii"), dtype=np.uint8)
+# The last blocks drawn, for the short strings asked in a row
+_blocks = LRUCache(max_bytes=2**20)
+
+
+def block(seed, number, keep=True):
+    """Block number of stream seed: BLOCK characters, as a uint8 array."""
+    data = _blocks.get((seed, number))
+    if data is None:
+        generator = np.random.Generator(np.random.PCG64([seed, number]))
+        data = _alphabet[generator.integers(0, len(ALPHABET), size=BLOCK, dtype=np.uint8)]
+        if keep:
+            _blocks.put((seed, number), data)
+    return data
+
+
+def chars(seed, start, n, keep=True):
+    """n characters of stream seed from position start, as a uint8 array."""
+    if n <= 0:
+        return _alphabet[:0]
+    first, last = start // BLOCK, (start + n - 1) // BLOCK
+    blocks = [block(seed, number, keep) for number in range(first, last + 1)]
+    data = blocks[0] if len(blocks) == 1 else np.concatenate(blocks)
+    offset = start - first * BLOCK
+    return data[offset : offset + n]
+
+
+def text(seed, start, n):
+    return chars(seed, start, n).tobytes().decode("ascii")
+
+
+def strings(seed, start, count, length):
+    """count strings of length characters, one after the other in stream seed."""
+    if length == 0:
+        return [""] * count
+    data = chars(seed, start, count * length, keep=False)
+    return [s.decode("ascii") for s in data.view(f"S{length}").tolist()]
+
+
+def lines(seed, start, count, length, chunk_size=1 << 16):
+    """Generates the same strings as strings(), one per line, in chunks of about chunk_size
+    bytes. Only one chunk is in memory at a time."""
+    per_chunk = max(1, chunk_size // (length + 1))
+    done = 0
+    while done < count:
+        k = min(per_chunk, count - done)
+        out = np.empty((k, length + 1), dtype=np.uint8)
+        out[:, :length] = chars(seed, start + done * length, k * length, keep=False).reshape(k, length)
+        out[:, length] = ord("\n")
+        yield out.tobytes()
+        done += k
+
+
+class Stream:
+    """The stream kept in session[key] (a new session starts stream seed at 0)."""
+
+    def __init__(self, session, key, seed):
+        self.session = session
+        self.key = key
+        self.seed, self.position = session.get(key) or (seed, 0)
+
+    def take(self, n):
+        """The next n characters."""
+        res = text(self.seed, self.position, n)
+        self.advance(n)
+        return res
+
+    def advance(self, n):
+        self.position += n
+        self.session[self.key] = [self.seed, self.position]
+
+    def reset(self, seed):
+        self.seed, self.position = seed, 0
+        self.session[self.key] = [seed, 0]
@@ -0,0 +1,96 @@
+""" Finds many strings inside a text in a single pass, with an Aho-Corasick automaton.
+
+Like the find tweak, every occurrence is reported by its start index, overlapping ones too.
+    Building the automaton costs about the total length of the needles, so automata are
+    kept (see automaton()) and reused when the same set of needles comes back.
+"""
+
+import json
+import hashlib
+from collections import deque
+
+from cache import LRUCache
+
+
+class Automaton:
+    def __init__(self, needles):
+        self.needles = list(dict.fromkeys(needles))
+
+        # The trie of the needles: goto[state] maps a character to the next state
+        goto = [{}]
+        ends = [[]]
+        for n, needle in enumerate(self.needles):
+            if not needle:
+                continue
+            state = 0
+            for ch in needle:
+                if ch not in goto[state]:
+                    goto[state][ch] = len(goto)
+                    goto.append({})
+                    ends.append([])
+                state = goto[state][ch]
+            ends[state].append(n)
+
+        # Breadth first, each state gets its fallback (the longest suffix that is also in the
+        #   trie), its matches include the fallback's, and its transitions are completed with
+        #   the fallback's, so that the search never needs to follow fallbacks.
+        fail = [0] * len(goto)
+        self._delta = delta = [dict(goto[0])] + [None] * (len(goto) - 1)
+        self._ends = ends
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            delta[state] = dict(delta[fail[state]])
+            delta[state].update(goto[state])
+            if fail[state]:
+                ends[state] = ends[state] + ends[fail[state]]
+            for ch, child in goto[state].items():
+                fail[child] = delta[fail[state]].get(ch, 0) if state else 0
+                queue.append(child)
+
+        self.size = sum(len(d) for d in delta)
+
+    def find_all(self, text):
+        """Returns {needle: [start indices]} for every needle, in one pass over text."""
+        found = [[] for _ in self.needles]
+        lengths = [len(needle) for needle in self.needles]
+        delta = self._delta
+        ends = self._ends
+
+        state = 0
+        for i, ch in enumerate(text, 1):
+            state = delta[state].get(ch, 0)
+            if ends[state]:
+                for n in ends[state]:
+                    found[n].append(i - lengths[n])
+
+        for n, needle in enumerate(self.needles):
+            if not needle:
+                # str.find finds the empty string everywhere, the end of the text included
+                found[n] = list(range(len(text) + 1))
+        return dict(zip(self.needles, found))
+
+
+def needles_key(needles):
+    # Encoded as a JSON list: joined with a separator, needles holding it could collide
+    return hashlib.sha1(json.dumps(sorted(set(needles))).encode("utf-8")).hexdigest()
+
+
+# Recently used automata, bounded by their total number of transitions
+automata = LRUCache(max_bytes=4_000_000, sizeof=lambda a: a.size + 1)
+
+
+def automaton(needles):
+    """The automaton for a set of needles, built once and then taken from the cache."""
+    key = needles_key(needles)
+    found = automata.get(key)
+    if found is None:
+        found = Automaton(sorted(set(needles)))
+        automata.put(key, found)
+    return found
+
+
+def find_many(text, needles):
+    """Returns {needle: [start indices]}, for each needle in the order given."""
+    found = automaton(needles).find_all(text)
+    return {needle: found[needle] for needle in needles}
@@ -0,0 +1,47 @@
+""" Runs T-Tweak with several uvicorn workers that share one anagram index in shared memory.
+
+The index is built once, here in the parent process, and every worker attaches to it
+    read-only, instead of each worker opening (or building) its own.
+
+    python serve.py [--workers 8] [--host 127.0.0.1] [--port 8000]
+                    [--threads 40] [--limit-concurrency N] [--backlog 2048]
+
+--threads sizes each worker's pool for the plain "def" routes, --limit-concurrency makes a
+    worker answer 503 beyond N connections and requests at once, instead of queueing them.
+"""
+
+import os
+import argparse
+
+import uvicorn
+
+import words
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--threads", type=int, help="threads per worker for plain def routes")
+    parser.add_argument("--limit-concurrency", type=int, help="503 beyond this many at once")
+    parser.add_argument("--backlog", type=int, default=2048)
+    args = parser.parse_args()
+
+    if args.threads:
+        os.environ["TTWEAK_THREADS"] = str(args.threads)
+
+    name = f"ttweak-anagrams-{os.getpid()}"
+    shm = words.publish_shared(name)
+    os.environ["TTWEAK_ANAGRAM_SHM"] = name
+    try:
+        uvicorn.run(
+            "main:app",
+            host=args.host,
+            port=args.port,
+            workers=args.workers,
+            limit_concurrency=args.limit_concurrency,
+            backlog=args.backlog,
+        )
+    finally:
+        shm.close()
+        shm.unlink()
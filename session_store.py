@@ -0,0 +1,183 @@
+""" Where the storage state machine of each session lives, on the server side.
+
+The session cookie then only carries an opaque session id, instead of the whole machine
+    (signed and base64-encoded on every response, and checked and decoded on every request).
+
+Three stores with the same interface (get, put, delete), all expiring idle sessions:
+    MemoryStore   a dict in the process, least recently used sessions evicted first.
+                  Only right with a single worker process.
+    SQLiteStore   a table in an SQLite file, for any number of workers (and restarts).
+    SharedStore   a fixed table of slots in a memory-mapped file (in /dev/shm when there is
+                  one), for the workers of one machine.
+"""
+
+import os
+import json
+import time
+import mmap
+import struct
+import sqlite3
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+# "fcntl" is a linux module: in Windows it doesn't exist, and win_fctl stands in for it.
+try:
+    import fcntl
+except ModuleNotFoundError:
+    import win_fctl as fcntl
+
+
+class Store:
+    def get(self, sid):
+        """Returns the machine stored for a session id, or None."""
+        raise NotImplementedError
+
+    def put(self, sid, machine):
+        raise NotImplementedError
+
+    def delete(self, sid):
+        raise NotImplementedError
+
+
+class MemoryStore(Store):
+    def __init__(self, max_sessions=10000, ttl=3600):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, sid):
+        with self._lock:
+            item = self._items.get(sid)
+            if item is None:
+                return None
+            if item[0] < time.time():
+                del self._items[sid]
+                return None
+            self._items.move_to_end(sid)
+            return json.loads(item[1])
+
+    def put(self, sid, machine):
+        with self._lock:
+            self._items[sid] = (time.time() + self.ttl, json.dumps(machine))
+            self._items.move_to_end(sid)
+            while len(self._items) > self.max_sessions:
+                self._items.popitem(last=False)
+
+    def delete(self, sid):
+        with self._lock:
+            self._items.pop(sid, None)
+
+
+class SQLiteStore(Store):
+    def __init__(self, path, ttl=3600):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (sid TEXT PRIMARY KEY, machine TEXT, expires REAL)"
+        )
+        self._puts = 0
+
+    def get(self, sid):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT machine FROM sessions WHERE sid = ? AND expires >= ?", (sid, time.time())
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, sid, machine):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)",
+                (sid, json.dumps(machine), time.time() + self.ttl),
+            )
+            self._puts += 1
+            if self._puts % 1000 == 0:
+                self._db.execute("DELETE FROM sessions WHERE expires < ?", (time.time(),))
+
+    def delete(self, sid):
+        with self._lock:
+            self._db.execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+
+
+class SharedStore(Store):
+    # Each slot: expiry time, digest of the session id, length of the data, then the data
+    SLOT = struct.Struct("<d16sI")
+    PROBES = 8
+
+    def __init__(self, path=None, slots=4096, slot_size=4096, ttl=3600):
+        if path is None:
+            # One table per deployment: the name comes from the directory the server runs in
+            shm = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+            deployment = hashlib.sha1(os.getcwd().encode("utf-8")).hexdigest()[:12]
+            path = os.path.join(shm, f"ttweak-storage-{deployment}")
+        self.path = path
+        self.slots = slots
+        self.slot_size = slot_size
+        self.ttl = ttl
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < slots * slot_size:
+            os.ftruncate(self._fd, slots * slot_size)
+        self._map = mmap.mmap(self._fd, slots * slot_size)
+
+    def _probe(self, sid):
+        """The digest of sid and the slots it may be in."""
+        digest = hashlib.blake2b(sid.encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little") % self.slots
+        return digest, [(first + i) % self.slots * self.slot_size for i in range(self.PROBES)]
+
+    def get(self, sid):
+        digest, offsets = self._probe(sid)
+        fcntl.flock(self._fd, fcntl.LOCK_SH)
+        try:
+            for offset in offsets:
+                expires, key, size = self.SLOT.unpack_from(self._map, offset)
+                if key == digest and expires >= time.time():
+                    start = offset + self.SLOT.size
+                    return json.loads(self._map[start : start + size])
+            return None
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def put(self, sid, machine):
+        data = json.dumps(machine).encode("utf-8")
+        if len(data) > self.slot_size - self.SLOT.size:
+            raise ValueError(f"Session data over {self.slot_size - self.SLOT.size} bytes")
+        digest, offsets = self._probe(sid)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            # Its own slot, or else the one that expires first (free slots expire at 0)
+            slots = [(self.SLOT.unpack_from(self._map, o), o) for o in offsets]
+            mine = [o for (_, key, _), o in slots if key == digest]
+            offset = mine[0] if mine else min(slots)[1]
+            self.SLOT.pack_into(self._map, offset, time.time() + self.ttl, digest, len(data))
+            start = offset + self.SLOT.size
+            self._map[start : start + len(data)] = data
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def delete(self, sid):
+        digest, offsets = self._probe(sid)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            for offset in offsets:
+                if self.SLOT.unpack_from(self._map, offset)[1] == digest:
+                    self.SLOT.pack_into(self._map, offset, 0, bytes(16), 0)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+stores = {"memory": MemoryStore, "sqlite": SQLiteStore, "shared": SharedStore}
+
+
+def open_store(kind, *args, **options):
+    """Opens a store by name ("memory", "sqlite" or "shared")."""
+    if kind not in stores:
+        raise ValueError(f"Unknown session store {kind!r}, use one of {sorted(stores)}")
+    return stores[kind](*args, **options)
@@ -0,0 +1,89 @@
+""" Tweaks for texts too large for a path parameter: they work on the request body, chunk by chunk.
+
+Each function takes the body as an async iterator of bytes (as Request.stream() gives it) and
+    is an async generator of utf-8 bytes, so memory stays the same whatever the size of the text.
+"""
+
+import codecs
+import tempfile
+
+from starlette.concurrency import run_in_threadpool
+
+import tweaks
+
+block_size = 1 << 16
+
+
+async def _text(chunks):
+    """Decodes utf-8 chunks, keeping characters that are split between two chunks whole."""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    async for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    text = decoder.decode(b"", final=True)
+    if text:
+        yield text
+
+
+async def upper(chunks):
+    async for text in _text(chunks):
+        yield tweaks.upper(text).encode("utf-8")
+
+
+async def lower(chunks):
+    async for text in _text(chunks):
+        yield tweaks.lower(text).encode("utf-8")
+
+
+async def mix_case(chunks):
+    # The case alternates over the whole text, so each chunk starts where the last one ended
+    start = 0
+    async for text in _text(chunks):
+        yield tweaks.mix_case(text, start).encode("utf-8")
+        start += len(text)
+
+
+async def length(chunks):
+    n = 0
+    async for text in _text(chunks):
+        n += len(text)
+    yield f'{{"res": "{n}"}}'.encode("utf-8")
+
+
+def _read(spool, start, size):
+    spool.seek(start)
+    return spool.read(size)
+
+
+async def reverse(chunks):
+    """Spools the body to a temporary file, then reads it back from the end, block by block.
+
+    The spool is written and read in the threadpool, so a large body doesn't block the event loop.
+    """
+    spool = await run_in_threadpool(tempfile.TemporaryFile)
+    try:
+        async for chunk in chunks:
+            await run_in_threadpool(spool.write, chunk)
+        end = spool.tell()
+        while end > 0:
+            start = max(end - block_size, 0)
+            block = await run_in_threadpool(_read, spool, start, end - start)
+            cut = 0
+            while start > 0 and cut < len(block) and block[cut] & 0xC0 == 0x80:
+                cut += 1
+            if cut == len(block):
+                cut = 0
+            yield block[cut:].decode("utf-8", errors="replace")[::-1].encode("utf-8")
+            end = start + cut
+    finally:
+        spool.close()
+
+
+operations = {
+    "length": length,
+    "reverse": reverse,
+    "upper": upper,
+    "tolower": lower,
+    "mix_case": mix_case,
+}
@@ -0,0 +1,68 @@
+""" Password strength scores for many passwords at once, computed with NumPy array operations.
+
+The rules (and their quirks) are those of main.password_strength, which scores one password
+    per request; scores() gives the same result for every input. Passwords are packed into a
+    matrix of code points, one row per password, padded with zeros to a fixed width: passwords
+    longer than that width score -1 anyway, without looking at them.
+"""
+
+import numpy as np
+
+WIDTH = 20
+COMMON = ["password", "admin", "root"]
+CHUNK = 100_000
+
+
+def pack(passwords):
+    """Returns (codes, lengths): an (n, WIDTH) uint32 matrix of code points and the lengths."""
+    lengths = np.fromiter(map(len, passwords), dtype=np.int64, count=len(passwords))
+    row = 4 * WIDTH
+    data = b"".join(
+        p.encode("utf-32-le", "surrogatepass").ljust(row, b"\0") if len(p) <= WIDTH else bytes(row)
+        for p in passwords
+    )
+    codes = np.frombuffer(data, dtype="<u4").reshape(len(passwords), WIDTH)
+    return codes, lengths
+
+
+def _scores(passwords):
+    codes, lengths = pack(passwords)
+    inside = np.arange(WIDTH) < lengths[:, None]
+
+    # A password should be larger than 12
+    score = 10 - np.clip(12 - lengths, 0, None)
+
+    # A password should NOT be the same letter or number repeated
+    repeated = np.all((codes == codes[:, :1]) | ~inside, axis=1)
+    repeated_score = score - 7
+
+    # A password should NOT be the words “password”, "admin" or "root"
+    common_codes, common_lengths = pack(COMMON)
+    common = np.zeros(len(passwords), dtype=bool)
+    for word, word_length in zip(common_codes, common_lengths):
+        common |= (lengths == word_length) & np.all(codes == word, axis=1)
+    score = np.where(common, 0, score)
+
+    # A password should include upper case letter(s), lower case letter(s), and number(s).
+    for low, high in ((65, 90), (97, 122), (48, 57)):
+        present = np.any((codes >= low) & (codes <= high) & inside, axis=1)
+        score = score - 2 * ~present
+
+    # A password shouldn’t contain any consecutive letters or numbers (any ordinals, in fact).
+    consecutive = (codes[:, 1:] == codes[:, :-1] + 1) & inside[:, 1:]
+    score = score - consecutive.sum(axis=1)
+
+    score = np.where(repeated, repeated_score, score)
+    score = np.clip(score, 0, 10)
+    score = np.where(lengths == 0, -2, score)
+    return np.where(lengths > WIDTH, -1, score)
+
+
+def scores(passwords):
+    """Scores a list of passwords: an int64 array, with the same values password_strength gives."""
+    passwords = list(passwords)
+    if not passwords:
+        return np.zeros(0, dtype=np.int64)
+    return np.concatenate(
+        [_scores(passwords[i : i + CHUNK]) for i in range(0, len(passwords), CHUNK)]
+    )
@@ -0,0 +1,236 @@
+""" Spelling suggestions: the dictionary words within a few edits (Levenshtein distance) of a text.
+
+The index is a SymSpell deletion dictionary. Every string that some word becomes after
+    deleting up to MAX_DISTANCE of its letters (its "deletes", the word itself included) is
+    recorded with the word, and the number of letters deleted. Two strings are within k
+    edits only if they have a delete in common, reached with at most k deletions from each:
+    a query looks up its own deletes, and only measures the distance to the words found.
+
+    Found through a common delete with a + b deletions (a from the query, b from the word),
+    a word is at most a + b edits away, and at least (a + b) / 2. So the words found with
+    a + b <= k are all suggestions, and for k <= 2 the others can only be exactly k edits
+    away: those are only measured (in alphabetical order) until there are enough.
+
+The index is built once (see write_suggest) and opened with mmap, like wordindex.py. The
+    server has it built in a child process (see dictionary.py), from an anagram index:
+
+    python suggest.py words.idx words.sug
+
+Layout (in the byte order recorded in the header):
+    header          magic, byte order, MAX_DISTANCE, number of words, number of entries,
+                    and a 16-byte tag (words.py puts a digest of the source there)
+    keys            n_entries 64-bit hashes of deletes, sorted
+    values          n_entries 32-bit values: (word number << 2) | deletions
+    word_offsets    n_words + 1 32-bit offsets into the word blob
+    word blob       all words, utf-8, sorted
+"""
+
+import os
+import sys
+import mmap
+import struct
+import hashlib
+
+import numpy as np
+
+MAGIC = b"TTSUG001"
+HEADER = struct.Struct("<8s4sBxxxII16s")
+BYTE_ORDER = sys.byteorder[:1].encode() * 4
+MAX_DISTANCE = 2
+
+
+def deletes(text, k=MAX_DISTANCE):
+    """{string: deletions} of all the strings text becomes after deleting up to k letters."""
+    found = {text: 0}
+    frontier = [text]
+    for depth in range(1, k + 1):
+        following = []
+        for s in frontier:
+            for i in range(len(s)):
+                d = s[:i] + s[i + 1 :]
+                if d not in found:
+                    found[d] = depth
+                    following.append(d)
+        frontier = following
+    return found
+
+
+def delete_hash(text):
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def distance(a, b, k):
+    """The Levenshtein distance between a and b, or k + 1 if it is more than k.
+
+    Only the diagonal band of width 2k + 1 is computed: the cells out of it are all over k.
+    """
+    la, lb = len(a), len(b)
+    if abs(la - lb) > k:
+        return k + 1
+    over = k + 1
+    previous = [j if j <= k else over for j in range(lb + 1)]
+    for i in range(1, la + 1):
+        ca = a[i - 1]
+        current = [over] * (lb + 1)
+        current[0] = best = i if i <= k else over
+        for j in range(max(1, i - k), min(lb, i + k) + 1):
+            v = previous[j - 1] + (ca != b[j - 1])
+            if previous[j] + 1 < v:
+                v = previous[j] + 1
+            if current[j - 1] + 1 < v:
+                v = current[j - 1] + 1
+            current[j] = v
+            if v < best:
+                best = v
+        if best > k:
+            return over
+        previous = current
+    return min(previous[lb], over)
+
+
+def pack_suggest(all_words, tag=bytes(16)):
+    """Packs the index of a list of words (sorted, no duplicates) into bytes."""
+    all_words = [w for w in all_words if w]
+    # Millions of entries: straight into an array, 12 bytes each, not into lists of ints
+    entries = np.fromiter(
+        (
+            (delete_hash(d), number << 2 | depth)
+            for number, word in enumerate(all_words)
+            for d, depth in deletes(word).items()
+        ),
+        dtype=[("key", np.uint64), ("value", np.uint32)],
+    )
+    keys, values = entries["key"], entries["value"]
+    order = np.argsort(keys, kind="stable")
+
+    blob = [w.encode("utf-8") for w in all_words]
+    offsets = np.zeros(len(blob) + 1, dtype=np.uint32)
+    np.cumsum([len(w) for w in blob], out=offsets[1:])
+    return b"".join(
+        [
+            HEADER.pack(MAGIC, BYTE_ORDER, MAX_DISTANCE, len(all_words), len(keys), tag),
+            keys[order].tobytes(),
+            values[order].tobytes(),
+            offsets.tobytes(),
+            b"".join(blob),
+        ]
+    )
+
+
+def write_suggest(path, all_words, tag=bytes(16)):
+    """Writes the index of all_words to path. The file is replaced atomically."""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(pack_suggest(all_words, tag))
+    os.replace(tmp, path)
+
+
+def build_suggest(index, path):
+    """Writes the index of the words of an anagram index (see wordindex.py) to path, with its
+    tag."""
+    write_suggest(path, sorted(index.values()), index.tag)
+
+
+class SuggestIndex:
+    """Finds the words within k edits of a text, in a file written by write_suggest."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buf = memoryview(self._map)
+        if len(buf) < HEADER.size:
+            raise ValueError(f"{path} is not a t-tweak suggestion index")
+        magic, order, self.max_distance, n_words, n_entries, self.tag = HEADER.unpack_from(buf)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a t-tweak suggestion index")
+        if order != BYTE_ORDER:
+            raise ValueError(f"{path} was built on another platform, rebuild it")
+
+        pos = HEADER.size
+        self._keys = np.frombuffer(buf, dtype=np.uint64, count=n_entries, offset=pos)
+        pos += 8 * n_entries
+        self._values = np.frombuffer(buf, dtype=np.uint32, count=n_entries, offset=pos)
+        pos += 4 * n_entries
+        self._offsets = buf[pos : pos + 4 * (n_words + 1)].cast("I")
+        pos += 4 * (n_words + 1)
+        self._words = buf[pos : pos + self._offsets[n_words]]
+        self._n_words = n_words
+        self.nbytes = len(buf)
+
+    def __len__(self):
+        return self._n_words
+
+    def word(self, number):
+        return str(self._words[self._offsets[number] : self._offsets[number + 1]], "utf-8")
+
+    def _found(self, text, k):
+        """(word numbers, least a + b) of the words found through the deletes of text."""
+        found = deletes(text, k)
+        hashes = np.fromiter(map(delete_hash, found), dtype=np.uint64, count=len(found))
+        depths = np.fromiter(found.values(), dtype=np.uint8, count=len(found))
+        starts = np.searchsorted(self._keys, hashes, "left")
+        ends = np.searchsorted(self._keys, hashes, "right")
+        hits = ends > starts
+        if not hits.any():
+            return np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.uint8)
+        starts, ends, depths = starts[hits], ends[hits], depths[hits]
+        ranges = zip(starts.tolist(), ends.tolist())
+        positions = np.concatenate([np.arange(start, end) for start, end in ranges])
+        values = self._values[positions]
+        a = np.repeat(depths, ends - starts)
+        b = (values & 3).astype(np.uint8)
+        within = b <= k
+        numbers = values[within] >> 2
+        total = a[within] + b[within]
+        # The least a + b of each word, one row per word, in word order
+        order = np.lexsort((total, numbers))
+        numbers, total = numbers[order], total[order]
+        first = np.ones(len(numbers), dtype=bool)
+        first[1:] = numbers[1:] != numbers[:-1]
+        return numbers[first], total[first]
+
+    def suggest(self, text, k=MAX_DISTANCE, limit=10):
+        """Up to limit (word, distance) pairs, the closest first, then in alphabetical order."""
+        if not 0 <= k <= self.max_distance:
+            raise ValueError(f"k must be between 0 and {self.max_distance}")
+        numbers, total = self._found(text, k)
+
+        sure = total <= k
+        found = []
+        for number, bound in zip(numbers[sure].tolist(), total[sure].tolist()):
+            word = self.word(number)
+            d = bound if bound == abs(len(word) - len(text)) else distance(text, word, bound)
+            if d <= k:
+                found.append((d, number))
+        found.sort()
+        closer = [(d, number) for d, number in found if d < k]
+        at_k = [number for d, number in found if d == k]
+
+        # The others are at exactly k edits, or more: measured in order, until there are enough
+        needed = limit - len(closer)
+        more = []
+        i = 0
+        for number in numbers[~sure].tolist():
+            while i < len(at_k) and at_k[i] < number and len(more) < needed:
+                more.append(at_k[i])
+                i += 1
+            if len(more) >= needed:
+                break
+            if distance(text, self.word(number), k) <= k:
+                more.append(number)
+        more += at_k[i:]
+        found = closer + [(k, number) for number in sorted(more)]
+        return [(self.word(number), d) for d, number in found[:limit]]
+
+
+if __name__ == "__main__":
+    # python suggest.py index suggestions: index is an anagram index file, or the name of the
+    #   shared memory block serve.py published it in
+    import words
+    import wordindex
+
+    src, dst = sys.argv[1:3]
+    index = wordindex.PackedIndex(src) if os.path.isfile(src) else words.attach_shared(src)
+    build_suggest(index, dst)
+    print(f"{dst}: {len(SuggestIndex(dst))} words")
@@ -3,7 +3,10 @@
 import os
 import sys
 import json
+import asyncio
 import random
+import shutil
+import tempfile
 
 import fastapi.exceptions
 import pytest
@@ -19,6 +22,7 @@ import extra
 
 # Client that gives us access to a dummy server for HTTP tests
 client = None
+storage_dir = None
 
 
 # ---------------------------------------------------------------------------
@@ -38,6 +42,11 @@ def setup_module(module):
     # For example, set a dummy server running (like the TestClient)
     print("==> START!")
 
+    # The session store of the tests is their own, never the one of a server running here
+    global storage_dir
+    storage_dir = tempfile.mkdtemp(prefix="ttweak-test-")
+    main.storage_file = os.path.join(storage_dir, "storage")
+
     global client
     client = TestClient(main.app)
 
@@ -49,6 +58,7 @@ def teardown_module(module):
 
     global client
     client = None
+    shutil.rmtree(storage_dir, ignore_errors=True)
 
 
 def setup_function():
@@ -67,7 +77,7 @@ def teardown_function():
 # Amounts to 1 test in the total unit tests
 # ---------------------------------------------------------------------------
 def test_lower_ABCD():
-    r = main.lower("ABCD")
+    r = asyncio.run(main.lower("ABCD"))
     j = json.loads(r.body)
     assert r.status_code == 200
     assert j["res"] == "abcd"
@@ -84,11 +94,11 @@ def test_password_length_score():
     password = "".join(random.choices("abcXYZ123!@#", k=20))
 
     while len(password) >= 1:
-        r_large = main.password_strength(password)
+        r_large = asyncio.run(main.password_strength(password))
         j_large = json.loads(r_large.body)
 
         password = password[:-1]
-        r_small = main.password_strength(password)
+        r_small = asyncio.run(main.password_strength(password))
         j_small = json.loads(r_small.body)
 
         assert 200 == r_large.status_code
@@ -124,7 +134,7 @@ def test_password_length_score():
     ],
 )
 def test_upper_many(test, expected):
-    r = main.upper(test)
+    r = asyncio.run(main.upper(test))
     j = json.loads(r.body)
     assert r.status_code == 200
     assert j["res"] == expected
@@ -163,13 +173,13 @@ def test_upper_rest_outside_bv():
 # ---------------------------------------------------------------------------
 def test_random_naive():
     extra.reset_random(0)
-    r = main.rand_str(4)
+    r = asyncio.run(main.rand_str(4))
     j = json.loads(r.body)
 
     assert r.status_code == 200
     assert j["res"] == "2yW4"
 
-    r = main.rand_str(15)
+    r = asyncio.run(main.rand_str(15))
     j = json.loads(r.body)
 
     assert r.status_code == 200
@@ -188,7 +198,7 @@ def test_random_naive():
 )
 def test_random_unit(monkeypatch, length):
     monkeypatch.setattr(main.extra, "get_rand_char", lambda: "t")
-    r = main.rand_str(length)
+    r = asyncio.run(main.rand_str(length))
     j = json.loads(r.body)
     assert r.status_code == 200
     assert j["res"] == "t" * length
@@ -205,7 +215,7 @@ def test_random_unit(monkeypatch, length):
 def test_with_exception():
     # 'raises' checks that the exception is raised
     with pytest.raises(fastapi.exceptions.HTTPException) as exc:
-        main.substring("course 67778", 3, 2)
+        asyncio.run(main.substring("course 67778", 3, 2))
     assert http_status.HTTP_409_CONFLICT == exc.value.status_code
 
 
@@ -307,3 +317,1011 @@ def test_storage_db():
 @pytest.mark.skip(reason="Skipping this test for now")
 def test_storage():
     assert True
+
+
+# ---------------------------------------------------------------------------
+# TEST 15: The anagram index on disk must answer exactly like the dictionary
+#   words.py builds in memory, for every key.
+# Amounts to 1 test in the total unit tests
+# ---------------------------------------------------------------------------
+def test_anagram_index_matches_dict(tmp_path):
+    import words
+    import wordindex
+
+    table = words.build_anagrams(words.load_words())
+    path = str(tmp_path / "words.idx")
+    wordindex.write_index(path, table)
+    index = wordindex.PackedIndex(path)
+
+    assert len(index) == len(table)
+    assert dict(index.items()) == table
+    assert index.get("not a key") is None
+
+
+# ---------------------------------------------------------------------------
+# TEST 16: Anagrams through the dummy server. The word itself is not an anagram.
+# Amounts to 1 test in the total unit tests
+# ---------------------------------------------------------------------------
+def test_anagrams_rest():
+    r = client.get("anagrams/Listen")
+    assert 200 == r.status_code
+    assert "silent" in r.json()["res"]
+    assert "listen" not in r.json()["res"]
+
+
+# ---------------------------------------------------------------------------
+# TEST 17: The background writer answers the history at once, queued entries
+#   included, and after a flush its log holds the same entries for any other writer.
+#   The history and log files of earlier versions are imported, once.
+# Amounts to 2 tests in the total unit tests
+# ---------------------------------------------------------------------------
+def test_writer_history(tmp_path):
+    from writer import LogWriter
+
+    dirs = [str(tmp_path / name) for name in ("log", "history")]
+    w = LogWriter(*dirs)
+
+    for i in range(120):
+        w.log(f"line {i}")
+        w.history(f"entry {i}")
+
+    assert [f"entry {i}" for i in range(70, 120)] == w.history()
+    assert [f"entry {i}" for i in range(60, 70)] == w.tail(10, page=5)
+    w.flush()
+
+    again = LogWriter(*dirs)
+    assert w.history() == again.history()
+    lines = again.log_store.tail(1000)
+    assert 120 == len(lines) and lines[-1].endswith("line 119")
+
+    w.reset()
+    assert [] == w.history() == again.history()
+
+
+def test_writer_imports_files(tmp_path):
+    from writer import LogWriter
+
+    files = {"log_file": tmp_path / "log.log", "hist_file": tmp_path / "history.txt"}
+    files["log_file"].write_text("Mon Jan  1 00:00:00 2024 upper abc\n")
+    files["hist_file"].write_text("upper abc\nreverse abc\n")
+    dirs = [str(tmp_path / name) for name in ("log", "history")]
+
+    w = LogWriter(*dirs, **files).start()
+    assert ["upper abc", "reverse abc"] == w.history()
+    assert 1 == len(w.log_store)
+    w.history("length abc")
+    w.flush()
+    # Not again: already imported
+    again = LogWriter(*dirs, **files).start()
+    assert ["upper abc", "reverse abc", "length abc"] == again.history()
+    w.reset()
+    assert [] == LogWriter(*dirs, **files).start().history()
+
+
+# ---------------------------------------------------------------------------
+# TEST 18: Stress test for the shared counter. Several processes increment it at
+#   the same time, as uvicorn workers would, and not a single increment may be lost.
+# Amounts to 2 tests in the total unit tests
+# ---------------------------------------------------------------------------
+def add_many(kind, path, n, options):
+    import counter
+
+    c = counter.open_counter(kind, path, **options)
+    for _ in range(n):
+        c.add(1)
+
+
+@pytest.mark.parametrize(
+    "kind,options",
+    [("slot", {}), ("journal", {"compact_every": 50})],
+    ids=["slot", "journal"],
+)
+def test_counter_many_processes(tmp_path, kind, options):
+    import multiprocessing
+    import counter
+
+    path = str(tmp_path / "count.cnt")
+    procs = [
+        multiprocessing.Process(target=add_many, args=(kind, path, 300, options))
+        for _ in range(6)
+    ]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+
+    c = counter.open_counter(kind, path)
+    assert 6 * 300 == c.get()
+    c.reset()
+    assert 0 == c.get()
+
+
+# ---------------------------------------------------------------------------
+# TEST 19: A batch gives the same results as calling the single tweak for each text,
+#   keeps the single tweak's limits per text, and can be streamed as NDJSON.
+# Amounts to 1 test in the total unit tests
+# ---------------------------------------------------------------------------
+def test_batch():
+    texts = ["abc", "Hello World", "", "q3q5q7q10"]
+    r = client.post("batch", json={"op": "mix_case", "items": texts})
+    assert 200 == r.status_code
+    expected = [json.loads(asyncio.run(main.mix_case(t)).body)["res"] for t in texts]
+    assert expected == r.json()["res"]
+
+    r = client.post("batch", json={"op": "reverse", "items": ["ok", "x" * 101]})
+    assert 422 == r.status_code
+
+    body = "\n".join(json.dumps(t) for t in texts)
+    r = client.post("batch/stream?op=upper", content=body)
+    assert 200 == r.status_code
+    assert [t.upper() for t in texts] == [json.loads(l)["res"] for l in r.text.splitlines()]
+
+
+# ---------------------------------------------------------------------------
+# TEST 20: Texts in the request body are tweaked chunk by chunk. Small chunks and
+#   small blocks make sure characters split between chunks (and the mix_case
+#   alternation) survive the boundaries.
+# Amounts to 1 test in the total unit tests
+# ---------------------------------------------------------------------------
+def test_stream_tweaks(monkeypatch):
+    import streams
+
+    monkeypatch.setattr(streams, "block_size", 7)
+    text = "Ab cD é 漢字 😀 ß " * 200
+    data = text.encode("utf-8")
+
+    def chunks():
+        for i in range(0, len(data), 13):
+            yield data[i : i + 13]
+
+    for op, expected in [
+        ("reverse", text[::-1]),
+        ("upper", text.upper()),
+        ("tolower", text.lower()),
+        ("mix_case", main.tweaks.mix_case(text)),
+    ]:
+        r = client.post(f"stream/{op}", content=chunks())
+        assert 200 == r.status_code
+        assert expected == r.text
+
+    assert str(len(text)) == client.post("stream/length", content=chunks()).json()["res"]
+
+
+# ---------------------------------------------------------------------------
+# TEST 21: Property test for counterstrings. The linear-time generator (whole or in
+#   chunks) must give exactly what the original quadratic algorithm gave, for every
+#   length from 0 to 150 and every single printable character as the mark.
+# Amounts to 1 test in the total unit tests
+# ---------------------------------------------------------------------------
+def counterstring_reference(length, char):
+    counterstring = ""
+    while length > 0:
+        next_count = char + str(length)[::-1]
+        if len(next_count) > length:
+            next_count = next_count[:length]
+        counterstring = counterstring + next_count
+        length -= len(next_count)
+    return counterstring[::-1]
+
+
+def test_counterstring_property():
+    import string
+    import tweaks
+
+    for char in string.printable:
+        for length in range(0, 151):
+            expected = counterstring_reference(length, char)
+            assert expected == tweaks.counterstring(length, char)
+            assert expected == "".join(tweaks.counterstring_chunks(length, char, 16))
+
+
+# ---------------------------------------------------------------------------
+# TEST 22: The cache of counterstrings is bounded by the size of what it holds.
+# Amounts to 1 test in the total unit tests
+# ---------------------------------------------------------------------------
+def test_lru_cache_bytes():
+    from cache import LRUCache
+
+    cache = LRUCache(max_bytes=10)
+    cache.put("a", "12345")
+    cache.put("b", "1234")
+    assert "12345" == cache.get("a")
+    cache.put("c", "123")
+    assert cache.get("b") is None and "12345" == cache.get("a")
+    assert 8 == cache.bytes
+    cache.put("d", "12345678901")
+    assert cache.get("d") is None and 2 == len(cache)
+
+
+# ---------------------------------------------------------------------------
+# TEST 23: /find_many looks for many needles at once, and for each one it must
+#   answer what /find answers for that needle alone (overlaps included).
+#   Different sets of needles never share a cached automaton.
+# Amounts to 2 tests in the total unit tests
+# ---------------------------------------------------------------------------
+def test_find_many_like_find():
+    haystack = "aaaabaab"
+    needles = ["a", "aa", "aab", "b", "ba", "x", "aaaabaab"]
+
+    r = client.post("find_many", json={"haystack": haystack, "needles": needles})
+    assert 200 == r.status_code
+    for needle in needles:
+        single = json.loads(asyncio.run(main.find(haystack, needle)).body)["res"]
+        assert single == r.json()["res"][needle]
+
+
+def test_find_many_needle_sets():
+    for needles in (["a\x00b"], ["a", "b"]):
+        r = client.post("find_many", json={"haystack": "ab a\x00b", "needles": needles})
+        assert 200 == r.status_code
+        assert needles == list(r.json()["res"])
+
+
+# ---------------------------------------------------------------------------
+# TEST 24: The vectorized password scores must be identical to password_strength,
+#   quirks included, for any input: short, long, empty, repeated, common, unicode.
+# Amounts to 1 test in the total unit tests
+# ---------------------------------------------------------------------------
+def test_password_bulk_like_single():
+    import strength
+
+    alphabet = "aAbBzZyY0189!@ é😀:;`{[/" + "abcdefgh" + "ABCDEF" + "0123456789"
+    passwords = ["", "a", "password", "admin", "root", "aaaaaaa", "abc123ABC", "x" * 21]
+    passwords += ["".join(random.choices(alphabet, k=random.randint(0, 24))) for _ in range(2000)]
+    passwords += [random.choice(alphabet) * random.randint(1, 22) for _ in range(200)]
+
+    expected = [
+        json.loads(asyncio.run(main.password_strength(p)).body)["res"] for p in passwords
+    ]
+    assert expected == strength.scores(passwords).tolist()
+
+    body = "\n".join(json.dumps(p) for p in passwords[:100]) + "\n3"
+    r = client.post("password/bulk", content=body)
+    assert 200 == r.status_code
+    lines = [json.loads(l) for l in r.text.splitlines()]
+    assert expected[:100] == [l["res"] for l in lines[:100]]
+    assert "detail" in lines[100]
+
+
+# ---------------------------------------------------------------------------
+# TEST 25: With serve.py, the workers read the anagram index from shared memory.
+#   Attached there, it must answer like the index file.
+# Amounts to 1 test in the total unit tests
+# ---------------------------------------------------------------------------
+def test_anagram_index_shared_memory():
+    import words
+
+    shm = words.publish_shared(f"ttweak-test-{os.getpid()}")
+    try:
+        shared = words.attach_shared(shm.name)
+        index = words.open_index()
+        for word in ("listen", "stone", "zzzz", "été"):
+            key = words.anagram_key(word)
+            assert index.get(key) == shared.get(key)
+        assert len(index) == len(shared)
+        del shared
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+# ---------------------------------------------------------------------------
+# TEST 26: Sub-anagrams and wildcard patterns must find exactly what a (slow) scan
+#   of every word finds, and pages must add up to the total.
+# Amounts to 1 test in the total unit tests
+# ---------------------------------------------------------------------------
+def test_word_searches():
+    import re
+    from collections import Counter
+    import words
+
+    all_words = [w for w in words.load_words() if w]
+    letter_index, pattern_index = main.word_search()
+
+    for letters in ("listen", "Scrabble", "écoles", "zz"):
+        available = Counter(letters.lower())
+        expected = sorted(
+            [w for w in all_words if not Counter(w) - available], key=lambda w: (-len(w), w)
+        )
+        assert expected == letter_index.sub_anagrams(letters)
+
+    for pattern in ("c?t*", "*ing", "*a*b*", "??e*y", "?", "cat", "*é*"):
+        regex = "".join(".*" if c == "*" else "." if c == "?" else re.escape(c) for c in pattern)
+        expected = [w for w in all_words if re.fullmatch(regex, w, re.S)]
+        assert expected == pattern_index.match(pattern)
+
+    r = client.get("wildcard/c%3Ft*?size=100")
+    first = r.json()
+    second = client.get("wildcard/c%3Ft*?size=100&page=1").json()
+    assert first["total"] == len(pattern_index.match("c?t*"))
+    assert pattern_index.match("c?t*")[:200] == first["res"] + second["res"]
+
+
+# ---------------------------------------------------------------------------
+# TEST 27: The storage machine lives in a server-side store, and the session
+#   cookie only carries its id. Every store must keep, expire and drop machines.
+# Amounts to 1 test in the total unit tests
+# ---------------------------------------------------------------------------
+def test_session_stores(tmp_path):
+    import time
+    import session_store
+
+    stores = [
+        session_store.MemoryStore(max_sessions=2, ttl=60),
+        session_store.SQLiteStore(str(tmp_path / "storage.db"), ttl=60),
+        session_store.SharedStore(str(tmp_path / "storage.shm"), slots=16, ttl=60),
+    ]
+    machine = {"state": "full", "strings": ["a", "b", "ç", "d", "e" * 100]}
+    for store in stores:
+        assert store.get("nobody") is None
+        store.put("sid1", machine)
+        assert machine == store.get("sid1")
+        store.put("sid1", {"state": "start", "strings": []})
+        assert "start" == store.get("sid1")["state"]
+        store.delete("sid1")
+        assert store.get("sid1") is None
+        store.ttl = -1
+        store.put("sid2", machine)
+        assert store.get("sid2") is None
+
+    # Least recently used machines are dropped first
+    memory = stores[0]
+    memory.ttl = 60
+    for sid in ("x", "y", "z"):
+        memory.put(sid, machine)
+    assert memory.get("x") is None and memory.get("z") == machine
+
+    previous = main._session_store
+    main._session_store = stores[2]
+    stores[2].ttl = 60
+    try:
+        with TestClient(main.app) as c:
+            c.get("storage/add")
+            cookie = c.cookies["session"]
+            for i in range(5):
+                r = c.get(f"storage/string{i}")
+            assert "full" == r.json()["res"]["state"]
+            assert "string3" == c.get("storage/query?index=3").json()["res"]
+            # Same session id, and the cookie does not grow with the strings
+            assert cookie.split(".")[0] == c.cookies["session"].split(".")[0]
+    finally:
+        main._session_store = previous
+
+
+# ---------------------------------------------------------------------------
+# TEST 28: Responses of pure tweaks are cached already encoded. A hit must give
+#   the same bytes as the first response, and still be counted and logged.
+# Amounts to 1 test in the total unit tests
+# ---------------------------------------------------------------------------
+def test_response_cache():
+    from cache import ResponseCache
+
+    main.responses.clear()
+    before = client.get("cache/stats").json()["res"]["routes"].get("reverse", {})
+    first = client.get("reverse/cached text")
+    count = main.count()
+    second = client.get("reverse/cached text")
+    assert first.content == second.content == b'{"res":"txet dehcac"}'
+    assert count + 1 == main.count()
+    assert "reverse cached text" == main.history()[-1]
+
+    stats = client.get("cache/stats").json()["res"]["routes"]["reverse"]
+    assert before.get("hits", 0) + 1 == stats["hits"]
+    assert before.get("misses", 0) + 1 == stats["misses"]
+    assert 409 == client.get("substring/abc/2/1").status_code
+
+    # Each route has its own limit, and expired entries are misses
+    cache = ResponseCache(default_bytes=10, limits={"big": 100}, ttl=-1)
+    cache.put("small", "a", b"x" * 20)
+    cache.put("big", "a", b"x" * 20)
+    assert cache.get("small", "a") is None and cache.get("big", "a") is None
+    assert 1 == cache.stats()["routes"]["big"]["evictions"]
+
+
+# ---------------------------------------------------------------------------
+# TEST 29: /metrics counts requests and errors per route and status, and times
+#   each request and its phases in histograms.
+# Amounts to 1 test in the total unit tests
+# ---------------------------------------------------------------------------
+def test_metrics():
+    import re
+
+    def value(text, line):
+        found = re.search("^" + re.escape(line) + " (.+)$", text, re.M)
+        return float(found.group(1)) if found else 0
+
+    requests = 'ttweak_requests_total{route="/substring/{string}/{start}/{end}",status="%s"}'
+    before = client.get("metrics").text
+    client.get("substring/abcdef/1/3")
+    client.get("substring/abcdef/3/1")
+    client.get("substring/abcdef/x/1")
+    after = client.get("metrics").text
+
+    for status in ("200", "409", "422"):
+        assert value(before, requests % status) + 1 == value(after, requests % status)
+    errors = 'ttweak_request_errors_total{route="/substring/{string}/{start}/{end}",status="409"}'
+    assert value(before, errors) + 1 == value(after, errors)
+
+    labels = 'route="/substring/{string}/{start}/{end}"'
+    duration = "ttweak_request_duration_seconds_count{%s}" % labels
+    assert value(before, duration) + 3 == value(after, duration)
+    infinite = 'ttweak_request_duration_seconds_bucket{%s,le="+Inf"}' % labels
+    assert value(after, infinite) == value(after, duration)
+    for phase, calls in (("validation", 3), ("work", 2), ("log", 2)):
+        line = 'ttweak_phase_duration_seconds_count{%s,phase="%s"}' % (labels, phase)
+        assert value(before, line) + calls == value(after, line)
+
+
+# ---------------------------------------------------------------------------
+# TEST 30: Profiling is off unless configured. When on, one request in every N
+#   is profiled, plain "def" routes in their own thread too, and the results
+#   are added up per route and written to a directory.
+# Amounts to 1 test in the total unit tests
+# ---------------------------------------------------------------------------
+def test_profiling(tmp_path):
+    from fastapi import FastAPI
+    import profiling
+
+    assert main.profiler is None
+    assert 404 == client.get("profile/top").status_code
+
+    def spin(n):
+        return sum(i * i for i in range(n))
+
+    app = FastAPI()
+    app.router.route_class = profiling.ProfiledRoute
+
+    @app.get("/spin/{n}")
+    def spin_route(n: int):
+        return {"res": spin(n)}
+
+    profiler = profiling.Profiler(every=2, directory=str(tmp_path))
+    app.add_middleware(profiling.ProfilingMiddleware, profiler=profiler)
+    with TestClient(app) as c:
+        for _ in range(6):
+            assert 200 == c.get("spin/20000").status_code
+    profiler.wait()
+
+    top = profiler.top(50, "/spin/{n}")
+    assert 3 == top["requests"]
+    # The sum in spin() runs in the thread pool, and is most of the time (with the loop
+    #   waiting for it in epoll or select)
+    assert any(f["function"].startswith("test_unit.py") for f in top["functions"][:3])
+    files = os.listdir(os.path.join(tmp_path, str(os.getpid())))
+    assert {"spin__n_.prof", "summary.json"} <= set(files)
+
+
+# ---------------------------------------------------------------------------
+# TEST 31: The tweaks don't wait on the count file: increments are added up in
+#   memory, seen right away by this process, and handed to the file in batches.
+# Amounts to 1 test in the total unit tests
+# ---------------------------------------------------------------------------
+def test_buffered_counter(tmp_path):
+    from counter import BufferedCounter, open_counter
+
+    path = str(tmp_path / "count.cnt")
+    counter = BufferedCounter(open_counter("journal", path), interval=60)
+    other = open_counter("journal", path)
+    for _ in range(10):
+        counter.add(2)
+    assert 20 == counter.get() and 0 == other.get()
+    counter.flush()
+    assert 20 == other.get()
+    other.add(5)
+    counter.add(1)
+    assert 26 == counter.get()
+    counter.reset()
+    assert 0 == counter.get() == other.get()
+
+
+# ---------------------------------------------------------------------------
+# TEST 32: A crash can leave a partial line at the end of the log. It is never
+#   returned, and the entries appended after it don't get glued to it.
+# Amounts to 1 test in the total unit tests
+# ---------------------------------------------------------------------------
+def test_logstore_partial_line(tmp_path):
+    from logstore import SegmentedLog
+
+    log = SegmentedLog(str(tmp_path))
+    log.append([f"entry {i}" for i in range(100)] + ["two\nlines, a \\ too"])
+    (segment,) = [n for n in os.listdir(tmp_path) if n.endswith(".log")]
+    with open(tmp_path / segment, "ab") as f:
+        f.write(b"cut in the mid")
+
+    reopened = SegmentedLog(str(tmp_path))
+    assert 101 == len(reopened) == len(log)
+    assert ["entry 99", "two\nlines, a \\ too"] == reopened.tail(2)
+
+    reopened.append(["after the crash"])
+    assert ["entry 99", "two\nlines, a \\ too", "after the crash"] == log.tail(3)
+    assert 102 == len(log)
+
+
+# ---------------------------------------------------------------------------
+# TEST 33: The log rotates into new segments and drops the oldest beyond its
+#   retention, and /history pages back through it from the latest entry.
+# Amounts to 2 tests in the total unit tests
+# ---------------------------------------------------------------------------
+def test_logstore_rotation(tmp_path):
+    from logstore import SegmentedLog
+
+    log = SegmentedLog(str(tmp_path), segment_bytes=1000, max_segments=4)
+    for i in range(0, 1000, 10):
+        log.append([f"entry {j:04}" for j in range(i, i + 10)])
+    stats = log.stats()
+    assert 4 == stats["segments"] and stats["bytes"] <= 4 * 1000
+    assert stats["entries"] == len(log) < 1000
+    assert [f"entry {j:04}" for j in range(990, 1000)] == log.tail(10)
+    assert [f"entry {j:04}" for j in range(900, 970)] == log.tail(70, skip=30)
+    # More than is kept: what is kept
+    assert log.tail(5000) == [f"entry {j:04}" for j in range(1000 - len(log), 1000)]
+
+    log.clear()
+    assert 0 == len(log) == len(SegmentedLog(str(tmp_path)))
+
+
+def test_history_pages():
+    main.writer.reset()
+    for i in range(30):
+        client.get(f"reverse/page{i}")
+    assert [f"reverse page{i}" for i in range(20, 30)] == client.get("history?size=10").json()
+    assert [f"reverse page{i}" for i in range(10, 20)] == client.get("history?size=10&page=1").json()
+    assert [f"reverse page{i}" for i in range(0, 10)] == client.get("history?size=10&page=2").json()
+    assert 422 == client.get(f"history?size={main.history_max_page + 1}").status_code
+
+
+# ---------------------------------------------------------------------------
+# TEST 34: Each session draws its random strings from a stream of its own:
+#   other clients don't change what it gets, and /reset_server only rewinds the
+#   caller's. /random/bulk goes on in the same stream.
+# Amounts to 2 tests in the total unit tests
+# ---------------------------------------------------------------------------
+def test_random_streams():
+    alone = TestClient(main.app)
+    expected = [alone.get("random?length=12").json()["res"] for _ in range(3)]
+
+    a, b = TestClient(main.app), TestClient(main.app)
+    got = []
+    for _ in range(3):
+        got.append(a.get("random?length=12").json()["res"])
+        assert 200 == b.get("random?length=7").status_code
+    assert expected == got
+
+    assert 200 == b.get("reset_server").status_code
+    assert expected[0] == b.get("random?length=12").json()["res"]
+    bulk = a.get("random/bulk?count=4&length=9")
+    assert 200 == bulk.status_code
+    fresh = TestClient(main.app).get("random?length=72").json()["res"]
+    assert "".join(expected) + bulk.text.replace("\n", "") == fresh
+
+    # A seed of its own: same string every time, and the session's stream doesn't move
+    assert a.get("random?length=5&seed=1").json() == b.get("random?length=5&seed=1").json()
+    assert 422 == a.get(f"random/bulk?count={main.random_bulk_limit}&length=2").status_code
+
+
+def test_rng_blocks():
+    import rng
+
+    # Across the end of a block, and in a bulk of lines
+    whole = rng.text(7, 0, 3 * rng.BLOCK)
+    assert whole[rng.BLOCK - 5 : rng.BLOCK + 5] == rng.text(7, rng.BLOCK - 5, 10)
+    assert set(whole) <= set(rng.ALPHABET) and whole != rng.text(8, 0, 3 * rng.BLOCK)
+    strings = rng.strings(7, 100, 1000, 11)
+    assert "".join(strings) == whole[100:11100]
+    lines = b"".join(rng.lines(7, 100, 1000, 11, chunk_size=100)).decode()
+    assert strings == lines.splitlines()
+
+
+# ---------------------------------------------------------------------------
+# TEST 35: The anagram index ships with the code, so that cold starts only open
+#   it: it must have been built from words.txt as it is. An index that wasn't
+#   is rebuilt, even when it looks newer than its source.
+# Amounts to 1 test in the total unit tests
+# ---------------------------------------------------------------------------
+def test_prebuilt_index(tmp_path):
+    import words
+    import wordindex
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    shipped = wordindex.PackedIndex(os.path.join(root, words.index_file))
+    assert shipped.tag == words.source_tag(os.path.join(root, words.source))
+
+    src, path = str(tmp_path / "words.txt"), str(tmp_path / "words.idx")
+    with open(src, "w") as f:
+        f.write("stone\nnotes\n")
+    wordindex.write_index(path, {"enost": ["onset"]})
+    os.utime(path, (0, 0))
+    assert ["notes", "stone"] == words.open_index(path, src).get("enost")
+
+
+# ---------------------------------------------------------------------------
+# TEST 36: Responses come in the format the Accept header asks for: MessagePack,
+#   frames for lists of strings or integers, and JSON otherwise. The OpenAPI
+#   schema lists the formats of each route.
+# Amounts to 1 test in the total unit tests
+# ---------------------------------------------------------------------------
+def test_response_formats():
+    import msgpack
+    import formats
+
+    as_json = client.get("anagrams/listen")
+    assert "application/json" == as_json.headers["content-type"]
+
+    packed = client.get("anagrams/listen", headers={"Accept": "application/msgpack"})
+    assert "application/msgpack" == packed.headers["content-type"]
+    assert as_json.json() == msgpack.unpackb(packed.content)
+
+    framed = client.get("anagrams/listen", headers={"Accept": formats.FRAMES})
+    assert as_json.json()["res"] == formats.decode_frames(framed.content)
+    framed = client.get("find/abababab/ab", headers={"Accept": formats.FRAMES})
+    assert [0, 2, 4, 6] == formats.decode_frames(framed.content)
+    # The kind comes from the route: an empty list of integers is still one of integers
+    framed = client.get("find/abc/z", headers={"Accept": formats.FRAMES})
+    assert framed.content.startswith(b"i")
+    assert [] == formats.decode_frames(framed.content)
+
+    # Frames can't hold a string: the next format asked for, then JSON
+    accept = f"{formats.FRAMES}, application/x-msgpack;q=0.5, */*;q=0.1"
+    r = client.get("reverse/abc", headers={"Accept": accept})
+    assert {"res": "cba"} == msgpack.unpackb(r.content)
+    r = client.get("reverse/abc", headers={"Accept": f"text/html, {formats.FRAMES}"})
+    assert {"res": "cba"} == r.json()
+
+    paths = client.get("openapi.json").json()["paths"]
+    content = paths["/anagrams/{text}"]["get"]["responses"]["200"]["content"]
+    assert {"application/json", "application/msgpack", formats.FRAMES} == set(content)
+    assert formats.FRAMES in paths["/history"]["get"]["responses"]["200"]["content"]
+    assert formats.FRAMES not in paths["/reverse/{text}"]["get"]["responses"]["200"]["content"]
+    # The NDJSON routes don't negotiate
+    content = paths["/password/bulk"]["post"]["responses"]["200"]["content"]
+    assert {"application/x-ndjson"} == set(content)
+
+
+# ---------------------------------------------------------------------------
+# TEST 37: The dictionary is reloaded when words.txt changes: the new version is
+#   built in the background and swapped in, while the old one still answers
+#   whoever has it. The admin routes need the admin token.
+# Amounts to 2 tests in the total unit tests
+# ---------------------------------------------------------------------------
+def test_dictionary_reload(tmp_path):
+    import dictionary
+
+    src, path = str(tmp_path / "words.txt"), str(tmp_path / "words.idx")
+    with open(src, "w") as f:
+        f.write("stone\nnotes\n")
+    d = dictionary.Dictionary(src, path)
+    old = d.current()
+    assert 1 == old.number and ["notes", "stone"] == old.index.get("enost")
+    assert old.build_seconds > 0
+    assert d.check() is None
+
+    with open(src, "a") as f:
+        f.write("onset\nlisten\n")
+    d.check().join()
+    new = d.current()
+    assert 2 == new.number and 2 == len(new.index) and None is d.last_error
+    assert ["notes", "onset", "stone"] == new.index.get("enost")
+    assert ["notes", "stone"] == old.index.get("enost")
+    assert ["listen"] == new.word_search()[1].match("l*")
+
+    # Nothing changed: nothing to swap
+    d.reload().join()
+    assert new is d.current()
+
+
+def test_dictionary_admin(monkeypatch):
+    assert http_status.HTTP_403_FORBIDDEN == client.get("admin/dictionary").status_code
+    monkeypatch.setenv("TTWEAK_ADMIN_TOKEN", "secret")
+    headers = {"X-Admin-Token": "secret"}
+    assert http_status.HTTP_403_FORBIDDEN == client.post(
+        "admin/dictionary/reload", headers={"X-Admin-Token": "wrong"}
+    ).status_code
+
+    client.get("anagrams/listen")
+    r = client.get("admin/dictionary", headers=headers)
+    info = r.json()["res"]
+    assert info["version"] >= 1 and info["entries"] > 50000
+    assert main.words.source_tag() == bytes.fromhex(info["source"])
+
+    r = client.post("admin/dictionary/reload", headers=headers)
+    assert http_status.HTTP_202_ACCEPTED == r.status_code
+    main.dictionary.reload().join()
+    # words.txt didn't change: the version stays
+    assert info["version"] == main.dictionary.current().number
+
+
+# ---------------------------------------------------------------------------
+# TEST 38: /anagrams can look in other dictionaries, by name. Each is loaded on
+#   first use, and the least recently used are unloaded to stay within the
+#   memory budget (the pinned ones never are).
+# Amounts to 2 tests in the total unit tests
+# ---------------------------------------------------------------------------
+def test_dictionary_registry(tmp_path):
+    import dictionary
+
+    sources = {}
+    for name, text in (("a", "stone\nnotes\n"), ("b", "listen\nsilent\n"), ("c", "evil\nlive\n")):
+        sources[name] = str(tmp_path / f"{name}.txt")
+        with open(sources[name], "w") as f:
+            f.write(text)
+    registry = dictionary.Registry(sources)
+    assert not registry["a"].loaded
+    size = registry.use("a").nbytes
+    registry.max_bytes = 2 * size + size // 2
+    pinned = dictionary.Dictionary(sources["c"], str(tmp_path / "p.idx"))
+    registry.add("pinned", pinned, pinned=True)
+
+    assert ["listen", "silent"] == registry.use("b").index.get("eilnst")
+    registry.use("pinned")
+    # Three loaded: the least recently used (a) goes
+    assert not registry["a"].loaded and registry["b"].loaded and registry["pinned"].loaded
+    registry.use("b")
+    registry.use("c")
+    assert not registry["b"].loaded and registry["pinned"].loaded
+
+    stats = registry.stats()["dictionaries"]
+    assert (1, 1, 1) == (stats["b"]["hits"], stats["b"]["loads"], stats["b"]["evictions"])
+    assert stats["c"]["loaded"] and stats["c"]["bytes"] == registry.use("c").nbytes
+    with pytest.raises(KeyError):
+        registry.use("d")
+
+
+def test_anagrams_dictionary_param():
+    default = client.get("anagrams/listen").json()
+    assert default == client.get("anagrams/listen", params={"dict": "words"}).json()
+    assert http_status.HTTP_404_NOT_FOUND == client.get("anagrams/listen?dict=nope").status_code
+    stats = client.get("dictionaries/stats").json()["res"]["dictionaries"]
+    assert stats["words"]["loaded"] and stats["words"]["entries"] > 50000
+
+
+# ---------------------------------------------------------------------------
+# TEST 39: Spelling suggestions are the words within k edits, closest first:
+#   the same words a scan of the whole dictionary finds. Their index is built
+#   in a child process, never in the worker, and rebuilt with the dictionary.
+# Amounts to 3 tests in the total unit tests
+# ---------------------------------------------------------------------------
+def test_suggest_index(tmp_path):
+    import suggest
+
+    def levenshtein(a, b):
+        previous = list(range(len(b) + 1))
+        for i, ca in enumerate(a, 1):
+            current = [i]
+            for j, cb in enumerate(b, 1):
+                change = previous[j - 1] + (ca != cb)
+                current.append(min(previous[j] + 1, current[j - 1] + 1, change))
+            previous = current
+        return previous[-1]
+
+    all_words = sorted({"cat", "cart", "carts", "chart", "coat", "cot", "act", "at", "scat", "dog"})
+    path = str(tmp_path / "words.sug")
+    suggest.write_suggest(path, all_words, b"t" * 16)
+    index = suggest.SuggestIndex(path)
+    assert b"t" * 16 == index.tag and len(all_words) == len(index)
+
+    for text in ("cat", "cta", "carst", "ct", "xyz", "", "chats"):
+        for k in range(3):
+            scan = sorted((levenshtein(text, w), w) for w in all_words)
+            expected = [(w, d) for d, w in scan if d <= k]
+            assert expected == index.suggest(text, k, limit=100)
+            assert expected[:3] == index.suggest(text, k, limit=3)
+    with pytest.raises(ValueError):
+        index.suggest("cat", 3)
+
+
+def test_suggest_built_in_child(tmp_path, monkeypatch):
+    import suggest
+    import dictionary
+
+    def in_worker(*args):
+        raise AssertionError("The suggestion index was built in the worker")
+
+    monkeypatch.setattr(suggest, "write_suggest", in_worker)
+    src, path = str(tmp_path / "words.txt"), str(tmp_path / "words.idx")
+    with open(src, "w") as f:
+        f.write("stone\nnotes\n")
+    d = dictionary.Dictionary(src, path)
+    assert [("stone", 0)] == d.current().suggestions().suggest("stone")
+
+    # Built again along with the anagram index, by the reload
+    with open(src, "a") as f:
+        f.write("stony\n")
+    d.reload().join()
+    version = d.current()
+    assert 2 == version.number and None is d.last_error
+    assert version.tag == suggest.SuggestIndex(str(tmp_path / "words.sug")).tag
+    assert [("stone", 0), ("stony", 1)] == version.suggestions().suggest("stone", 1)
+
+
+def test_suggest_rest():
+    r = client.get("suggest/speling")
+    assert 200 == r.status_code
+    assert "spelling" == r.json()["res"][0]
+    assert ["listen"] == client.get("suggest/Listen?k=0").json()["res"]
+    assert 3 == len(client.get("suggest/cat?limit=3").json()["res"])
+    assert 422 == client.get("suggest/cat?k=3").status_code
+
+
+# ---------------------------------------------------------------------------
+# TEST 40: Admission control lets in a limited number of requests of each
+#   class at once and a short line of others: past that, requests are turned
+#   away at once with 503 and Retry-After, and a client over its rate with 429.
+#   A wait that times out just as a place is released ends one way or the other.
+# Amounts to 3 tests in the total unit tests
+# ---------------------------------------------------------------------------
+def test_admission_gate():
+    import admission
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def app(scope, receive, send):
+            await release.wait()
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": b""})
+
+        control = admission.Admission({"words": 1}, max_queue=2, target=0.05, timeout=0.2)
+        middleware = admission.AdmissionMiddleware(app, control)
+
+        async def get(path):
+            sent = []
+
+            async def send(message):
+                sent.append(message)
+
+            scope = {"type": "http", "path": path, "client": ("1.2.3.4", 5)}
+            await middleware(scope, None, send)
+            headers = dict(sent[0]["headers"])
+            return sent[0]["status"], headers.get(b"retry-after")
+
+        first = asyncio.ensure_future(get("/anagrams/a"))
+        await asyncio.sleep(0.01)
+        second = asyncio.ensure_future(get("/anagrams/b"))
+        await asyncio.sleep(0.1)
+        # The one waiting has waited past the target: turned away at once
+        assert (503, b"1") == await get("/suggest/c")
+        # Other classes, and the exempt routes, have their own room
+        release.set()
+        assert (200, None) == await get("/upper/d")
+        assert (200, None) == await first and (200, None) == await second
+
+        release.clear()
+        waiting = [asyncio.ensure_future(get(f"/anagrams/{i}")) for i in range(3)]
+        await asyncio.sleep(0.01)
+        assert (503, b"1") == await get("/anagrams/e")
+        assert [(503, b"1")] * 2 == await asyncio.gather(*waiting[1:])
+        release.set()
+        assert (200, None) == await waiting[0]
+
+        stats = control.stats()["words"]
+        assert (0, 0, 3) == (stats["active"], stats["waiting"], stats["admitted"])
+        assert (1, 1, 2) == (stats["queue"], stats["overload"], stats["timeout"])
+
+        middleware = admission.AdmissionMiddleware(app, admission.Admission(rate=1, burst=2))
+        assert [200, 200, 429] == [(await get("/upper/x"))[0] for _ in range(3)]
+
+    asyncio.run(scenario())
+
+
+def test_admission_timeout_race():
+    import admission
+
+    async def scenario():
+        gate = admission.Gate("words", 1, 10, 1, 0)
+        await gate.enter()
+        waiting = asyncio.ensure_future(gate.enter())
+        await asyncio.sleep(0)
+        # The place is released while the wait for it is timing out
+        gate.leave()
+        try:
+            await waiting
+            gate.leave()
+        except admission.Rejected as e:
+            assert (503, "timeout") == (e.status, e.reason)
+        assert (0, 0) == (gate.active, len(gate._waiting))
+        assert 2 == gate.counts["admitted"] + gate.counts["timeout"]
+
+    asyncio.run(scenario())
+
+
+def test_admission_stats():
+    r = client.get("admission/stats")
+    assert 200 == r.status_code
+    assert {"transform", "words", "storage", "bulk"} <= set(r.json()["res"])
+    assert "ttweak_admission_total" in client.get("metrics").text
+
+
+# ---------------------------------------------------------------------------
+# TEST 41: The client (ttweak_client.py) wraps the routes, keeps the session
+#   cookie, sends the calls answered 503 again (after Retry-After), and
+#   batches the tweaks called within its window into fewer requests.
+# Amounts to 2 tests in the total unit tests
+# ---------------------------------------------------------------------------
+def test_client_routes():
+    import httpx
+    import ttweak_client
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=main.app)
+        async with ttweak_client.AsyncClient(
+            "http://testserver", transport=transport, batch_window=0.01
+        ) as t:
+            texts = [f"word{i}" for i in range(30)]
+            assert [text.upper() for text in texts] == await asyncio.gather(
+                *[t.upper(text) for text in texts]
+            )
+            # One batch for the 30 calls
+            assert (30, 1) == (t.calls, t.sent)
+
+            # A text too long for its batch fails alone
+            found = await asyncio.gather(
+                t.reverse("abc"), t.reverse("x" * 101), return_exceptions=True
+            )
+            assert "cba" == found[0]
+            assert 422 == found[1].status
+
+            assert "enlist" in await t.anagrams("listen")
+            assert ["cat"] == (await t.wildcard("c?t", size=1))["res"]
+            # The storage machine of the session goes on from call to call
+            await t.storage("add")
+            for i in range(5):
+                await t.storage(f"string{i}")
+            assert "string3" == await t.storage("query", index=3)
+
+    asyncio.run(scenario())
+
+
+def test_client_retries():
+    import threading
+    import httpx
+    import ttweak_client
+
+    answers = []
+
+    def handler(request):
+        if request.url.path == "/batch":
+            items = json.loads(request.content)["items"]
+            answers.append(len(items))
+            return httpx.Response(200, json={"res": [text[::-1] for text in items]})
+        status = answers.pop(0) if answers else 200
+        if status == 200:
+            return httpx.Response(200, json={"res": "OK"})
+        headers = {"Retry-After": "0"} if status == 503 else {}
+        return httpx.Response(status, json={"detail": "no"}, headers=headers)
+
+    t = ttweak_client.Client(
+        "http://testserver", retries=2, backoff=0, transport=httpx.MockTransport(handler)
+    )
+    answers[:] = [503, 503]
+    assert "OK" == t.upper("ok")
+    assert (1, 3) == (t.calls, t.sent)
+    # Out of retries
+    answers[:] = [503, 503, 503]
+    with pytest.raises(ttweak_client.Error) as e:
+        t.upper("ok")
+    assert (503, "no") == (e.value.status, e.value.detail)
+    # Not sent again: an error of the call, or a 500 where it could have changed something
+    for status, call in ((422, lambda: t.upper("ok")), (500, lambda: t.storage("add"))):
+        answers[:] = [status]
+        sent = t.sent
+        with pytest.raises(ttweak_client.Error):
+            call()
+        assert sent + 1 == t.sent
+
+    # Calls from many threads, batched
+    answers.clear()
+    t = ttweak_client.Client(
+        "http://testserver", batch_window=0.05, transport=httpx.MockTransport(handler)
+    )
+    found = {}
+    threads = [
+        threading.Thread(target=lambda i=i: found.update({i: t.reverse(f"ab{i}")}))
+        for i in range(20)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert {i: f"ab{i}"[::-1] for i in range(20)} == found
+    assert 20 == sum(answers) and len(answers) < 20
+    t.close()
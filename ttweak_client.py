@@ -0,0 +1,473 @@
+""" A Python client for t-tweak: a method for each route, over connections kept open.
+
+    Client          plain calls, that threads can share
+    AsyncClient     the same methods, to await (all on one event loop)
+
+    with ttweak_client.Client("http://127.0.0.1:8000") as t:
+        t.upper("hello")                    # "HELLO"
+        t.anagrams("listen")                # ["enlist", "inlets", ...]
+
+Connections: httpx pools them, up to max_connections at once (as many calls in flight). The
+    others wait for one to be free, for at most timeout seconds. The session cookie of
+    t-tweak is kept too, so /storage and /random go on where the last call left them.
+
+Retries: a call answered 429, 502, 503 or 504, or that could not connect, is sent again up to
+    retries times. It waits the Retry-After of the response (at most max_wait seconds), or
+    backoff seconds, then twice that, and so on. Those calls did not run on the server, so
+    any of them can go again; a 500 is only retried by the calls that change nothing there
+    (all but storage and reset_server). Past the retries, or for another error, a call
+    raises Error, with the status and the detail of the response.
+
+Batching: with a batch_window (seconds), the five tweaks (length, reverse, upper, tolower and
+    mix_case) are not sent one by one. The texts of calls to the same tweak made within the
+    window go together in one POST /batch (at most batch_size of them: more are sent at
+    once), and each call gets its own result back. A batch answered 422 (one of its texts
+    is too long) is sent again one text at a time, so that only that call raises Error.
+    Each call waits the window first: batching pays off when there are many calls at
+    once (threads, or tasks), not for a single caller. The history counts a batch as one
+    entry.
+"""
+
+import json
+import time
+import asyncio
+import threading
+import concurrent.futures
+from urllib.parse import quote
+
+import httpx
+
+# Answered before the route ran (see admission.py): sent again whatever the call
+RETRY_STATUSES = (429, 502, 503, 504)
+TWEAKS = ("length", "reverse", "upper", "tolower", "mix_case")
+
+
+class Error(Exception):
+    """A call t-tweak answered with an error (status 0: it could not be reached)."""
+
+    def __init__(self, status, detail):
+        super().__init__(f"{status}: {detail}")
+        self.status = status
+        self.detail = detail
+
+
+def segment(value):
+    """value as one segment of a path: "/", "?" and the like encoded too."""
+    return quote(str(value), safe="")
+
+
+def params_of(**params):
+    return {key: value for key, value in params.items() if value is not None}
+
+
+def detail_of(response):
+    try:
+        return response.json()["detail"]
+    except (ValueError, KeyError, TypeError):
+        return response.text
+
+
+def retry_after(response, max_wait):
+    """The seconds Retry-After asks to wait (at most max_wait), or None."""
+    try:
+        return min(max(float(response.headers["retry-after"]), 0), max_wait)
+    except (KeyError, ValueError):
+        return None
+
+
+def as_res(response):
+    return response.json()["res"]
+
+
+def as_json(response):
+    return response.json()
+
+
+def as_text(response):
+    return response.text
+
+
+def as_lines(response):
+    return response.text.splitlines()
+
+
+def as_ndjson(response):
+    """The results of an NDJSON response, one per line: raises Error on the first that failed."""
+    found = []
+    for line in response.text.splitlines():
+        if line.strip():
+            item = json.loads(line)
+            if "detail" in item:
+                raise Error(422, item["detail"])
+            found.append(item["res"])
+    return found
+
+
+def ndjson_body(items):
+    return "".join(json.dumps(item) + "\n" for item in items).encode()
+
+
+class Routes:
+    """The routes of t-tweak, called through self._call (and the tweaks through self._tweak).
+
+    Shared by Client and AsyncClient: for the latter every method returns a coroutine.
+    """
+
+    # Tweaks (batched, with a batch_window)
+    def length(self, text):
+        """The length of text (as a str, like /length)."""
+        return self._tweak("length", text)
+
+    def reverse(self, text):
+        return self._tweak("reverse", text)
+
+    def upper(self, text):
+        return self._tweak("upper", text)
+
+    def tolower(self, text):
+        return self._tweak("tolower", text)
+
+    def mix_case(self, text):
+        return self._tweak("mix_case", text)
+
+    def batch(self, op, items):
+        """op (one of TWEAKS) applied to each of items, with one POST /batch."""
+        return self._call("POST", "/batch", json={"op": op, "items": list(items)})
+
+    def batch_stream(self, op, items):
+        """As batch, through POST /batch/stream (NDJSON): no limit on the number of items."""
+        body = ndjson_body(items)
+        params = {"op": op}
+        return self._call("POST", "/batch/stream", params=params, content=body, parse=as_ndjson)
+
+    def stream(self, op, text):
+        """op applied to a text of any size (POST /stream/{op}): a str, or an int for length."""
+        parse = as_res if op == "length" else as_text
+        return self._call("POST", f"/stream/{segment(op)}", content=text.encode(), parse=parse)
+
+    # Strings
+    def find(self, string, sub):
+        """Where sub starts in string (overlapping ones too)."""
+        return self._call("GET", f"/find/{segment(string)}/{segment(sub)}")
+
+    def find_many(self, haystack, needles):
+        """{needle: [where it starts in haystack]} for each of needles."""
+        body = {"haystack": haystack, "needles": list(needles)}
+        return self._call("POST", "/find_many", json=body)
+
+    def substring(self, string, start, end):
+        return self._call("GET", f"/substring/{segment(string)}/{start}/{end}")
+
+    def password(self, password):
+        """The strength of password, from 0 to 10."""
+        return self._call("GET", f"/password/{segment(password)}")
+
+    def password_bulk(self, passwords):
+        """The strength of each of passwords (POST /password/bulk)."""
+        body = ndjson_body(passwords)
+        return self._call("POST", "/password/bulk", content=body, parse=as_ndjson)
+
+    def counterstring(self, length, char="*"):
+        return self._call("GET", f"/counterstring/{length}/{segment(char)}")
+
+    def counterstring_stream(self, length, char="*"):
+        path = f"/counterstring/stream/{length}/{segment(char)}"
+        return self._call("GET", path, parse=as_text)
+
+    def random(self, length, seed=None):
+        """A random string: the next of the session's stream, or of its own with a seed."""
+        return self._call("GET", "/random", params=params_of(length=length, seed=seed))
+
+    def random_bulk(self, count, length, seed=None):
+        """count random strings of length characters, as a list."""
+        params = params_of(count=count, length=length, seed=seed)
+        return self._call("GET", "/random/bulk", params=params, parse=as_lines)
+
+    # Words
+    def anagrams(self, text, dict=None):
+        """The words of the dictionary (words, or dict) with the letters of text."""
+        params = params_of(dict=dict)
+        return self._call("GET", f"/anagrams/{segment(text)}", params=params)
+
+    def subanagrams(self, letters, page=0, size=50):
+        """{"res": a page of the words made with some of letters, "total": all found}."""
+        path = f"/subanagrams/{segment(letters)}"
+        return self._call("GET", path, params={"page": page, "size": size}, parse=as_json)
+
+    def wildcard(self, pattern, page=0, size=50):
+        """{"res": a page of the words matching pattern ("?" any letter, "*" any), "total"}."""
+        path = f"/wildcard/{segment(pattern)}"
+        return self._call("GET", path, params={"page": page, "size": size}, parse=as_json)
+
+    def suggest(self, text, k=2, limit=10, dict=None):
+        """The words within k edits of text, the closest first."""
+        params = params_of(k=k, limit=limit, dict=dict)
+        return self._call("GET", f"/suggest/{segment(text)}", params=params)
+
+    # Storage and server
+    def storage(self, command, index=None):
+        """A command of the storage machine of this client's session."""
+        params = params_of(index=index)
+        return self._call("GET", f"/storage/{segment(command)}", params=params, idempotent=False)
+
+    def reset_server(self):
+        return self._call("GET", "/reset_server", idempotent=False)
+
+    def count(self):
+        """The number of tweaks served."""
+        return self._call("GET", "/count/all")
+
+    def history(self, page=0, size=50):
+        return self._call("GET", "/history", params={"page": page, "size": size}, parse=as_json)
+
+    def metrics(self):
+        """The metrics, in the Prometheus text format."""
+        return self._call("GET", "/metrics", parse=as_text)
+
+    def cache_stats(self):
+        return self._call("GET", "/cache/stats")
+
+    def dictionary_stats(self):
+        return self._call("GET", "/dictionaries/stats")
+
+    def admission_stats(self):
+        return self._call("GET", "/admission/stats")
+
+
+class Base(Routes):
+    """What Client and AsyncClient share: their settings, and when to send a call again."""
+
+    http_class = None
+
+    def __init__(
+        self,
+        base_url="http://127.0.0.1:8000",
+        max_connections=16,
+        timeout=10.0,
+        retries=3,
+        backoff=0.05,
+        max_wait=10.0,
+        batch_window=None,
+        batch_size=100,
+        transport=None,
+    ):
+        limits = httpx.Limits(
+            max_connections=max_connections, max_keepalive_connections=max_connections
+        )
+        self.http = self.http_class(
+            base_url=base_url, limits=limits, timeout=timeout, transport=transport
+        )
+        self.retries = retries
+        self.backoff = backoff
+        self.max_wait = max_wait
+        self.batch_window = batch_window
+        self.batch_size = batch_size
+        # Calls made, and the HTTP requests they took (retries and batches included)
+        self.calls = self.sent = 0
+        # {op: [(text, future)]}, the texts of the next batch of each tweak
+        self._pending = {}
+
+    def _wait(self, attempt, idempotent, response=None, error=None):
+        """The seconds to wait before sending a call again: raises Error if it isn't."""
+        last = attempt == self.retries
+        if error is not None:
+            # A call that could not connect was not sent at all
+            if last or not (isinstance(error, httpx.ConnectError) or idempotent):
+                raise Error(0, str(error)) from error
+            return self.backoff * 2**attempt
+        status = response.status_code
+        if last or not (status in RETRY_STATUSES or (idempotent and status >= 500)):
+            raise Error(status, detail_of(response))
+        wait = retry_after(response, self.max_wait)
+        return self.backoff * 2**attempt if wait is None else wait
+
+    def _take(self, op, text, future):
+        """Adds text to the next batch of op: (that batch, whether it is full). A full batch
+        is no longer pending, and is sent at once; the others batch_window after their first
+        text was added."""
+        batch = self._pending.setdefault(op, [])
+        batch.append((text, future))
+        full = len(batch) >= self.batch_size
+        if full:
+            del self._pending[op]
+        return batch, full
+
+    def _done(self, batch, found):
+        for (_, future), result in zip(batch, found):
+            # A caller that was cancelled (asyncio) has no one to hear its result
+            if not future.done():
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+
+class Client(Base):
+    """The routes of t-tweak at base_url, as plain calls. See the module's docstring."""
+
+    http_class = httpx.Client
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for op, batch in list(self._pending.items()):
+            self._flush(op, batch)
+        self.http.close()
+
+    def _call(self, *args, **kwargs):
+        with self._lock:
+            self.calls += 1
+        return self._request(*args, **kwargs)
+
+    def _request(self, method, path, params=None, json=None, content=None, parse=as_res,
+                 idempotent=True):
+        for attempt in range(self.retries + 1):
+            with self._lock:
+                self.sent += 1
+            try:
+                response = self.http.request(
+                    method, path, params=params, json=json, content=content
+                )
+            except httpx.TransportError as e:
+                time.sleep(self._wait(attempt, idempotent, error=e))
+                continue
+            if response.status_code < 400:
+                return parse(response)
+            time.sleep(self._wait(attempt, idempotent, response=response))
+
+    def _tweak(self, op, text):
+        if not self.batch_window:
+            return self._call("GET", f"/{op}/{segment(text)}")
+        return self.submit(op, text).result()
+
+    def submit(self, op, text):
+        """Adds text to the next batch of op (one of TWEAKS): a concurrent.futures.Future of
+        its result. Needs a batch_window. Many submits, and then their results, batch the
+        calls of a single thread."""
+        future = concurrent.futures.Future()
+        with self._lock:
+            self.calls += 1
+            batch, full = self._take(op, text, future)
+            first = len(batch) == 1
+        if full:
+            self._send(op, batch)
+        elif first:
+            timer = threading.Timer(self.batch_window, self._flush, (op, batch))
+            timer.daemon = True
+            timer.start()
+        return future
+
+    def _flush(self, op, batch):
+        with self._lock:
+            if self._pending.get(op) is not batch:
+                # Sent already, when it was full
+                return
+            del self._pending[op]
+        self._send(op, batch)
+
+    def _send(self, op, batch):
+        texts = [text for text, _ in batch]
+        try:
+            found = self._request("POST", "/batch", json={"op": op, "items": texts})
+        except Exception as e:
+            if not (isinstance(e, Error) and e.status == 422 and len(batch) > 1):
+                found = [e] * len(batch)
+            else:
+                # A text can't be tweaked: each on its own, for its own result or error
+                found = []
+                for text in texts:
+                    try:
+                        found.append(self._request("GET", f"/{op}/{segment(text)}"))
+                    except Exception as e:
+                        found.append(e)
+        self._done(batch, found)
+
+
+class AsyncClient(Base):
+    """The routes of t-tweak at base_url, to await. See the module's docstring."""
+
+    http_class = httpx.AsyncClient
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # The batches being sent: kept, so that their tasks are not collected before they end
+        self._sending = set()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        for op, batch in list(self._pending.items()):
+            self._flush(op, batch)
+        await asyncio.gather(*self._sending)
+        await self.http.aclose()
+
+    def _call(self, *args, **kwargs):
+        # Only counted on the event loop: no lock
+        self.calls += 1
+        return self._request(*args, **kwargs)
+
+    async def _request(self, method, path, params=None, json=None, content=None, parse=as_res,
+                       idempotent=True):
+        for attempt in range(self.retries + 1):
+            self.sent += 1
+            try:
+                response = await self.http.request(
+                    method, path, params=params, json=json, content=content
+                )
+            except httpx.TransportError as e:
+                await asyncio.sleep(self._wait(attempt, idempotent, error=e))
+                continue
+            if response.status_code < 400:
+                return parse(response)
+            await asyncio.sleep(self._wait(attempt, idempotent, response=response))
+
+    async def _tweak(self, op, text):
+        if not self.batch_window:
+            return await self._call("GET", f"/{op}/{segment(text)}")
+        self.calls += 1
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch, full = self._take(op, text, future)
+        if full:
+            self._start(op, batch)
+        elif len(batch) == 1:
+            loop.call_later(self.batch_window, self._flush, op, batch)
+        return await future
+
+    def _flush(self, op, batch):
+        if self._pending.get(op) is batch:
+            del self._pending[op]
+            self._start(op, batch)
+
+    def _start(self, op, batch):
+        task = asyncio.ensure_future(self._send(op, batch))
+        self._sending.add(task)
+        task.add_done_callback(self._sending.discard)
+
+    async def _send(self, op, batch):
+        texts = [text for text, _ in batch]
+        try:
+            found = await self._request("POST", "/batch", json={"op": op, "items": texts})
+        except Exception as e:
+            if not (isinstance(e, Error) and e.status == 422 and len(batch) > 1):
+                found = [e] * len(batch)
+            else:
+                found = []
+                for text in texts:
+                    try:
+                        found.append(await self._request("GET", f"/{op}/{segment(text)}"))
+                    except Exception as e:
+                        found.append(e)
+        self._done(batch, found)
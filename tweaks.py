@@ -0,0 +1,86 @@
+""" The text tweaks themselves, without the web server around them.
+
+The REST functions in main validate the input, log the call and wrap these results in a
+    response. Keeping the tweaks here lets single calls and batches share the same logic.
+"""
+
+from array import array
+
+
+def length(text):
+    return str(len(text))
+
+
+def reverse(text):
+    return text[::-1]
+
+
+def upper(text):
+    return text.upper()
+
+
+def lower(text):
+    return text.lower()
+
+
+def mix_case(text, start=0):
+    """Alternates lower and upper case. start is the index of text[0] in a longer text."""
+    if text.isascii():
+        # Same result without a string per character: case the odd (or even) half at once
+        odd = (start + 1) % 2
+        chars = bytearray(text.lower(), "ascii")
+        chars[odd::2] = text[odd::2].upper().encode("ascii")
+        return chars.decode("ascii")
+    return "".join([l.upper() if i % 2 else l.lower() for i, l in enumerate(text, start)])
+
+
+def counterstring(length, char):
+    """A string of the given length where each mark (char) is preceded by its own position.
+
+    Same output as the algorithm in https://github.com/deefex/pyclip (which builds the string
+        backwards and reverses it at the end), but each piece is reversed on its own and all
+        are joined once, in linear time.
+    """
+    parts = []
+    while length > 0:
+        part = char + str(length)[::-1]
+        if len(part) > length:
+            part = part[:length]
+        parts.append(part[::-1])
+        length -= len(part)
+    parts.reverse()
+    return "".join(parts)
+
+
+def counterstring_chunks(length, char, chunk_size=1 << 16):
+    """Generates counterstring(length, char) in chunks of about chunk_size characters.
+
+    Only the position of each piece is kept (8 bytes per piece), never the whole string.
+    """
+    ends = array("q")
+    while length > 0:
+        ends.append(length)
+        length -= min(len(char) + len(str(length)), length)
+
+    chunk = []
+    size = 0
+    for end in reversed(ends):
+        part = (char + str(end)[::-1])[:end][::-1]
+        chunk.append(part)
+        size += len(part)
+        if size >= chunk_size:
+            yield "".join(chunk)
+            chunk = []
+            size = 0
+    if chunk:
+        yield "".join(chunk)
+
+
+# Each tweak with the longest text its REST function accepts (None: no limit)
+operations = {
+    "length": (length, 100),
+    "reverse": (reverse, 100),
+    "upper": (upper, None),
+    "tolower": (lower, 100),
+    "mix_case": (mix_case, 100),
+}
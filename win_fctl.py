@@ -1,6 +1,7 @@
 """ Fake module to fake fcntl in Windows OS. Opens a very small risk of concomitant file access. """
 
 LOCK_EX = "lock exclusively"
+LOCK_SH = "lock shared"
 LOCK_UN = "lock unlock"
 
 
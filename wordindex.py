@@ -0,0 +1,149 @@
+""" A compact, read-only index from string keys to lists of strings, stored in a single file.
+
+The file is built once (see write_index) and then opened with mmap, so every process that
+    reads it shares the same pages and nothing is parsed or copied per process or per request.
+
+Layout (all integers are unsigned 32 bits, in the byte order recorded in the header):
+    header          magic, byte order, number of keys, number of values, and a 16-byte tag
+                    the writer chose (words.py puts a digest of the source there)
+    key_offsets     n_keys + 1 offsets into the key blob
+    value_starts    n_keys + 1 positions in value_offsets where each key's values start
+    value_offsets   n_values + 1 offsets into the value blob
+    key blob        all keys, utf-8, sorted by their utf-8 bytes
+    value blob      all values, utf-8, grouped by key
+"""
+
+import os
+import sys
+import mmap
+import struct
+from array import array
+
+MAGIC = b"TTIDX002"
+HEADER = struct.Struct("<8s4sII16s")
+BYTE_ORDER = sys.byteorder[:1].encode() * 4
+
+
+def pack_index(mapping, tag=bytes(16)):
+    """Packs a {key: [values]} mapping into the bytes of an index."""
+    keys = sorted(mapping, key=lambda k: k.encode("utf-8"))
+
+    key_offsets = array("I", [0])
+    value_starts = array("I", [0])
+    value_offsets = array("I", [0])
+    key_blob = bytearray()
+    value_blob = bytearray()
+
+    for key in keys:
+        key_blob += key.encode("utf-8")
+        key_offsets.append(len(key_blob))
+        for value in mapping[key]:
+            value_blob += value.encode("utf-8")
+            value_offsets.append(len(value_blob))
+        value_starts.append(len(value_offsets) - 1)
+
+    return b"".join(
+        [
+            HEADER.pack(MAGIC, BYTE_ORDER, len(keys), len(value_offsets) - 1, tag),
+            key_offsets.tobytes(),
+            value_starts.tobytes(),
+            value_offsets.tobytes(),
+            key_blob,
+            value_blob,
+        ]
+    )
+
+
+def write_index(path, mapping, tag=bytes(16)):
+    """Writes a {key: [values]} mapping to path. The file is replaced atomically."""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(pack_index(mapping, tag))
+    os.replace(tmp, path)
+
+
+class PackedIndex:
+    """Looks up keys in a file written by write_index, by binary search over the mmap'd keys."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._attach(memoryview(self._map))
+
+    @classmethod
+    def from_buffer(cls, buf, name="<buffer>"):
+        """Reads an index from any buffer that holds pack_index bytes (e.g. shared memory)."""
+        index = cls.__new__(cls)
+        index.path = name
+        index._map = buf
+        index._attach(memoryview(buf).toreadonly())
+        return index
+
+    def _attach(self, buf):
+        if len(buf) < HEADER.size:
+            raise ValueError(f"{self.path} is not a t-tweak index")
+        magic, order, n_keys, n_values, self.tag = HEADER.unpack_from(buf, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not a t-tweak index")
+        if order != BYTE_ORDER:
+            raise ValueError(f"{self.path} was built on another platform, rebuild it")
+
+        pos = HEADER.size
+        self._key_offsets = buf[pos : pos + 4 * (n_keys + 1)].cast("I")
+        pos += 4 * (n_keys + 1)
+        self._value_starts = buf[pos : pos + 4 * (n_keys + 1)].cast("I")
+        pos += 4 * (n_keys + 1)
+        self._value_offsets = buf[pos : pos + 4 * (n_values + 1)].cast("I")
+        pos += 4 * (n_values + 1)
+        self._keys = buf[pos : pos + self._key_offsets[n_keys]]
+        pos += self._key_offsets[n_keys]
+        self._values = buf[pos : pos + self._value_offsets[n_values]]
+        self._n_keys = n_keys
+        self._n_values = n_values
+        self.nbytes = len(buf)
+
+    def __len__(self):
+        return self._n_keys
+
+    def __contains__(self, key):
+        return self._find(key.encode("utf-8")) >= 0
+
+    def _key(self, i):
+        return bytes(self._keys[self._key_offsets[i] : self._key_offsets[i + 1]])
+
+    def _find(self, key):
+        lo, hi = 0, self._n_keys
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._n_keys and self._key(lo) == key:
+            return lo
+        return -1
+
+    def get(self, key, default=None):
+        """Returns a new list with the values of key, or default if the key is not indexed."""
+        i = self._find(key.encode("utf-8"))
+        if i < 0:
+            return default
+        offsets = self._value_offsets
+        values = self._values
+        return [
+            str(values[offsets[v] : offsets[v + 1]], "utf-8")
+            for v in range(self._value_starts[i], self._value_starts[i + 1])
+        ]
+
+    def values(self):
+        """A new list with the values of all the keys, in key order."""
+        offsets = self._value_offsets
+        values = self._values
+        return [str(values[offsets[v] : offsets[v + 1]], "utf-8") for v in range(self._n_values)]
+
+    def items(self):
+        """Iterates over all (key, values) pairs, in key order."""
+        for i in range(self._n_keys):
+            key = str(self._key(i), "utf-8")
+            yield key, self.get(key)
@@ -1,22 +1,129 @@
-""" Reformats the Linux word dictionary into a hash of anagrams. """
+""" Reformats the Linux word dictionary into a hash of anagrams.
 
-words = {}
+The dictionary is normalized once and written to a packed index (see wordindex.py), which
+    the server opens with mmap. The index ships with the code, so that a cold start (on
+    Vercel, every new instance) only has to open it. Rebuild it whenever words.txt changes:
 
+    python words.py
 
-with open("words.txt", "r") as d:
-    all_words = d.readlines()
+The index records a digest of the words.txt it was built from: an index that doesn't match
+    its source is rebuilt when opened, whatever the dates of the files say.
 
-all_words = [word.lower().strip() for word in all_words]
-all_words = [word.replace("'", "") for word in all_words]
-all_words = list(set(all_words))
+With several worker processes, the server can also be started by serve.py, which builds the
+    index once into shared memory (publish_shared) for all the workers to read (attach_shared).
 
-for w in all_words:
-    key = "".join(sorted(w))
-    anagrams = words.get(key, None)
-    if anagrams:
-        if w != words[key]:
-            anagrams.append(w)
-    else:
-        anagrams = [w]
+"words.words" still gives the whole table as a dict, but it is only built when first used.
+"""
 
-    words.update({key: anagrams})
+import os
+import hashlib
+
+import wordindex
+
+source = "words.txt"
+index_file = "words.idx"
+
+
+def load_words(path=source):
+    """Reads a word list and normalizes it: lower case, no apostrophes, no duplicates."""
+    with open(path, "r") as d:
+        all_words = d.readlines()
+
+    all_words = [word.lower().strip() for word in all_words]
+    all_words = [word.replace("'", "") for word in all_words]
+    return sorted(set(all_words))
+
+
+def anagram_key(text):
+    return "".join(sorted(text))
+
+
+def build_anagrams(all_words):
+    anagrams = {}
+    for w in all_words:
+        anagrams.setdefault(anagram_key(w), []).append(w)
+    return anagrams
+
+
+def source_tag(src=source):
+    with open(src, "rb") as d:
+        return hashlib.blake2b(d.read(), digest_size=16).digest()
+
+
+def build_index(src=source, dst=index_file):
+    wordindex.write_index(dst, build_anagrams(load_words(src)), source_tag(src))
+
+
+def is_current(path=index_file, src=source):
+    """Whether the index at path was built from src as it is now.
+
+    The digest of src is only checked when the index is older than src (as after a checkout).
+    """
+    try:
+        index = wordindex.PackedIndex(path)
+    except (FileNotFoundError, ValueError):
+        return False
+    return os.path.getmtime(path) >= os.path.getmtime(src) or index.tag == source_tag(src)
+
+
+def open_index(path=index_file, src=source):
+    """Opens the anagram index, (re)building it first if it is missing or not built from src."""
+    if not is_current(path, src):
+        build_index(src, path)
+    return wordindex.PackedIndex(path)
+
+
+_published = set()
+
+
+def publish_shared(name, src=source):
+    """Builds the index into a new shared memory block. The caller unlinks it when done."""
+    from multiprocessing import shared_memory
+
+    data = wordindex.pack_index(build_anagrams(load_words(src)), source_tag(src))
+    shm = shared_memory.SharedMemory(name=name, create=True, size=len(data))
+    shm.buf[: len(data)] = data
+    _published.add(name)
+    return shm
+
+
+def attach_shared(name):
+    """Opens the index that publish_shared built, without copying it."""
+    from multiprocessing import shared_memory
+
+    try:
+        shm = shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13 every process that attaches also unlinks the block when it exits
+        from multiprocessing import resource_tracker
+
+        shm = shared_memory.SharedMemory(name=name)
+        if name not in _published:
+            resource_tracker.unregister(shm._name, "shared_memory")
+    index = wordindex.PackedIndex.from_buffer(shm.buf, name)
+    index.shm = shm
+    return index
+
+
+def __getattr__(name):
+    if name == "words":
+        global words
+        words = build_anagrams(load_words())
+        return words
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+if __name__ == "__main__":
+    # python words.py [source] [index] [suggestions]
+    import sys
+
+    src, dst = (sys.argv[1:] + [source, index_file][len(sys.argv) - 1 :])[:2]
+    build_index(src, dst)
+    index = wordindex.PackedIndex(dst)
+    print(f"{dst}: {len(index)} keys")
+    if len(sys.argv) > 3:
+        # The spelling suggestions of the same words (see suggest.py)
+        import suggest
+
+        suggest.build_suggest(index, sys.argv[3])
+        print(f"{sys.argv[3]}: {len(suggest.SuggestIndex(sys.argv[3]))} words")
@@ -0,0 +1,115 @@
+""" Word searches over the dictionary beyond exact anagrams.
+
+LetterIndex answers "all the words that can be formed with these letters" (sub-anagrams, as
+    in Scrabble). Every word is a row of 26 letter counts in a NumPy matrix, and a query is a
+    single vectorized comparison of the whole matrix against the counts of the letters given.
+
+PatternIndex answers patterns where "?" is any one letter and "*" any number of letters. The
+    words are kept sorted, which makes the list an implicit trie: the words under a prefix
+    are a contiguous range, found by bisection. A query walks that trie for the literal part
+    of the pattern, from the start or, when the pattern's end is more selective, over the
+    reversed words from the end, and only checks the words left in range against the rest.
+"""
+
+import re
+from bisect import bisect_left
+from collections import Counter
+
+import numpy as np
+
+LETTERS = "abcdefghijklmnopqrstuvwxyz"
+
+
+def letter_counts(text):
+    return np.array([text.count(l) for l in LETTERS], dtype=np.uint8)
+
+
+class LetterIndex:
+    def __init__(self, words):
+        # Longest words first, then alphabetical: the order the results come out in
+        words = sorted((w for w in words if w), key=lambda w: (-len(w), w))
+        plain = [w for w in words if w.isascii() and w.isalpha()]
+        self.words = np.array(plain, dtype=object)
+        self.lengths = np.fromiter(map(len, plain), dtype=np.int64, count=len(plain))
+
+        width = int(self.lengths.max(initial=0))
+        chars = b"".join(w.encode().ljust(width, b"\0") for w in plain)
+        chars = np.frombuffer(chars, dtype=np.uint8).reshape(len(plain), width)
+        self.counts = np.stack([(chars == ord(l)).sum(axis=1) for l in LETTERS], axis=1)
+        self.counts = self.counts.astype(np.uint8)
+
+        # The few words with other letters (é, ö...) are checked one by one
+        self.others = [(w, Counter(w)) for w in words if not (w.isascii() and w.isalpha())]
+        self._order = {w: i for i, w in enumerate(words)}
+
+    def sub_anagrams(self, letters):
+        """All the words made only of the letters given, each letter used at most as many times."""
+        letters = letters.lower()
+        found = (self.counts <= letter_counts(letters)).all(axis=1) & (self.lengths <= len(letters))
+        res = self.words[found].tolist()
+
+        available = Counter(letters)
+        others = [w for w, need in self.others if not need - available]
+        if others:
+            res = sorted(res + others, key=self._order.__getitem__)
+        return res
+
+
+class PatternIndex:
+    def __init__(self, words):
+        self.forward = sorted(w for w in words if w)
+        self.backward = sorted(w[::-1] for w in self.forward)
+
+    @staticmethod
+    def _walk(words, pattern):
+        """Returns the (lo, hi) ranges of words matching pattern up to its first "*"."""
+        head = pattern.split("*", 1)[0]
+        ranges = [(0, len(words))]
+        for depth, ch in enumerate(head):
+            narrowed = []
+            for lo, hi in ranges:
+                prefix = words[lo][:depth]
+                # Words that are exactly the prefix sort first, and have no letter at depth
+                if lo < hi and len(words[lo]) == depth:
+                    lo += 1
+                if ch != "?":
+                    start = bisect_left(words, prefix + ch, lo, hi)
+                    end = bisect_left(words, prefix + chr(ord(ch) + 1), start, hi)
+                    if start < end:
+                        narrowed.append((start, end))
+                    continue
+                while lo < hi:
+                    letter = words[lo][depth]
+                    end = bisect_left(words, prefix + chr(ord(letter) + 1), lo, hi)
+                    narrowed.append((lo, end))
+                    lo = end
+            ranges = narrowed
+        return ranges
+
+    def match(self, pattern):
+        """All the words that match pattern ("?": one letter, "*": any letters), sorted."""
+        pattern = pattern.lower()
+        head = pattern.split("*", 1)[0]
+        tail = pattern.rsplit("*", 1)[-1]
+        backwards = len(tail.replace("?", "")) > len(head.replace("?", ""))
+
+        words = self.backward if backwards else self.forward
+        if backwards:
+            pattern = pattern[::-1]
+        head = pattern.split("*", 1)[0]
+        rest = re.compile(
+            "".join(
+                ".*" if c == "*" else "." if c == "?" else re.escape(c)
+                for c in pattern[len(head) :]
+            ),
+            re.S,
+        )
+
+        res = []
+        for lo, hi in self._walk(words, pattern):
+            for w in words[lo:hi]:
+                if rest.fullmatch(w, len(head)):
+                    res.append(w)
+        if backwards:
+            res = [w[::-1] for w in res]
+        return sorted(res)
@@ -0,0 +1,128 @@
+""" Writes the log and the history in the background, off the request path.
+
+Requests only touch memory: log lines and history entries are queued, and a single thread
+    drains the queues in batches, appending them to their logs every few hundred milliseconds
+    (and at exit). The count is not kept here: it is shared by all workers, see counter.py.
+
+The log and the history are each a segmented log (see logstore.py), shared by all workers:
+    appending costs the same however much is kept, and how much is kept is set by the
+    retention of the segments. The history is read back from its log, with the entries
+    still queued by this process added at the end.
+"""
+
+import atexit
+import datetime
+import threading
+from collections import deque
+
+from logstore import SegmentedLog
+
+
+class LogWriter:
+    def __init__(
+        self,
+        log_dir,
+        hist_dir,
+        hist_lines=50,
+        interval=0.5,
+        ring_size=4096,
+        log_file=None,
+        hist_file=None,
+        **retention,
+    ):
+        self.log_store = SegmentedLog(log_dir, **retention)
+        self.hist_store = SegmentedLog(hist_dir, **retention)
+        self.hist_lines = hist_lines
+        self.interval = interval
+        self.ring_size = ring_size
+        # Where the log and the history were kept before the segmented logs
+        self.log_file = log_file
+        self.hist_file = hist_file
+
+        self._lock = threading.Lock()
+        self._flushing = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._log = deque()
+        self._hist = deque()
+
+    def _enqueue(self, queue, item):
+        queue.append(item)
+        if len(self._log) + len(self._hist) >= self.ring_size:
+            self._wake.set()
+
+    def log(self, msg):
+        if msg:
+            self._enqueue(self._log, f"{datetime.datetime.now().strftime('%c')} {str(msg)}")
+
+    def history(self, new_string=None):
+        """Adds new_string to the history. Without it, returns the last hist_lines entries."""
+        if new_string:
+            with self._lock:
+                self._enqueue(self._hist, str(new_string))
+            return None
+        return self.tail(self.hist_lines)
+
+    def tail(self, last, page=0):
+        """The last entries of the history, page pages of them back, oldest first."""
+        skip = page * last
+        with self._flushing:
+            with self._lock:
+                queued = list(self._hist)
+            newest = queued[max(0, len(queued) - skip - last) : max(0, len(queued) - skip)]
+            try:
+                older = self.hist_store.tail(last - len(newest), max(0, skip - len(queued)))
+            except Exception:
+                # Silently fail in serverless environments where filesystem may be restricted
+                older = []
+        return older + newest
+
+    def reset(self):
+        """Empties the history (the log is left intact)."""
+        with self._flushing, self._lock:
+            self._hist.clear()
+            try:
+                self.hist_store.clear()
+            except Exception:
+                # Silently fail in serverless environments where filesystem may be restricted
+                pass
+
+    def flush(self):
+        """Writes out everything queued so far. Safe to call from any thread."""
+        with self._flushing:
+            self._flush()
+
+    def _flush(self):
+        logs = [self._log.popleft() for _ in range(len(self._log))]
+        with self._lock:
+            hist = [self._hist.popleft() for _ in range(len(self._hist))]
+
+        try:
+            self.log_store.append(logs)
+            self.hist_store.append(hist)
+        except Exception:
+            # Silently fail in serverless environments where filesystem may be restricted
+            pass
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+    def start(self):
+        """Starts the background thread (once) and flushes at interpreter exit. The entries
+        of log_file and hist_file are first imported into logs that have none yet."""
+        if self._thread is None:
+            for store, path in ((self.log_store, self.log_file), (self.hist_store, self.hist_file)):
+                if path:
+                    try:
+                        store.import_file(path)
+                    except Exception:
+                        # Silently fail in serverless environments where filesystem may be
+                        #   restricted
+                        pass
+            self._thread = threading.Thread(target=self._run, name="ttweak-writer", daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+        return self